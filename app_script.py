@@ -1,47 +1,142 @@
-from flask import Flask, render_template, request
-from bokeh.plotting import output_file
-import csv
+from flask import Flask, abort, g, jsonify, render_template, request
+from bokeh.embed import components
+from bokeh.resources import CDN
+import atexit
+import functools
+import io
 import os
+import time
+import uuid
 import sqlite3
 import networkx as nx
-from lib.account import Account
-from lib.functions import construct_account_graph, reduce_graph, return_account_page, get_network_graph, get_edge_weights
-from bokeh.io import save
+from lib.database import ACCOUNT_PAGE_SIZE, connect, get_connection, release_connections, initialise_database, parse_account_list, insert_account, upsert_account, import_csv, get_account_connections, get_account_names, get_account_store, get_candidate_counts, get_graph_accounts, get_graph_version, iter_graph_edges, remove_graph, remove_account, tenant_exists
+from lib.functions import construct_account_graph, count_links, select_accounts, filter_edges, return_account_page, get_network_graph, get_edge_weights_counts
+from lib.sparse import SCORING_MODES, get_edge_weights_store
+from lib.snapshot import load_snapshot, get_edge_weights_snapshot
+from lib.sketch import get_edge_weights_sketch
+from lib.layout import compute_plot_layout
+from lib.constants import AnalysisEngines, GraphLayoutTypes, JobStatus, LinkTypes, RenderModes, StorageBackends
+from lib.cache import AnalysisCache
+from lib.jobs import JobQueue, JobQueueFull
+from lib.instrumentation import count, counted, metrics, observe_recording, stage, start_profiler, start_recording, stop_profiler, stop_recording
+from lib.storage import get_storage
+from lib.ingest import INGEST_MAX_BYTES, NDJSON_MIMETYPES, IngestBuffer, IngestBufferFull, parse_account, parse_ndjson
 
 
 app = Flask(__name__, static_folder='static')
 
+# database connections are pooled, and returned to the pool at the end of each request
+app.teardown_appcontext(release_connections)
+
+# graphs are stored in one database file per tenant (files), or in one database file shared by every tenant (shared),
+# whose path can be set with STORAGE_LOCATION. The tenant of a request is read from the TENANT_HEADER header if one
+# is set (e.g. by an authenticating proxy), and is the client's IP address otherwise
+app.config['STORAGE'] = os.environ.get('STORAGE', StorageBackends.files.value)
+app.config['STORAGE_LOCATION'] = os.environ.get('STORAGE_LOCATION')
+app.config['TENANT_HEADER'] = os.environ.get('TENANT_HEADER', '')
+storage = get_storage(app.config['STORAGE'], app.config['STORAGE_LOCATION'])
+
+# cache of analysis results, shared by all requests handled by this process
+analysis_cache = AnalysisCache(max_entries=128, max_bytes=64 * 1024 * 1024)
+
+# cache of plot layouts, so that re-plotting a graph version with other settings skips the layout computation
+layout_cache = AnalysisCache(max_entries=32, max_bytes=64 * 1024 * 1024)
+
+# analyses that are not cached yet run in a pool of worker processes, and their status and
+# results are kept in a SQLite file so that the result page can poll for them
+app.config['ASYNC_JOBS'] = os.environ.get('ASYNC_JOBS', '1') == '1'
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_MAX_PENDING'] = int(os.environ.get('JOB_MAX_PENDING', 16))
+job_queue = JobQueue('database/jobs.db', max_workers=app.config['JOB_WORKERS'], max_pending=app.config['JOB_MAX_PENDING'])
+
+# accounts posted to /ingest are buffered in memory, and written in grouped transactions by a single writer thread;
+# posts wait up to INGEST_TIMEOUT seconds for room in a full buffer before they are refused, and bodies larger than
+# INGEST_MAX_BYTES are refused before they are read
+app.config['INGEST_BUFFER_SIZE'] = int(os.environ.get('INGEST_BUFFER_SIZE', 10000))
+app.config['INGEST_TIMEOUT'] = float(os.environ.get('INGEST_TIMEOUT', 1.0))
+app.config['INGEST_MAX_BYTES'] = int(os.environ.get('INGEST_MAX_BYTES', INGEST_MAX_BYTES))
+ingest_buffer = IngestBuffer(max_accounts=app.config['INGEST_BUFFER_SIZE'])
+atexit.register(ingest_buffer.close)
+
+# opt-in instrumentation: per-stage timings in a Server-Timing header, and aggregated metrics at /metrics
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '0') == '1'
+
+# opt-in profiling of single requests, with ?profile=cprofile (or pyinstrument) or an X-Profile header
+app.config['PROFILING'] = os.environ.get('PROFILING', '0') == '1'
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+
+
+@app.before_request
+def start_instrumentation() -> None:
+    """
+    Start recording the stage timings of a request (and profiling it, if requested) when
+    instrumentation is enabled.
+    """
+    if app.config.get('INSTRUMENTATION'):
+        g.request_start = time.perf_counter()
+        g.recording, g.recording_token = start_recording()
+
+    profile = request.args.get('profile') or request.headers.get('X-Profile')
+
+    if app.config.get('PROFILING') and profile:
+        g.profiler = start_profiler(profile)
+
+@app.after_request
+def finish_instrumentation(response):
+    """
+    Add the stage timings of a request to its Server-Timing header and to the metrics, and
+    save its profile (whose path is returned in the X-Profile-File header).
+    """
+    if 'profiler' in g:
+        response.headers['X-Profile-File'] = _save_profile(g.pop('profiler'))
+
+    if 'recording' in g:
+        duration = time.perf_counter() - g.request_start
+        recording = g.pop('recording')
+        observe_recording(recording)
+        metrics.observe('request_seconds', duration, endpoint=str(request.endpoint))
+        response.headers['Server-Timing'] = ', '.join(v for v in [recording.server_timing(), 'total;dur=' + format(duration * 1000, '.1f')] if v)
+
+    return response
+
+@app.teardown_request
+def stop_instrumentation(exception: BaseException=None) -> None:
+    """
+    Stop the recording of a request, and save the profile of a request that raised an exception.
+    """
+    if 'recording_token' in g:
+        stop_recording(g.pop('recording_token'))
+
+    if 'profiler' in g:
+        _save_profile(g.pop('profiler'))
+
+def _save_profile(profiler) -> str:
+    """
+    Save the profile of the current request to the profile directory, and return its path.
+    """
+    name = time.strftime('%Y%m%d-%H%M%S') + '-' + str(request.endpoint) + '-' + uuid.uuid4().hex[:8]
+
+    return stop_profiler(profiler, app.config['PROFILE_DIR'], name)
+
 
 @app.route('/', methods=['GET', 'POST'])
 def index() -> render_template:
     """
     Index function to deliver the homepage upon connection to the host URL. This function also handles the 
-    creation of an initial database file if none is already present.
-    """
-    # get user IP address
-    user_ip = str(request.remote_addr)
-    db_file = 'database/' + user_ip + 'database.db'
-
-    # check if database file exists: if not, create it
-    if os.path.isfile(db_file) != True:
-        conn = sqlite3.connect(db_file)
-        conn.execute("""CREATE TABLE connections (
-            graph text,
-            user text,
-            followers text,
-            following text
-        );""")
+    creation of an initial graph entry for a new tenant.
+    """
+    # create the schema, or migrate a database file that still uses the legacy 'connections' table
+    conn = get_connection(*_tenant_database())
+    initialise_database(conn)
 
+    if not tenant_exists(conn):
         # insert standard values as initial graph entry
-        values = ('graph', 'test', 'test', 'test')
-        conn.execute("INSERT INTO connections (graph, user, followers, following) VALUES " + str(values) + ";")
+        insert_account(conn, 'graph', 'test', ['test'], ['test'])
 
         # save the database to file
         conn.commit()
 
-    app.config['DATABASE'] = db_file
-
-    graph_list_first, graph_list, account_list_first, account_list = return_account_page(app)
+    graph_list_first, graph_list, account_list_first, account_list = return_account_page(conn)
 
     return render_template('add.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list)
 
@@ -53,20 +148,35 @@ def get_account_details() -> render_template:
     graph_name = request.form['graph_name']
     account_name = request.form['account_name_1']
 
-    try:
-        conn = sqlite3.connect(app.config['DATABASE'])
-        cursor = conn.execute("""SELECT * from connections where graph='""" + graph_name + """' and user='""" + account_name + """'""")
-        results = [row for row in cursor]
-        followers = results[0][2]
-        following = results[0][3]
-    except:
+    conn = get_connection(*_tenant_database())
+    connections = get_account_connections(conn, graph_name, account_name)
+
+    if connections is not None:
+        followers = ', '.join(connections[0])
+        following = ', '.join(connections[1])
+    else:
         followers = 'Empty'
         following = 'Empty'
     
-    _, graph_list, _, account_list = return_account_page(app)
+    _, graph_list, _, account_list = return_account_page(conn, graph_name)
 
     return render_template('add.html', graph_list_first=graph_name, graph_list=graph_list, account_list_first=account_name, account_list=account_list, followers=followers, following=following)
 
+@app.route('/search_accounts', methods=['GET'])
+def search_accounts() -> str:
+    """
+    Return, in json format, one page of the names of the accounts in a graph that start with the
+    text typed so far, for the type-ahead account search.
+    """
+    graph_name = request.args.get('graph', default='')
+    prefix = request.args.get('q', default='')
+    offset = max(request.args.get('offset', default=0, type=int), 0)
+    limit = min(max(request.args.get('limit', default=ACCOUNT_PAGE_SIZE, type=int), 0), ACCOUNT_PAGE_SIZE)
+
+    conn = get_connection(*_tenant_database())
+
+    return jsonify(get_account_names(conn, graph_name, prefix=prefix, offset=offset, limit=limit))
+
 @app.route('/delete_graph', methods=['GET', 'POST'])
 def delete_graph() -> render_template:
     """
@@ -74,13 +184,13 @@ def delete_graph() -> render_template:
     """
     graph_name = request.form['graph_name']
 
-    conn = sqlite3.connect(app.config['DATABASE'])
-    cursor = conn.execute("""DELETE from connections where graph='""" + graph_name + """'""")
+    conn = get_connection(*_tenant_database())
+    remove_graph(conn, graph_name)
 
     # save the database to file
     conn.commit()
 
-    graph_list_first, graph_list, account_list_first, account_list = return_account_page(app)
+    graph_list_first, graph_list, account_list_first, account_list = return_account_page(conn)
 
     return render_template('add.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list)
 
@@ -91,13 +201,13 @@ def delete_account() -> render_template:
     """
     account_name = request.form['account_name_1']
 
-    conn = sqlite3.connect(app.config['DATABASE'])
-    cursor = conn.execute("""DELETE from connections where user='""" + account_name + """'""")
+    conn = get_connection(*_tenant_database())
+    remove_account(conn, account_name)
 
     # save the database to file
     conn.commit()
 
-    graph_list_first, graph_list, account_list_first, account_list = return_account_page(app)
+    graph_list_first, graph_list, account_list_first, account_list = return_account_page(conn)
 
     return render_template('add.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list)
 
@@ -106,47 +216,251 @@ def analyze() -> render_template:
     """
     Connect to the database and perform a similarity analysis and mapping of the account
     in question. Return the results.html page with a graph of the account, and a list of 
-    recommended similar accounts, in csv format.
+    recommended similar accounts, in csv format. When background jobs are enabled, analyses
+    that are not cached yet run in the job queue, and the page loads their results once the
+    job has finished. Profiled requests always run the analysis themselves.
+    """
+    graph_name, cache_key, analysis_args = _read_analysis_form()
+    profiled = 'profiler' in g
+    cached_result = analysis_cache.get(cache_key) if not profiled else None
+
+    if cached_result is None and app.config.get('ASYNC_JOBS') and not profiled:
+        try:
+            job_id = job_queue.submit(cache_key, _analysis_job, *analysis_args)
+        except JobQueueFull as e:
+            return str(e), 429
+
+        job = job_queue.get(job_id)
+
+        if job['status'] != JobStatus.done.value:
+            return render_template('result.html', graph=graph_name, job_id=job_id, recommended_accounts='', scores=[], plot=None, plot_resources=CDN.render())
+
+        cached_result = job['result']
+        analysis_cache.put(cache_key, cached_result)
+
+    if cached_result is not None:
+        scores, plot = cached_result
+    else:
+        # the job arguments start with the database file and tenant, which are replaced by this request's connection
+        scores, plot = _run_analysis(get_connection(*analysis_args[:2]), *analysis_args[2:])
+        analysis_cache.put(cache_key, (scores, plot))
+
+    recommended_accounts = ', '.join([v[0] for v in scores])
+
+    # the plot is embedded in the response itself, so concurrent requests never share a plot file
+    with stage('render'):
+        return render_template('result.html', graph=graph_name, recommended_accounts=recommended_accounts, scores=scores, plot=plot, plot_resources=CDN.render())
+
+@app.route('/jobs', methods=['POST'])
+def submit_job() -> str:
+    """
+    Submit an analysis (with the same form fields as /analyze) to the job queue, and return
+    the id of its job in json format. Jobs for the same graph version and settings are
+    deduplicated, so the id of an existing job may be returned.
+    """
+    graph_name, cache_key, analysis_args = _read_analysis_form()
+
+    try:
+        job_id = job_queue.submit(cache_key, _analysis_job, *analysis_args)
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429
+
+    return jsonify({'job_id': job_id, 'status': job_queue.get(job_id)['status']}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id: str) -> str:
+    """
+    Return, in json format, the status of an analysis job, with its recommended accounts,
+    scores and plot components once it has finished. The results of a finished job are cached
+    under its key, so that /analyze does not submit the analysis again.
+    """
+    job = job_queue.get(job_id)
+
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+
+    response = {'job_id': job_id, 'status': job['status'], 'error': job['error']}
+
+    if job['status'] == JobStatus.done.value:
+        scores, plot = job['result']
+
+        if job['key'] is not None:
+            analysis_cache.put(job['key'], job['result'])
+
+        response.update(recommended_accounts=', '.join([v[0] for v in scores]), scores=scores, plot=plot)
+
+    return jsonify(response)
+
+
+def _read_analysis_form() -> (str, tuple, tuple):
+    """
+    Read the analysis settings from the submitted form, and return the graph name, the key
+    that its results are cached (and its jobs deduplicated) under, and the arguments of
+    _analysis_job.
     """
     graph_name = request.form['graphs']
     connection_type = request.form['connection_type']
     analysis_type = request.form['analysis_type']
     graph_type = request.form['graph_type']
+    threshold = request.form.get('threshold', default=1, type=int)
+    top_n = request.form.get('top_n', default=None, type=int)
+
+    if top_n is not None and top_n < 1:
+        abort(400, 'top_n must be at least 1.')
 
-    conn = sqlite3.connect(app.config['DATABASE'])
+    engine = request.form.get('engine', default=AnalysisEngines.networkx.value)
+    render_mode = request.form.get('render_mode', default=RenderModes.auto.value)
 
-    cursor = conn.execute("SELECT * from connections where graph='""" + graph_name + """'""")
+    db_file, tenant = _tenant_database()
+    conn = get_connection(db_file, tenant)
 
-    results = [row for row in cursor]
+    with stage('sql'):
+        graph_version = get_graph_version(conn, graph_name)
 
-    account_list = [Account(row[1], '', row[2].split(', '), row[3].split(', ')) for row in results]
+    # results are cached per tenant and graph version, so any write to the graph invalidates them
+    layout_key = (db_file, tenant, graph_name, connection_type, analysis_type, graph_type, threshold, top_n, graph_version)
+    cache_key = layout_key + (engine, render_mode)
 
-    major_accounts = [v.account_name for v in account_list]
+    return graph_name, cache_key, (db_file, tenant, graph_name, connection_type, analysis_type, graph_type, threshold, top_n, engine, render_mode, layout_key)
 
-    graph_edges = construct_account_graph(account_list, type=connection_type)
 
-    graph_edges = reduce_graph(graph_edges, major_accounts, mode=analysis_type)
+def _tenant_database() -> (str, str):
+    """
+    Return the database file and the tenant of the current request: the tenant is read from the
+    tenant header (when one is configured) or is the client's IP address, and the storage backend
+    maps it to a database file.
+    """
+    header = app.config.get('TENANT_HEADER')
+    tenant = (request.headers.get(header) if header else None) or str(request.remote_addr)
+
+    try:
+        return storage.locate(tenant)
+    except ValueError:
+        abort(400, 'Invalid tenant.')
+
+
+def _analysis_job(db_file: str, tenant: str, *args) -> (list, dict):
+    """
+    Run an analysis in a job queue worker process, with its own connection to the database
+    file, bound to the tenant (see _run_analysis for the other arguments).
+    """
+    conn = connect(db_file, tenant)
+
+    try:
+        return _run_analysis(conn, *args)
+    finally:
+        conn.close()
+
+
+def _run_analysis(conn: sqlite3.Connection, graph_name: str, connection_type: str, analysis_type: str, graph_type: str, threshold: int, top_n: int, engine: str, render_mode: str, layout_key: tuple) -> (list, dict):
+    """
+    Read a graph from the database, and compute its recommended accounts and (unless no plot is
+    requested) the script and div components used to embed its network plot in a page, drawn
+    with the given render mode. The plot layout is cached under layout_key.
+    """
+    with stage('sql'):
+        major_accounts = get_graph_accounts(conn, graph_name)
+
+    if analysis_type in SCORING_MODES:
+        # similarity scores are computed with sparse matrix operations, from the links of every account, and
+        # the plot shows the accounts they were computed for (as with the common analysis type)
+        if engine not in (AnalysisEngines.sparse.value, AnalysisEngines.snapshot.value):
+            engine = AnalysisEngines.sparse.value
+
+        reduce_mode = LinkTypes.common.value
+    else:
+        reduce_mode = analysis_type
+
+    if engine == AnalysisEngines.sketch.value and analysis_type != LinkTypes.common.value:
+        # only the most linked accounts can be found in fixed memory, so the other analysis types are exact
+        engine = AnalysisEngines.sparse.value
+
+    plot_requested = graph_type != GraphLayoutTypes.no_plot.value
+    networkx_engine = engine not in (AnalysisEngines.sparse.value, AnalysisEngines.index.value, AnalysisEngines.snapshot.value, AnalysisEngines.sketch.value)
+
+    if engine == AnalysisEngines.index.value:
+        # read the ranking from the candidate counts that are updated on every write, so that the edges
+        # only need to be read to draw a plot
+        with stage('sql'):
+            scores = get_candidate_counts(conn, graph_name, connection_type, mode=analysis_type, threshold=threshold, top_n=top_n, top_k=top_n)
+
+    if engine == AnalysisEngines.sparse.value:
+        # read the edges into an AccountStore, which interns the account names and keeps the links in integer
+        # buffers, and rank the accounts with sparse matrix operations, so that networkx is only needed to draw a plot
+        with stage('sql'):
+            store = get_account_store(conn, graph_name, (connection_type,))
+
+        with stage('rank'):
+            scores = get_edge_weights_store(store, connection_type, mode=analysis_type, threshold=threshold, top_n=top_n, top_k=top_n)
+
+    if engine == AnalysisEngines.snapshot.value:
+        # rank the accounts from a memory-mapped snapshot of the graph, which is only rebuilt when the graph
+        # version changes, and is shared through the page cache by every process that analyzes the graph
+        with stage('snapshot'):
+            snapshot = load_snapshot(conn, graph_name)
+
+        with stage('rank'):
+            scores = get_edge_weights_snapshot(snapshot, connection_type, mode=analysis_type, threshold=threshold, top_n=top_n, top_k=top_n)
+
+    if engine == AnalysisEngines.sketch.value:
+        # stream the edges from the cursor through a Count-Min sketch and a heavy hitters summary, so that memory
+        # use does not depend on the number of edges (the link counts are estimates, see lib.sketch)
+        with stage('rank'):
+            scores = get_edge_weights_sketch(iter_graph_edges(conn, graph_name, connection_type), major_accounts, threshold=threshold, top_k=top_n)
+
+    if plot_requested or networkx_engine:
+        if engine == AnalysisEngines.sparse.value:
+            read_edges = functools.partial(construct_account_graph, store, type=connection_type)
+        else:
+            # edges are stored one per row, so they are streamed from the cursor, without building a list of them
+            read_edges = functools.partial(iter_graph_edges, conn, graph_name, connection_type)
+
+        # the edges are read twice: once to count the links of each account, and once to add the edges of the
+        # selected accounts to the graph, so that only the counts and the reduced graph are ever held in memory
+        with stage('reduce'):
+            links, degrees = count_links(counted(read_edges(), 'analyzed_edges'), major_accounts)
+            selected_accounts = select_accounts(links, mode=reduce_mode, threshold=threshold, top_n=top_n)
+
+    if plot_requested:
+        with stage('graph'):
+            g = nx.Graph()
+            g.add_edges_from(filter_edges(read_edges(), selected_accounts))
 
-    g = nx.Graph()
-    g.add_edges_from(graph_edges)
+        count('graph_nodes', g.number_of_nodes())
+        count('graph_edges', g.number_of_edges())
 
-    #Create a plot — set dimensions, toolbar, and title
-    plot = get_network_graph(g, major_accounts, layout=graph_type)
+        positions = layout_cache.get(layout_key)
 
-    output_file('templates/bokeh_plot.html')
+        if positions is None:
+            with stage('layout'):
+                positions = compute_plot_layout(g, major_accounts, layout=graph_type)
 
-    save(plot)
+            layout_cache.put(layout_key, positions)
 
-    recommended_accounts = get_edge_weights(g, major_accounts)
-    recommended_accounts = ', '.join([v[0] for v in recommended_accounts])
+        #Create a plot — set dimensions, toolbar, and title
+        with stage('plot'):
+            plot = get_network_graph(g, major_accounts, layout=graph_type, positions=positions, render_mode=render_mode)
 
-    return render_template('result.html', graph=graph_name, recommended_accounts=recommended_accounts)
+        with stage('serialize'):
+            plot_script, plot_div = components(plot)
+
+        plot = {'script': plot_script, 'div': plot_div}
+    else:
+        plot = None
+
+    if networkx_engine:
+        # the degrees of the selected accounts are their degrees in the reduced graph, so no graph is built to rank them
+        with stage('rank'):
+            scores = get_edge_weights_counts(degrees, selected_accounts, top_k=top_n)
+
+    return scores, plot
 
 
 @app.route('/add_account', methods=['GET', 'POST'])
 def add_account() -> render_template:
     """
-    Connect to the database and add a specified account to the graph in question.
+    Connect to the database and add a specified account to the graph in question (or, in upsert
+    mode, update its follower and following accounts if the graph already holds it).
     """
     graph_name = request.form["graph_name_2"]
 
@@ -154,24 +468,85 @@ def add_account() -> render_template:
     followers = request.form['follower_accounts']
     following = request.form['following_accounts']
 
-    conn = sqlite3.connect(app.config['DATABASE'])
+    conn = get_connection(*_tenant_database())
 
-    values = (graph_name, account_name, followers, following)
-    conn.execute("INSERT INTO connections (graph, user, followers, following) VALUES " + str(values) + ";")
+    # in upsert mode, an account that is already in the graph is updated rather than added again
+    if request.form.get('upsert'):
+        upsert_account(conn, graph_name, account_name, parse_account_list(followers), parse_account_list(following))
+    else:
+        insert_account(conn, graph_name, account_name, parse_account_list(followers), parse_account_list(following))
 
     # save the database to file
     conn.commit()
 
-    graph_list_first, graph_list, account_list_first, account_list = return_account_page(app)
+    graph_list_first, graph_list, account_list_first, account_list = return_account_page(conn)
 
     return render_template('add.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list)
 
+@app.route('/ingest', methods=['POST'])
+def ingest() -> str:
+    """
+    Queue a batch of accounts, posted in json (a list of account objects) or ndjson format (one
+    account object per line), to be written to the client's graphs, and return the number of
+    accepted and rejected accounts in json format. The accounts are written shortly afterwards, in
+    transactions grouped with the accounts posted by other producers. When the ingestion buffer is
+    full, the whole batch is refused with a 429 status, so that producers back off and retry. With
+    ?mode=upsert, accounts that are already stored are updated rather than added again. Bodies
+    larger than INGEST_MAX_BYTES are refused with a 413 status before they are read.
+    """
+    db_file, tenant = _tenant_database()
+    max_bytes = app.config.get('INGEST_MAX_BYTES', INGEST_MAX_BYTES)
+
+    if request.content_length is not None and request.content_length > max_bytes:
+        return jsonify({'error': 'a batch cannot be larger than ' + str(max_bytes) + ' bytes'}), 413
+
+    if request.mimetype in NDJSON_MIMETYPES:
+        values = parse_ndjson(request.stream)
+    else:
+        values = request.get_json(silent=True)
+
+        if isinstance(values, dict):
+            values = [values]
+
+        if not isinstance(values, list):
+            return jsonify({'error': 'expected a json list of accounts, or one account per line in ndjson format'}), 400
+
+    rows, rejected = [], 0
+
+    for value in values:
+        row = parse_account(value)
+
+        if row is None:
+            rejected += 1
+        else:
+            rows.append(row)
+
+    try:
+        ingest_buffer.put(db_file, tenant, rows, timeout=app.config.get('INGEST_TIMEOUT', 0), upsert=request.args.get('mode') == 'upsert')
+    except IngestBufferFull as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '1'}
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+
+    return jsonify({'accepted': len(rows), 'rejected': rejected}), 202
+
+@app.route('/ingest', methods=['GET'])
+def ingest_status() -> str:
+    """
+    Return, in json format, the number of accounts waiting in the ingestion buffer, the numbers
+    of accounts and batches written so far, and the client's most recent accounts that could not
+    be written.
+    """
+    return jsonify(dict(ingest_buffer.stats(), failed_rows=ingest_buffer.failed_rows(*_tenant_database())))
+
 @app.route('/explore', methods=['POST'])
 def homepage() -> render_template:
     """
     Return to the homepage from the explore.html page.
     """
-    graph_list_first, graph_list, account_list_first, account_list = return_account_page(app)
+    conn = get_connection(*_tenant_database())
+
+    graph_list_first, graph_list, account_list_first, account_list = return_account_page(conn)
 
     return render_template('explore.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list)
 
@@ -180,40 +555,53 @@ def home() -> render_template:
     """
     Return to the homepage from the add.html page.
     """
-    graph_list_first, graph_list, account_list_first, account_list = return_account_page(app)
+    conn = get_connection(*_tenant_database())
+
+    graph_list_first, graph_list, account_list_first, account_list = return_account_page(conn)
 
     return render_template('add.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list)
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload() -> render_template:
     """
-    Upload, in bulk, the details of multiple accounts, from a csv file.
+    Upload, in bulk, the details of multiple accounts, from a csv file. In upsert mode, the
+    accounts that are already stored are updated, and unchanged accounts are skipped, so that a
+    graph can be re-imported from a new snapshot without duplicating its accounts.
     """
       # upload file flask
     f = request.files.get('file')
 
-    data = []
+    conn = get_connection(*_tenant_database())
+    initialise_database(conn)
 
-    with open(f.filename) as file:
-        csv_file = csv.reader(file)
-        for row in csv_file:
-            data.append(row)
+    # stream the uploaded file through the csv reader, rather than loading it into memory
+    start_time = time.perf_counter()
 
-    # get user IP address
-    user_ip = request.remote_addr
-    db_file = 'database/' + user_ip + 'database.db'
+    with stage('import'):
+        inserted, rejected = import_csv(conn, io.TextIOWrapper(f.stream, encoding='utf-8', newline=''), upsert=bool(request.form.get('upsert')))
 
-    conn = sqlite3.connect(db_file)
+    elapsed_time = time.perf_counter() - start_time
+    count('uploaded_rows', inserted)
+    count('rejected_rows', rejected)
 
-    for values in data:
-        conn.execute("INSERT INTO connections (graph, user, followers, following) VALUES " + str(tuple(values)) + ";")
+    upload_message = 'Uploaded ' + str(inserted) + ' accounts (' + str(int(inserted / max(elapsed_time, 1e-6))) + ' rows/sec), rejected ' + str(rejected) + ' rows.'
 
-    # save the database to file
-    conn.commit()
+    with stage('render'):
+        graph_list_first, graph_list, account_list_first, account_list = return_account_page(conn)
 
-    graph_list_first, graph_list, account_list_first, account_list = return_account_page(app)
+        return render_template('add.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list, upload_message=upload_message)
 
-    return render_template('add.html', graph_list_first=graph_list_first, graph_list=graph_list, account_list_first=account_list_first, account_list=account_list)
+@app.route('/metrics', methods=['GET'])
+def get_metrics() -> str:
+    """
+    Return the request and stage duration histograms, and the counters, of this process in the
+    Prometheus text format (when instrumentation is enabled). The stages of analyses run in the
+    job queue are included once the job has finished.
+    """
+    if not app.config.get('INSTRUMENTATION'):
+        return 'Instrumentation is disabled.', 404
+
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 if __name__ == '__main__':
     app.run(debug=True, host="0.0.0.0", port=int(os.environ.get("PORT", 8080)))
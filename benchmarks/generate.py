@@ -0,0 +1,116 @@
+import csv as _csv
+import numpy as _np
+import os as _os
+import sys as _sys
+import typing as _t
+
+
+cwd = _os.getcwd()
+
+# Add the parent directory to sys.path
+_sys.path.append(cwd)
+
+from lib.account import Account
+from lib.database import CSV_COLUMNS
+
+
+def generate_accounts(seeds: int=100, candidates: int=10000, edges: int=20000, exponent: float=2.1, random_seed: int=0) -> list:
+    """
+    Function to generate a synthetic social graph, as a list of seed (major) accounts whose follower and following
+    lists are drawn from a pool of candidate accounts. Both the number of links per seed account and the popularity
+    of the candidate accounts follow a power law (P(k) ~ k^-exponent), as in real follower networks: a few seed accounts
+    have most of the links, and a few candidate accounts are linked to by most of the seed accounts. The same arguments
+    always generate the same graph.
+
+    :param seeds: int (number of seed accounts)
+    :param candidates: int (number of candidate accounts)
+    :param edges: int (approximate number of links of each type, followers and following)
+    :param exponent: float (power law exponent, > 1)
+    :param random_seed: int
+    :return: list (of Account objects)
+    """
+    rng = _np.random.default_rng(random_seed)
+    seed_names = ['seed' + str(i) for i in range(seeds)]
+    candidate_names = _np.array(['account' + str(i) for i in range(candidates)], dtype=object)
+
+    # candidate popularity: the i-th most popular candidate is picked with a probability ~ (i + 1)^-(exponent - 1),
+    # the Zipf form of a power law degree distribution
+    popularity = _np.arange(1, candidates + 1, dtype=float) ** -(exponent - 1)
+    popularity /= popularity.sum()
+
+    accounts = []
+    links = {}
+
+    for type in ('followers', 'following'):
+        # number of links of each seed account: Pareto distributed, scaled to the requested total
+        degrees = rng.pareto(exponent - 1, seeds) + 1
+        degrees = _np.minimum(_np.maximum(_np.rint(degrees / degrees.sum() * edges), 1), candidates).astype(_np.int64)
+
+        links[type] = [candidate_names[_unique_choice(rng, popularity, k)].tolist() for k in degrees]
+
+    for i, account_name in enumerate(seed_names):
+        accounts.append(Account(account_name, None, links['followers'][i], links['following'][i]))
+
+    return accounts
+
+
+def generate_edges(seeds: int=160000, candidates: int=20000, edges: int=1600000, exponent: float=2.1, random_seed: int=0) -> list:
+    """
+    Function to generate the (seed account, linked account) pairs of a synthetic graph directly, with the same power law
+    degree distributions as generate_accounts, for graphs with many more seed accounts than generate_accounts can draw
+    in a reasonable time. A seed account can be linked to the same account more than once, as in a graph that holds
+    the same account twice. The same arguments always generate the same pairs.
+
+    :param seeds: int (number of seed accounts)
+    :param candidates: int (number of candidate accounts)
+    :param edges: int (approximate number of pairs)
+    :param exponent: float (power law exponent, > 1)
+    :param random_seed: int
+    :return: list (of (seed account, linked account) tuples)
+    """
+    rng = _np.random.default_rng(random_seed)
+    seed_names = _np.array(['seed' + str(i) for i in range(seeds)], dtype=object)
+    candidate_names = _np.array(['account' + str(i) for i in range(candidates)], dtype=object)
+
+    popularity = _np.arange(1, candidates + 1, dtype=float) ** -(exponent - 1)
+    popularity /= popularity.sum()
+
+    degrees = rng.pareto(exponent - 1, seeds) + 1
+    degrees = _np.maximum(_np.rint(degrees / degrees.sum() * edges), 1).astype(_np.int64)
+
+    users = _np.repeat(seed_names, degrees)
+    targets = candidate_names[rng.choice(candidates, size=len(users), p=popularity)]
+
+    return list(zip(users.tolist(), targets.tolist()))
+
+
+def write_csv(accounts: list, file: _t.TextIO, graph_name: str='graph') -> None:
+    """
+    Function to write accounts to a file in the csv format used for bulk uploads.
+
+    :param accounts: list
+    :param file: file object
+    :param graph_name: str
+    :return: None
+    """
+    writer = _csv.writer(file)
+    writer.writerow(CSV_COLUMNS)
+
+    for account in accounts:
+        writer.writerow([graph_name, account.account_name, ', '.join(account.follower_accounts), ', '.join(account.following_accounts)])
+
+
+def _unique_choice(rng: _np.random.Generator, probabilities: _np.ndarray, k: int) -> _np.ndarray:
+    """
+    Function to draw k distinct indices with the given probabilities, with the Gumbel top-k trick (the k largest
+    log(p) + Gumbel noise values), which costs O(N) however close k is to the size of the pool.
+
+    :param rng: np.random.Generator
+    :param probabilities: np.ndarray
+    :param k: int
+    :return: np.ndarray (in the order they were drawn)
+    """
+    keys = _np.log(probabilities) + rng.gumbel(size=len(probabilities))
+    selected = _np.argpartition(-keys, k - 1)[:k]
+
+    return selected[_np.argsort(-keys[selected])]
@@ -0,0 +1,308 @@
+import argparse as _argparse
+import io as _io
+import json as _json
+import networkx as nx
+import os as _os
+import platform as _platform
+import sys as _sys
+import tempfile as _tempfile
+import time as _time
+import tracemalloc as _tracemalloc
+import typing as _t
+
+
+cwd = _os.getcwd()
+
+# Add the parent directory to sys.path
+_sys.path.append(cwd)
+
+from benchmarks.generate import generate_accounts, generate_edges, write_csv
+from lib.constants import AccountAttributes, AnalysisEngines, GraphLayoutTypes, LinkTypes
+from lib.functions import construct_account_graph, count_links, reduce_graph, get_edge_weights, get_edge_weights_stream, get_similar_accounts, get_network_graph
+from lib.sketch import get_edge_weights_sketch
+
+# sizes of the synthetic graphs (see generate_accounts)
+SIZES = {
+    'small': {'seeds': 20, 'candidates': 2000, 'edges': 4000},
+    'medium': {'seeds': 100, 'candidates': 20000, 'edges': 40000},
+    'large': {'seeds': 500, 'candidates': 200000, 'edges': 400000},
+}
+
+# sizes of the graphs with many more seed accounts than candidate accounts (see generate_edges), on which the cost of
+# counting the distinct accounts linking to each candidate shows
+MANY_SEEDS_SIZES = {
+    'small': {'seeds': 5000, 'candidates': 1000, 'edges': 50000},
+    'medium': {'seeds': 40000, 'candidates': 5000, 'edges': 400000},
+    'large': {'seeds': 160000, 'candidates': 20000, 'edges': 1600000},
+}
+
+# layouts timed by the get_network_graph benchmarks
+LAYOUTS = [GraphLayoutTypes.circular_layout.value, GraphLayoutTypes.spring_layout.value, GraphLayoutTypes.spectral_layout.value, GraphLayoutTypes.force_layout.value]
+
+# a benchmark is only reported as a regression if it is slower than its baseline by more than this fraction...
+TIME_TOLERANCE = 0.25
+
+# ...and by more than this number of seconds, so that timer noise on very fast benchmarks is ignored
+MIN_TIME_DIFFERENCE = 0.01
+
+# a benchmark is reported as a regression if its peak memory is larger than its baseline by more than this fraction...
+MEMORY_TOLERANCE = 0.10
+
+# ...and by more than this number of bytes
+MIN_MEMORY_DIFFERENCE = 2 ** 20
+
+# benchmarks that run the app with the Flask test client
+ROUTE_BENCHMARKS = ['upload'] + ['analyze.' + v.value for v in AnalysisEngines]
+
+
+def measure(function: _t.Callable, repeat: int=3, setup: _t.Callable=None) -> dict:
+    """
+    Function to measure the time and peak memory of a function. The time is the fastest of repeat runs, and the peak
+    memory (the largest amount of memory allocated by Python and numpy at once, as traced by tracemalloc) is measured
+    in one more run, since tracing allocations slows the function down. setup, if given, is called (untimed) before
+    every run.
+
+    :param function: callable
+    :param repeat: int
+    :param setup: callable
+    :return: dict (with the keys 'time', in seconds, and 'peak_memory', in bytes)
+    """
+    times = []
+
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+
+        start_time = _time.perf_counter()
+        function()
+        times.append(_time.perf_counter() - start_time)
+
+    if setup is not None:
+        setup()
+
+    _tracemalloc.start()
+
+    try:
+        function()
+        peak_memory = _tracemalloc.get_traced_memory()[1]
+    finally:
+        _tracemalloc.stop()
+
+    return {'time': min(times), 'peak_memory': peak_memory}
+
+
+def run_benchmarks(size: str='small', repeat: int=3, only: list=None) -> dict:
+    """
+    Function to generate a synthetic graph of the given size, and measure the analytics functions, the plot of each
+    layout, the csv upload and the /analyze route on it.
+
+    :param size: str (a key of SIZES)
+    :param repeat: int
+    :param only: list (if given, only the benchmarks whose name starts with one of these prefixes are run)
+    :return: dict (benchmark name -> measure result)
+    """
+    accounts = generate_accounts(**SIZES[size])
+    major_accounts = [v.account_name for v in accounts]
+    results = {}
+
+    def run(name, function):
+        if _selected(name, only):
+            results[name] = measure(function, repeat=repeat)
+
+    following_edges = construct_account_graph(accounts, type=AccountAttributes.following.value)
+    follower_edges = construct_account_graph(accounts, type=AccountAttributes.followers.value)
+    following_graph = nx.Graph(reduce_graph(following_edges, major_accounts, mode=LinkTypes.common.value, threshold=1))
+    follower_graph = nx.Graph(reduce_graph(follower_edges, major_accounts, mode=LinkTypes.common.value, threshold=1))
+
+    run('construct_account_graph', lambda: construct_account_graph(accounts, type=AccountAttributes.following.value))
+    run('reduce_graph', lambda: reduce_graph(following_edges, major_accounts, mode=LinkTypes.common.value, threshold=1))
+    run('get_edge_weights', lambda: get_edge_weights(following_graph, major_accounts))
+    run('get_edge_weights_stream', lambda: get_edge_weights_stream(iter(following_edges), major_accounts, mode=LinkTypes.common.value, threshold=1))
+    run('get_similar_accounts', lambda: get_similar_accounts(following_graph, follower_graph, major_accounts, 1.0))
+    run('get_edge_weights_sketch', lambda: get_edge_weights_sketch(following_edges, major_accounts, threshold=1))
+
+    if _selected('count_links.many_seeds', only):
+        many_seeds_edges = generate_edges(**MANY_SEEDS_SIZES[size])
+        run('count_links.many_seeds', lambda: count_links(many_seeds_edges, []))
+
+    for layout in LAYOUTS:
+        run('get_network_graph.' + layout, lambda: get_network_graph(following_graph, major_accounts, layout=layout))
+
+    if any(_selected(v, only) for v in ROUTE_BENCHMARKS):
+        results.update(_run_route_benchmarks(accounts, repeat, only))
+
+    return results
+
+
+def _run_route_benchmarks(accounts: list, repeat: int, only: list=None) -> dict:
+    """
+    Function to measure the csv upload and the /analyze route (once per analysis engine) end to end, with the Flask
+    test client. The app is run in a temporary directory, so that its database files do not touch the repository,
+    and with background jobs and the result caches disabled, so that every request runs the analysis.
+
+    :param accounts: list
+    :param repeat: int
+    :param only: list
+    :return: dict (benchmark name -> measure result)
+    """
+    from app_script import app, analysis_cache, layout_cache, storage
+    from lib.database import connect, connection_pool, remove_graph
+
+    csv_file = _io.StringIO()
+    write_csv(accounts, csv_file, graph_name='benchmark')
+    csv_data = csv_file.getvalue().encode('utf-8')
+    results = {}
+
+    def clear_caches():
+        analysis_cache.clear()
+        layout_cache.clear()
+
+    def remove_benchmark_graph():
+        conn = connect(*storage.locate('benchmark'))
+
+        try:
+            remove_graph(conn, 'benchmark')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def upload():
+        response = client.post('/upload', data={'file': (_io.BytesIO(csv_data), 'accounts.csv')}, environ_base=environ)
+        assert response.status_code == 200
+
+    async_jobs = app.config.get('ASYNC_JOBS')
+    previous_directory = _os.getcwd()
+
+    with _tempfile.TemporaryDirectory() as directory:
+        _os.chdir(directory)
+        _os.mkdir('database')
+        app.config['ASYNC_JOBS'] = False
+
+        try:
+            client = app.test_client()
+            environ = {'REMOTE_ADDR': 'benchmark'}
+
+            # the index route creates the database file of the benchmark tenant (the client address)
+            client.get('/', environ_base=environ)
+
+            if _selected('upload', only):
+                results['upload'] = measure(upload, repeat=repeat, setup=remove_benchmark_graph)
+            else:
+                upload()
+
+            for engine in (v.value for v in AnalysisEngines):
+                name = 'analyze.' + engine
+
+                if not _selected(name, only):
+                    continue
+
+                form = {'graphs': 'benchmark', 'connection_type': AccountAttributes.following.value, 'analysis_type': LinkTypes.common.value,
+                        'graph_type': GraphLayoutTypes.spectral_layout.value, 'threshold': 1, 'engine': engine}
+
+                def analyze(form=form):
+                    response = client.post('/analyze', data=form, environ_base=environ)
+                    assert response.status_code == 200
+
+                results[name] = measure(analyze, repeat=repeat, setup=clear_caches)
+        finally:
+            # the pooled connections point to files in the temporary directory
+            connection_pool.close_all()
+            app.config['ASYNC_JOBS'] = async_jobs
+            clear_caches()
+            _os.chdir(previous_directory)
+
+    return results
+
+
+def _selected(name: str, only: list=None) -> bool:
+    """
+    Function to return whether a benchmark is selected by the --only prefixes (every benchmark is selected if there
+    are none).
+
+    :param name: str
+    :param only: list
+    :return: bool
+    """
+    return not only or any(name.startswith(v) for v in only)
+
+
+def compare(results: dict, baseline: dict, time_tolerance: float=TIME_TOLERANCE, memory_tolerance: float=MEMORY_TOLERANCE) -> list:
+    """
+    Function to compare benchmark results with a baseline, and return a description of every regression. Benchmarks
+    that are missing from either side are ignored.
+
+    :param results: dict (benchmark name -> measure result)
+    :param baseline: dict (benchmark name -> measure result)
+    :param time_tolerance: float
+    :param memory_tolerance: float
+    :return: list (of str)
+    """
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        old_time, new_time = baseline[name]['time'], result['time']
+
+        if new_time > old_time * (1 + time_tolerance) and new_time - old_time > MIN_TIME_DIFFERENCE:
+            regressions.append(name + ': time ' + format(old_time, '.4f') + 's -> ' + format(new_time, '.4f') + 's')
+
+        old_memory, new_memory = baseline[name]['peak_memory'], result['peak_memory']
+
+        if new_memory > old_memory * (1 + memory_tolerance) and new_memory - old_memory > MIN_MEMORY_DIFFERENCE:
+            regressions.append(name + ': peak memory ' + str(old_memory) + ' -> ' + str(new_memory) + ' bytes')
+
+    return regressions
+
+
+def main(argv: _t.Optional[list]=None) -> int:
+    """
+    Function to run the benchmarks, print their results, and optionally save them as a json baseline and/or compare
+    them with a previous baseline, e.g.:
+
+    python -m benchmarks.run --size medium --output baseline.json
+    python -m benchmarks.run --size medium --compare baseline.json
+
+    :param argv: list (defaults to sys.argv)
+    :return: int (exit status: 1 if a regression was found, 0 otherwise)
+    """
+    parser = _argparse.ArgumentParser(prog='python -m benchmarks.run', description='Graph Explore benchmarks.')
+    parser.add_argument('--size', choices=list(SIZES), default='small')
+    parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each benchmark (the fastest is kept)')
+    parser.add_argument('--only', action='append', help='only run the benchmarks whose name starts with this prefix (can be repeated)')
+    parser.add_argument('--output', help='path of a json file to save the results to, for use as a baseline')
+    parser.add_argument('--compare', help='path of a baseline json file to compare the results with')
+    parser.add_argument('--tolerance', type=float, default=TIME_TOLERANCE, help='fraction by which a benchmark may be slower than its baseline')
+    parser.add_argument('--memory-tolerance', type=float, default=MEMORY_TOLERANCE, help='fraction by which the peak memory may be larger than its baseline')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = _json.load(file)
+
+        if baseline['size'] != args.size:
+            parser.error('the baseline was run with --size ' + baseline['size'])
+
+    results = run_benchmarks(args.size, repeat=args.repeat, only=args.only)
+
+    for name, result in results.items():
+        print(format(name, '40') + format(result['time'], '10.4f') + 's' + format(result['peak_memory'] / 2 ** 20, '10.1f') + ' MB')
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            _json.dump({'size': args.size, 'python': _platform.python_version(), 'machine': _platform.machine(), 'results': results}, file, indent=2)
+
+    if args.compare:
+        regressions = compare(results, baseline['results'], time_tolerance=args.tolerance, memory_tolerance=args.memory_tolerance)
+
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    _sys.exit(main())
@@ -1,3 +1,11 @@
+import array as _array
+import numpy as _np
+import typing as _t
+
+from lib.constants import AccountAttributes
+from lib.sparse import AccountIndex
+
+
 class Account:
     """
     Define the class used to store user account details.
@@ -6,4 +14,144 @@ class Account:
         self.account_name = account_name
         self.account_description = account_description
         self.follower_accounts = follower_accounts
-        self.following_accounts = following_accounts
\ No newline at end of file
+        self.following_accounts = following_accounts
+
+
+class StoredAccount:
+    """
+    Define the class used to read the details of one account of an AccountStore, with the same attributes as Account.
+    It only holds a reference to the store and the position of the account, and the follower/following lists are
+    decoded from the store when they are read.
+    """
+    __slots__ = ('store', 'position')
+
+    def __init__(self, store: 'AccountStore', position: int):
+        self.store = store
+        self.position = position
+
+    @property
+    def account_name(self) -> str:
+        return self.store.index.names[self.store.account_ids[self.position]]
+
+    @property
+    def account_description(self) -> _t.Any:
+        return self.store.descriptions[self.position]
+
+    @property
+    def follower_accounts(self) -> list:
+        return self.store.linked_accounts(self.store.account_ids[self.position], AccountAttributes.followers.value)
+
+    @property
+    def following_accounts(self) -> list:
+        return self.store.linked_accounts(self.store.account_ids[self.position], AccountAttributes.following.value)
+
+
+class AccountStore:
+    """
+    Define the class used to hold many accounts compactly: every account name is interned to an integer id (so that
+    each distinct name is stored once, however many accounts link to it), and the follower/following links are kept
+    as pairs of (account id, linked account id) in array('I') buffers rather than as lists of strings. The buffers can
+    be read as numpy arrays without copying them (see edge_arrays).
+    """
+    def __init__(self, accounts: _t.Iterable[Account]=()):
+        self.index = AccountIndex()
+        self.account_ids = _array.array('I')
+        self.descriptions = []
+        self._edges = {v.value: (_array.array('I'), _array.array('I')) for v in AccountAttributes}
+
+        for account in accounts:
+            self.add(account.account_name, account.account_description, account.follower_accounts, account.following_accounts)
+
+    def __len__(self):
+        return len(self.account_ids)
+
+    def __getitem__(self, position: int) -> StoredAccount:
+        if not -len(self) <= position < len(self):
+            raise IndexError('account position out of range')
+
+        return StoredAccount(self, position % len(self))
+
+    def __iter__(self):
+        return (StoredAccount(self, i) for i in range(len(self)))
+
+    def add(self, account_name: str, account_description: _t.Any=None, follower_accounts: _t.Iterable[str]=(), following_accounts: _t.Iterable[str]=()) -> StoredAccount:
+        """
+        Function to add an account to the store, and return it.
+
+        :param account_name: str
+        :param account_description: any
+        :param follower_accounts: iterable
+        :param following_accounts: iterable
+        :return: StoredAccount
+        """
+        self.account_ids.append(self.index.add(account_name))
+        self.descriptions.append(account_description)
+        self.add_edges(((account_name, v) for v in follower_accounts), AccountAttributes.followers.value)
+        self.add_edges(((account_name, v) for v in following_accounts), AccountAttributes.following.value)
+
+        return StoredAccount(self, len(self) - 1)
+
+    def add_edges(self, graph_edges: _t.Iterable[tuple], type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value]) -> None:
+        """
+        Function to add (account, linked account) pairs, e.g. as read from the edges table, without adding the
+        accounts themselves.
+
+        :param graph_edges: iterable
+        :param type: str
+        :return: None
+        """
+        users, targets = self._edges[_direction(type)]
+        add = self.index.add
+
+        for user, target in graph_edges:
+            users.append(add(user))
+            targets.append(add(target))
+
+    def edge_arrays(self, type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value]) -> (_np.ndarray, _np.ndarray):
+        """
+        Function to return the account ids and linked account ids of the follower or following links, as read-only
+        numpy views of the store's buffers.
+
+        :param type: str
+        :return: (np.ndarray, np.ndarray)
+        """
+        return tuple(_np.frombuffer(v, dtype=_np.uint32) if len(v) > 0 else _np.zeros(0, dtype=_np.uint32) for v in self._edges[_direction(type)])
+
+    def pairs(self, type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value]) -> list:
+        """
+        Function to return the list of (account, linked account) name pairs, in the same format as
+        construct_account_graph. Every occurrence of a name is the same string object.
+
+        :param type: str
+        :return: list
+        """
+        names = self.index.names
+        users, targets = self._edges[_direction(type)]
+
+        return [(names[u], names[v]) for u, v in zip(users, targets)]
+
+    def linked_accounts(self, account_id: int, type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value]) -> list:
+        """
+        Function to return the names of the accounts linked to an account id, in insertion order.
+
+        :param account_id: int
+        :param type: str
+        :return: list
+        """
+        users, targets = self.edge_arrays(type)
+
+        return [self.index.names[v] for v in targets[users == account_id].tolist()]
+
+
+def _direction(type: str) -> str:
+    """
+    Function to return the link direction used for a connection type, with the same default as
+    construct_account_graph (anything other than followers means following).
+
+    :param type: str
+    :return: str
+    """
+    if type == AccountAttributes.followers.value:
+        return AccountAttributes.followers.value
+    else:
+        return AccountAttributes.following.value
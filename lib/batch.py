@@ -0,0 +1,74 @@
+import concurrent.futures as _futures
+import numpy as _np
+
+from lib.constants import AccountAttributes, LinkTypes
+from lib.database import DEFAULT_TENANT, connect, get_graph_accounts, get_graph_edges
+from lib.sparse import AccountIndex, build_bipartite_matrix, rank_scores, score_candidates
+
+
+def analyze_graphs(db_file: str, graph_names: list, connection_types: tuple=(AccountAttributes.following.value, AccountAttributes.followers.value), following_follower_ratio: float=1.0, mode: str=LinkTypes.common.value, threshold: int=0, top_n: int=None, top_k: int=None, max_workers: int=None, tenant: str=DEFAULT_TENANT) -> dict:
+    """
+    Function to analyze several graphs at once, and return one ranking of (account, score) pairs per graph. Each
+    (graph, connection type) pair is a separate work unit, run in a pool of worker processes, and the scores of the
+    connection types of a graph are blended in the same way as get_similar_accounts (following degrees weighted by
+    following_follower_ratio).
+
+    :param db_file: str
+    :param graph_names: list
+    :param connection_types: tuple (of 'following' and/or 'followers')
+    :param following_follower_ratio: float (the relative weigthing of follower vs following)
+    :param mode: str (common or unique, applied to each connection type as in reduce_graph, or a scoring mode)
+    :param threshold: int
+    :param top_n: int
+    :param top_k: int (if given, only the top_k accounts of each graph are returned)
+    :param max_workers: int (defaults to the number of CPUs)
+    :param tenant: str (the tenant whose graphs are analyzed, in a database file shared by several tenants)
+    :return: dict (graph name -> list)
+    """
+    weights = {AccountAttributes.following.value: following_follower_ratio, AccountAttributes.followers.value: 1.0}
+    indexes = {graph_name: AccountIndex() for graph_name in graph_names}
+    scores = {graph_name: [] for graph_name in graph_names}
+
+    with _futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [(graph_name, weights[connection_type], executor.submit(score_edges, db_file, graph_name, connection_type, mode, threshold, top_n, tenant))
+                   for graph_name in graph_names for connection_type in connection_types]
+
+        # the results are merged in submission order, so that ties are ranked in the same order on every run
+        for graph_name, weight, future in futures:
+            names, degrees = future.result()
+            account_ids = indexes[graph_name].add_many(names)
+            graph_scores = scores[graph_name]
+            graph_scores.extend([0.0] * (len(indexes[graph_name]) - len(graph_scores)))
+
+            for account_id, degree in zip(account_ids.tolist(), (degrees * weight).tolist()):
+                graph_scores[account_id] += degree
+
+    return {graph_name: rank_scores(_np.array(scores[graph_name]), indexes[graph_name], top_k) for graph_name in graph_names}
+
+
+def score_edges(db_file: str, graph_name: str, connection_type: str, mode: str=LinkTypes.common.value, threshold: int=0, top_n: int=None, tenant: str=DEFAULT_TENANT) -> (list, _np.ndarray):
+    """
+    Function to run one work unit of analyze_graphs in a worker process. The worker reads the edges from its own
+    connection to the database (reads run concurrently in WAL mode), so that no list of edges is ever pickled between
+    processes: only the names and degrees of the selected accounts are returned.
+
+    :param db_file: str
+    :param graph_name: str
+    :param connection_type: str
+    :param mode: str
+    :param threshold: int
+    :param top_n: int
+    :param tenant: str
+    :return: (list, np.ndarray) (account names, degrees)
+    """
+    conn = connect(db_file, tenant)
+
+    try:
+        matrix, _, candidate_index = build_bipartite_matrix(get_graph_edges(conn, graph_name, connection_type), get_graph_accounts(conn, graph_name))
+    finally:
+        conn.close()
+
+    degrees = score_candidates(matrix, mode=mode, threshold=threshold, top_n=top_n)
+    selected = _np.flatnonzero(degrees)
+
+    return [candidate_index.names[i] for i in selected], degrees[selected]
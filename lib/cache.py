@@ -0,0 +1,74 @@
+import collections as _collections
+import pickle as _pickle
+import threading as _threading
+import typing as _t
+
+
+class AnalysisCache:
+    """
+    Define the class used to cache analysis results in memory, with least-recently-used eviction once either the number
+    of entries or their total (pickled) size in bytes goes over its limit. Keys should include the version of the graph
+    the result was computed from (see lib.database.get_graph_version), so that writes to a graph invalidate its results.
+    """
+    def __init__(self, max_entries: int=128, max_bytes: int=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = _collections.OrderedDict()
+        self._lock = _threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: tuple):
+        return key in self._entries
+
+    def get(self, key: tuple) -> _t.Any:
+        """
+        Function to return a cached value (and mark it as recently used), or None if it is not in the cache.
+
+        :param key: tuple
+        :return: any
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+
+            self._entries.move_to_end(key)
+
+            return self._entries[key][0]
+
+    def put(self, key: tuple, value: _t.Any) -> None:
+        """
+        Function to add a value to the cache, evicting the least recently used values if the cache is full. Values
+        larger than the whole cache are not stored.
+
+        :param key: tuple
+        :param value: any (must be picklable)
+        :return: None
+        """
+        size = len(_pickle.dumps(value, protocol=_pickle.HIGHEST_PROTOCOL))
+
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+
+            while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self) -> None:
+        """
+        Function to remove every value from the cache.
+
+        :return: None
+        """
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
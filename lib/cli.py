@@ -0,0 +1,278 @@
+import argparse as _argparse
+import os as _os
+import sys as _sys
+import typing as _t
+
+
+cwd = _os.getcwd()
+
+# Add the parent directory to sys.path
+_sys.path.append(cwd)
+
+from lib.constants import AccountAttributes, LinkTypes
+
+# the analysis modules (numpy, scipy and the process pool) are imported by the subcommands that use them, so that
+# parsing the arguments (or printing the help) does not have to load them
+
+# database files analyzed by the analyze subcommand when none are given (one file per user of the app), along with
+# the database file shared by every user when the app uses the shared storage backend (see lib.storage)
+DEFAULT_DATABASES = 'database/*database.db'
+
+# output formats of the analyze subcommand
+OUTPUT_FORMATS = ['csv', 'jsonl', 'parquet']
+
+
+class ResultWriter:
+    """
+    Define the class used to stream (database, tenant, graph, rank, account, score) rows to a file in csv, jsonl or parquet
+    format. Rows are written as soon as they are passed to write, so that the results of each database are saved before
+    the next one is analyzed (each call to write is one row group of a parquet file).
+    """
+    columns = ['database', 'tenant', 'graph', 'rank', 'account', 'score']
+
+    def __init__(self, format: str, output: str='-'):
+        self.format = format
+        self._parquet_writer = None
+
+        if format == 'parquet':
+            if output == '-':
+                raise ValueError('the parquet format needs an output file')
+
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ImportError('the parquet format needs the pyarrow package')
+
+            self._pa = pa
+            self._schema = pa.schema([('database', pa.string()), ('tenant', pa.string()), ('graph', pa.string()), ('rank', pa.int64()), ('account', pa.string()), ('score', pa.float64())])
+            self._parquet_writer = pq.ParquetWriter(output, self._schema)
+            self.file = None
+        else:
+            self.file = _sys.stdout if output == '-' else open(output, 'w', newline='')
+
+            if format == 'csv':
+                import csv
+
+                self._csv_writer = csv.writer(self.file)
+                self._csv_writer.writerow(self.columns)
+
+    def write(self, rows: list) -> None:
+        """
+        Function to write a list of (database, tenant, graph, rank, account, score) rows.
+
+        :param rows: list
+        :return: None
+        """
+        if self.format == 'parquet':
+            if len(rows) > 0:
+                self._parquet_writer.write_table(self._pa.Table.from_arrays([self._pa.array(v, type=self._schema.field(i).type) for i, v in enumerate(zip(*rows))], schema=self._schema))
+        elif self.format == 'jsonl':
+            import json
+
+            self.file.writelines(json.dumps(dict(zip(self.columns, v))) + '\n' for v in rows)
+        else:
+            self._csv_writer.writerows(rows)
+
+        if self.file is not None:
+            self.file.flush()
+
+    def close(self) -> None:
+        """
+        Function to finish the output file (stdout is left open).
+
+        :return: None
+        """
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+        elif self.file is not _sys.stdout:
+            self.file.close()
+
+
+def batch(args: _argparse.Namespace) -> None:
+    """
+    Function to run the batch subcommand: analyze the given graphs (or every graph in the database) in parallel, and
+    write one (graph, rank, account, score) row per recommended account to stdout in csv format.
+
+    :param args: argparse.Namespace
+    :return: None
+    """
+    import csv
+
+    from lib.batch import analyze_graphs
+    from lib.database import connect, get_graph_names
+
+    graph_names = args.graph
+
+    if not graph_names:
+        conn = connect(args.database, args.tenant)
+
+        try:
+            graph_names = get_graph_names(conn)
+        finally:
+            conn.close()
+
+    results = analyze_graphs(args.database, graph_names, connection_types=tuple(args.connection_type or [AccountAttributes.following.value, AccountAttributes.followers.value]),
+                             following_follower_ratio=args.ratio, mode=args.mode, threshold=args.threshold, top_n=args.top_n, top_k=args.top_k, max_workers=args.workers, tenant=args.tenant)
+
+    writer = csv.writer(_sys.stdout)
+    writer.writerow(['graph', 'rank', 'account', 'score'])
+
+    for graph_name, scores in results.items():
+        writer.writerows([graph_name, i + 1, account, score] for i, (account, score) in enumerate(scores))
+
+
+def analyze(args: _argparse.Namespace) -> None:
+    """
+    Function to run the analyze subcommand: analyze every graph (or the given graphs) of every tenant (or the given
+    tenant) of every database file, without plotting, and stream one (database, tenant, graph, rank, account, score)
+    row per recommended account to the output. The database files and tenants are analyzed one after the other, and
+    the graphs of each tenant in parallel.
+
+    :param args: argparse.Namespace
+    :return: None
+    """
+    from lib.batch import analyze_graphs
+    from lib.database import connect, get_graph_names, get_tenant_names, initialise_database
+
+    databases = args.database or _default_databases()
+    writer = ResultWriter(args.format, args.output)
+
+    try:
+        for db_file in databases:
+            conn = connect(db_file)
+
+            try:
+                # older database files are upgraded to the current schema, in the same way as when the app opens them
+                initialise_database(conn)
+                tenants = get_tenant_names(conn) if args.tenant is None else [args.tenant]
+            finally:
+                conn.close()
+
+            for tenant in tenants:
+                conn = connect(db_file, tenant)
+
+                try:
+                    graph_names = [v for v in get_graph_names(conn) if not args.graph or v in args.graph]
+                finally:
+                    conn.close()
+
+                results = analyze_graphs(db_file, graph_names, connection_types=tuple(args.connection_type or [AccountAttributes.following.value, AccountAttributes.followers.value]),
+                                         following_follower_ratio=args.ratio, mode=args.mode, threshold=args.threshold, top_n=args.top_n, top_k=args.top_k, max_workers=args.workers, tenant=tenant)
+
+                writer.write([(db_file, tenant, graph_name, i + 1, account, score) for graph_name, scores in results.items() for i, (account, score) in enumerate(scores)])
+    finally:
+        writer.close()
+
+
+def migrate(args: _argparse.Namespace) -> None:
+    """
+    Function to run the migrate subcommand: copy the graphs of every per-tenant database file (or of the given files)
+    into a shared database file, under the tenant named by each file, and print one (database, tenant, accounts) row
+    per file.
+
+    :param args: argparse.Namespace
+    :return: None
+    """
+    import csv
+
+    from lib.storage import migrate_database, tenant_name
+
+    databases = [v for v in args.source or sorted(_glob(DEFAULT_DATABASES)) if _os.path.abspath(v) != _os.path.abspath(args.database)]
+
+    writer = csv.writer(_sys.stdout)
+    writer.writerow(['database', 'tenant', 'accounts'])
+
+    for db_file in databases:
+        tenant = tenant_name(db_file)
+        writer.writerow([db_file, tenant, migrate_database(db_file, args.database, tenant)])
+        _sys.stdout.flush()
+
+
+def _default_databases() -> list:
+    """
+    Function to return the database files analyzed by the analyze subcommand when none are given: the per-tenant
+    database files, and the shared database file if there is one.
+
+    :return: list
+    """
+    from lib.storage import SHARED_DATABASE
+
+    return sorted(_glob(DEFAULT_DATABASES)) + ([SHARED_DATABASE] if _os.path.isfile(SHARED_DATABASE) else [])
+
+
+def _glob(pattern: str) -> list:
+    """
+    Function to return the files matching a glob pattern.
+
+    :param pattern: str
+    :return: list
+    """
+    import glob
+
+    return glob.glob(pattern)
+
+
+def _add_analysis_arguments(parser: _argparse.ArgumentParser, every_tenant: bool=False) -> None:
+    """
+    Function to add the analysis options shared by the batch and analyze subcommands to a parser.
+
+    :param parser: argparse.ArgumentParser
+    :param every_tenant: bool (if True, every tenant of a database file is analyzed when no tenant is given)
+    :return: None
+    """
+    parser.add_argument('--graph', action='append', help='graph to analyze (can be repeated, defaults to every graph)')
+    parser.add_argument('--connection-type', action='append', choices=[v.value for v in AccountAttributes], help='connection type to analyze (can be repeated, defaults to both)')
+    parser.add_argument('--ratio', type=float, default=1.0, help='weight of the following scores relative to the follower scores')
+    parser.add_argument('--mode', choices=[v.value for v in LinkTypes], default=LinkTypes.common.value)
+    parser.add_argument('--threshold', type=int, default=0)
+    parser.add_argument('--top-n', type=int, default=None)
+    parser.add_argument('--top-k', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (defaults to the number of CPUs)')
+    if every_tenant:
+        parser.add_argument('--tenant', default=None, help='tenant whose graphs are analyzed, in a database file shared by several tenants (defaults to every tenant)')
+    else:
+        parser.add_argument('--tenant', default='', help='tenant whose graphs are analyzed, in a database file shared by several tenants')
+
+
+def main(argv: _t.Optional[list]=None) -> None:
+    """
+    Function to parse the command line arguments and run the selected subcommand, e.g.:
+
+    python -m lib.cli batch database/127.0.0.1database.db --graph graph1 --graph graph2 --workers 32 --top-k 100
+    python -m lib.cli analyze --format jsonl --output recommendations.jsonl --top-k 100
+    python -m lib.cli migrate database/graphexplore.db
+
+    :param argv: list (defaults to sys.argv)
+    :return: None
+    """
+    parser = _argparse.ArgumentParser(prog='python -m lib.cli', description='Graph Explore command line tools.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch_parser = subparsers.add_parser('batch', help='analyze several graphs in parallel, and print one ranking per graph')
+    batch_parser.add_argument('database', help='path of the database file')
+    _add_analysis_arguments(batch_parser)
+    batch_parser.set_defaults(function=batch)
+
+    analyze_parser = subparsers.add_parser('analyze', help='analyze every graph of several database files, and write one ranking per graph')
+    analyze_parser.add_argument('database', nargs='*', help='paths of the database files (defaults to ' + DEFAULT_DATABASES + ', and the shared database file)')
+    _add_analysis_arguments(analyze_parser, every_tenant=True)
+    analyze_parser.add_argument('--format', choices=OUTPUT_FORMATS, default='csv')
+    analyze_parser.add_argument('--output', default='-', help='path of the output file (defaults to stdout, which the parquet format does not support)')
+    analyze_parser.set_defaults(function=analyze)
+
+    migrate_parser = subparsers.add_parser('migrate', help='copy the per-tenant database files into a database file shared by every tenant')
+    migrate_parser.add_argument('database', help='path of the shared database file')
+    migrate_parser.add_argument('source', nargs='*', help='paths of the per-tenant database files (defaults to ' + DEFAULT_DATABASES + ')')
+    migrate_parser.set_defaults(function=migrate)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'analyze' and args.format == 'parquet' and args.output == '-':
+        parser.error('the parquet format needs an output file (--output)')
+
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,37 @@ class AccountAttributes(Enum):
 class LinkTypes(Enum):
     common = 'common'
     uncommon = 'uncommon'
+    jaccard = 'jaccard'
+    adamic_adar = 'adamic_adar'
+    tfidf = 'tfidf'
+    pagerank = 'pagerank'
 
 class GraphLayoutTypes(Enum):
     circular_layout = 'circular_layout'
     spring_layout = 'spring_layout'
-    spectral_layout = 'spectral_layout'
\ No newline at end of file
+    spectral_layout = 'spectral_layout'
+    force_layout = 'force_layout'
+    no_plot = 'no_plot'
+
+class AnalysisEngines(Enum):
+    networkx = 'networkx'
+    sparse = 'sparse'
+    index = 'index'
+    snapshot = 'snapshot'
+    sketch = 'sketch'
+
+class RenderModes(Enum):
+    auto = 'auto'
+    canvas = 'canvas'
+    webgl = 'webgl'
+    raster = 'raster'
+
+class JobStatus(Enum):
+    queued = 'queued'
+    running = 'running'
+    done = 'done'
+    failed = 'failed'
+
+class StorageBackends(Enum):
+    files = 'files'
+    shared = 'shared'
@@ -0,0 +1,897 @@
+import csv as _csv
+import hashlib as _hashlib
+import itertools as _itertools
+import sqlite3 as _sql
+import json as _json
+import threading as _threading
+import typing as _t
+
+from lib.account import AccountStore
+from lib.constants import AccountAttributes, LinkTypes
+
+# version of the normalized schema, stored in the database file using PRAGMA user_version
+SCHEMA_VERSION = 6
+
+# tenant of the rows of a database file that is not shared between tenants (and of plain sqlite3 connections)
+DEFAULT_TENANT = ''
+
+# trigger that keeps the candidate_counts table up to date when an edge is inserted (see initialise_database)
+EDGES_INSERT_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS trg_edges_insert AFTER INSERT ON edges BEGIN
+        INSERT INTO candidate_counts (tenant, graph, direction, target, links, seeds)
+        VALUES (NEW.tenant, NEW.graph, NEW.direction, NEW.target, 1,
+                NOT EXISTS (SELECT 1 FROM edges WHERE tenant = NEW.tenant AND graph = NEW.graph AND target = NEW.target AND direction = NEW.direction AND user = NEW.user AND rowid != NEW.rowid))
+        ON CONFLICT (tenant, graph, direction, target) DO UPDATE SET links = links + 1, seeds = seeds + excluded.seeds;
+    END
+"""
+
+# trigger that keeps the candidate counts up to date when an edge is deleted (dropped by remove_graph, which deletes the
+# candidate counts of the graph with its edges)
+EDGES_DELETE_TRIGGER = """
+    CREATE TRIGGER IF NOT EXISTS trg_edges_delete AFTER DELETE ON edges BEGIN
+        UPDATE candidate_counts
+        SET links = links - 1,
+            seeds = seeds - NOT EXISTS (SELECT 1 FROM edges WHERE tenant = OLD.tenant AND graph = OLD.graph AND target = OLD.target AND direction = OLD.direction AND user = OLD.user)
+        WHERE tenant = OLD.tenant AND graph = OLD.graph AND direction = OLD.direction AND target = OLD.target;
+        DELETE FROM candidate_counts WHERE tenant = OLD.tenant AND graph = OLD.graph AND direction = OLD.direction AND target = OLD.target AND links <= 0;
+    END
+"""
+
+# column names of the csv files used for bulk uploads (the header row is optional)
+CSV_COLUMNS = ['graph', 'user', 'followers', 'following']
+
+# maximum length of a csv field (the csv module's default of 128 KB is less than the follower list of a large account)
+CSV_FIELD_SIZE_LIMIT = 256 * 1024 * 1024
+
+# maximum number of account names returned per page/search
+ACCOUNT_PAGE_SIZE = 100
+
+# number of rows fetched from a cursor at a time by the functions that stream rows
+FETCH_SIZE = 10000
+
+
+class TenantConnection(_sql.Connection):
+    """
+    Define the class of the connections opened by connect: a sqlite3.Connection bound to the tenant whose rows it reads
+    and writes. Every function of this module scopes its queries to the tenant of the connection, so a connection to a
+    database file shared by several tenants only sees the graphs of one of them.
+    """
+    tenant = DEFAULT_TENANT
+
+
+class ConnectionPool:
+    """
+    Define the class used to keep a small number of idle SQLite connections per database file, so that they can be
+    reused across requests instead of being opened (and leaked) by every request. Connections are pooled per file, not
+    per tenant, so the tenants of a shared database file reuse the same warm connections.
+    """
+    def __init__(self, max_idle: int=4):
+        self.max_idle = max_idle
+        self._idle = {}
+        self._lock = _threading.Lock()
+
+    def acquire(self, db_file: str, tenant: str=DEFAULT_TENANT) -> _sql.Connection:
+        """
+        Function to return an idle connection to a database file, or a new one if none is available, bound to a tenant.
+
+        :param db_file: str
+        :param tenant: str
+        :return: sqlite3.Connection
+        """
+        with self._lock:
+            idle = self._idle.get(db_file)
+
+            if idle:
+                conn = idle.pop()
+                conn.tenant = tenant
+
+                return conn
+
+        return connect(db_file, tenant)
+
+    def release(self, db_file: str, conn: _sql.Connection) -> None:
+        """
+        Function to return a connection to the pool, rolling back any transaction left open. The connection is closed
+        if the pool already holds max_idle connections to the database file.
+
+        :param db_file: str
+        :param conn: sqlite3.Connection
+        :return: None
+        """
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._lock:
+            idle = self._idle.setdefault(db_file, [])
+
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+
+        conn.close()
+
+    def close_all(self) -> None:
+        """
+        Function to close every idle connection in the pool.
+
+        :return: None
+        """
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+
+            self._idle.clear()
+
+
+# connections shared by the requests handled by this process
+connection_pool = ConnectionPool()
+
+
+def connect(db_file: str, tenant: str=DEFAULT_TENANT) -> _sql.Connection:
+    """
+    Function to open a connection to a database file in WAL journal mode, so that reads do not block on writes, bound
+    to a tenant (see TenantConnection).
+
+    :param db_file: str
+    :param tenant: str
+    :return: sqlite3.Connection
+    """
+    conn = _sql.connect(db_file, check_same_thread=False, factory=TenantConnection)
+    conn.tenant = tenant
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+
+    return conn
+
+
+def get_connection(db_file: str, tenant: str=DEFAULT_TENANT) -> _sql.Connection:
+    """
+    Function to return the connection to a database file (bound to a tenant) for the current Flask app context, taking
+    it from the connection pool the first time it is needed. The connection is returned to the pool by
+    release_connections when the app context is torn down. Outside of an app context, a new connection is returned.
+
+    :param db_file: str
+    :param tenant: str
+    :return: sqlite3.Connection
+    """
+    # flask is imported here so that the command line tools can use this module without loading it
+    from flask import g, has_app_context
+
+    if not has_app_context():
+        return connect(db_file, tenant)
+
+    connections = g.setdefault('_database_connections', {})
+
+    if (db_file, tenant) not in connections:
+        connections[(db_file, tenant)] = connection_pool.acquire(db_file, tenant)
+
+    return connections[(db_file, tenant)]
+
+
+def release_connections(exception: BaseException=None) -> None:
+    """
+    Function to return the connections used by the current Flask app context to the connection pool. It is registered
+    with app.teardown_appcontext.
+
+    :param exception: BaseException
+    :return: None
+    """
+    from flask import g
+
+    for (db_file, tenant), conn in g.pop('_database_connections', {}).items():
+        connection_pool.release(db_file, conn)
+
+
+def initialise_database(conn: _sql.Connection) -> None:
+    """
+    Function to create the normalized account/edge tables and their indexes, and to migrate any legacy
+    'connections' table (one comma-joined follower/following string per row) into them. The candidate_counts table
+    holds, per graph and direction, the number of links to each linked account and the number of distinct accounts
+    that link to it; it is kept up to date by triggers on the edges table, so every write updates it in the same
+    transaction. Every table is keyed by tenant first, so that one database file can hold the graphs of many tenants.
+
+    :param conn: sqlite3.Connection
+    :return: None
+    """
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+
+    if version >= SCHEMA_VERSION:
+        return
+
+    if version < 4:
+        # the indexes, triggers and candidate counts are keyed by tenant since version 4, so they are rebuilt below
+        conn.executescript("""
+            DROP INDEX IF EXISTS idx_accounts_graph_user;
+            DROP INDEX IF EXISTS idx_edges_graph_user;
+            DROP INDEX IF EXISTS idx_edges_graph_target;
+            DROP TRIGGER IF EXISTS trg_edges_insert;
+            DROP TRIGGER IF EXISTS trg_edges_delete;
+            DROP TABLE IF EXISTS candidate_counts;
+        """)
+
+        # the rows written before version 4 belong to the default tenant
+        for table in ('accounts', 'edges'):
+            columns = [v[1] for v in conn.execute("PRAGMA table_info(" + table + ")")]
+
+            if len(columns) > 0 and 'tenant' not in columns:
+                conn.execute("ALTER TABLE " + table + " ADD COLUMN tenant text NOT NULL DEFAULT ''")
+
+        columns = [v[1] for v in conn.execute("PRAGMA table_info(graph_versions)")]
+
+        # the primary key of a table cannot be altered, so the graph versions are copied to a new table below
+        if len(columns) > 0 and 'tenant' not in columns:
+            conn.execute("ALTER TABLE graph_versions RENAME TO graph_versions_v3")
+
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS accounts (
+            tenant text NOT NULL DEFAULT '',
+            graph text,
+            user text,
+            hash text
+        );
+        CREATE TABLE IF NOT EXISTS edges (
+            tenant text NOT NULL DEFAULT '',
+            graph text,
+            user text,
+            target text,
+            direction text
+        );
+        CREATE TABLE IF NOT EXISTS graph_versions (
+            tenant text NOT NULL DEFAULT '',
+            graph text,
+            version integer NOT NULL,
+            PRIMARY KEY (tenant, graph)
+        );
+        CREATE INDEX IF NOT EXISTS idx_accounts_graph_user ON accounts (tenant, graph, user);
+        CREATE INDEX IF NOT EXISTS idx_edges_graph_user ON edges (tenant, graph, user);
+        CREATE INDEX IF NOT EXISTS idx_edges_graph_target ON edges (tenant, graph, target, direction, user);
+        CREATE INDEX IF NOT EXISTS idx_edges_graph_direction ON edges (tenant, graph, direction);
+        CREATE TABLE IF NOT EXISTS candidate_counts (
+            tenant text NOT NULL DEFAULT '',
+            graph text,
+            direction text,
+            target text,
+            links integer NOT NULL,
+            seeds integer NOT NULL,
+            PRIMARY KEY (tenant, graph, direction, target)
+        );
+        CREATE INDEX IF NOT EXISTS idx_candidate_counts_seeds ON candidate_counts (tenant, graph, direction, seeds DESC, target);
+    """)
+    conn.execute(EDGES_INSERT_TRIGGER)
+    conn.execute(EDGES_DELETE_TRIGGER)
+
+    # the content hash of each account's follower/following sets (see account_hash) was added in version 6, and is
+    # left empty for the accounts stored before, until they are next upserted
+    if 'hash' not in [v[1] for v in conn.execute("PRAGMA table_info(accounts)")]:
+        conn.execute("ALTER TABLE accounts ADD COLUMN hash text")
+
+    if version < 4:
+        if conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='graph_versions_v3'").fetchone() is not None:
+            conn.execute("INSERT INTO graph_versions (graph, version) SELECT graph, version FROM graph_versions_v3")
+            conn.execute("DROP TABLE graph_versions_v3")
+
+        # count the edges written before the triggers existed (or before the counts were keyed by tenant)
+        conn.execute("""INSERT INTO candidate_counts (tenant, graph, direction, target, links, seeds)
+                        SELECT tenant, graph, direction, target, COUNT(*), COUNT(DISTINCT user) FROM edges GROUP BY tenant, graph, direction, target""")
+
+    legacy = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='connections'").fetchone()
+
+    if legacy is not None:
+        for graph_name, account_name, followers, following in conn.execute("SELECT graph, user, followers, following FROM connections").fetchall():
+            insert_account(conn, graph_name, account_name, parse_account_list(followers), parse_account_list(following))
+
+        conn.execute("DROP TABLE connections")
+
+    # the graphs are listed from the graph_versions table (see get_graph_names), which files created before version 2
+    # do not have, and in which the graphs written before then have no row
+    conn.execute("INSERT OR IGNORE INTO graph_versions (tenant, graph, version) SELECT DISTINCT tenant, graph, 1 FROM accounts")
+
+    conn.execute("PRAGMA user_version = " + str(SCHEMA_VERSION))
+
+    # save the database to file
+    conn.commit()
+
+
+def parse_account_list(accounts: str) -> list:
+    """
+    Function to split a comma-separated list of account names, as entered in the forms or the csv upload.
+
+    :param accounts: str
+    :return: list
+    """
+    if not accounts:
+        return []
+
+    return [v.strip() for v in accounts.split(',') if v.strip()]
+
+
+def insert_account(conn: _sql.Connection, graph_name: str, account_name: str, followers: list, following: list) -> None:
+    """
+    Function to insert an account into a graph, with one edge row per follower/following account.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param account_name: str
+    :param followers: list
+    :param following: list
+    :return: None
+    """
+    tenant = _tenant(conn)
+
+    conn.execute("INSERT INTO accounts (tenant, graph, user) VALUES (?, ?, ?)", (tenant, graph_name, account_name))
+
+    edges = [(tenant, graph_name, account_name, v, AccountAttributes.followers.value) for v in followers]
+    edges += [(tenant, graph_name, account_name, v, AccountAttributes.following.value) for v in following]
+
+    conn.executemany("INSERT INTO edges (tenant, graph, user, target, direction) VALUES (?, ?, ?, ?, ?)", edges)
+
+    bump_graph_version(conn, graph_name)
+
+
+def account_hash(followers: list, following: list) -> str:
+    """
+    Function to return the content hash of an account's follower and following sets, which does not depend on the order
+    of the accounts, or on duplicates. It is stored with each upserted account, so that re-imports of an unchanged
+    account can be skipped without reading its edges.
+
+    :param followers: list
+    :param following: list
+    :return: str
+    """
+    content = _json.dumps([sorted(set(followers)), sorted(set(following))], ensure_ascii=False)
+
+    return _hashlib.blake2b(content.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def upsert_account(conn: _sql.Connection, graph_name: str, account_name: str, followers: list, following: list) -> bool:
+    """
+    Function to insert an account into a graph, or, if the graph already holds it, to update its edges to the given
+    follower and following sets. Only the added and removed edges are written (duplicate edges and account rows, e.g.
+    from an earlier insert of the same account, are removed), and nothing is written if the account's content hash is
+    unchanged. The graph version is only bumped if the graph changed.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param account_name: str
+    :param followers: list
+    :param following: list
+    :return: bool (whether the graph changed)
+    """
+    followers, following = list(dict.fromkeys(followers)), list(dict.fromkeys(following))
+    digest = account_hash(followers, following)
+    changed = _update_account(conn, graph_name, account_name, followers, following, digest)
+
+    if changed is None:
+        insert_account(conn, graph_name, account_name, followers, following)
+        conn.execute("UPDATE accounts SET hash=? WHERE tenant=? AND graph=? AND user=?", (digest, _tenant(conn), graph_name, account_name))
+
+        return True
+
+    if changed:
+        bump_graph_version(conn, graph_name)
+
+    return changed
+
+
+def upsert_accounts(conn: _sql.Connection, rows: _t.Iterable[list], chunk_size: int=10000) -> (int, int, int):
+    """
+    Function to upsert many accounts (see upsert_account) from an iterable of [graph, user, followers, following] rows,
+    as taken by insert_accounts, so that a graph can be re-imported from a new snapshot of its accounts. The accounts of
+    each chunk of chunk_size rows that are not stored yet are written with insert_accounts, and the version of each
+    graph that changed is bumped once. The caller is responsible for committing the transaction.
+
+    :param conn: sqlite3.Connection
+    :param rows: iterable
+    :param chunk_size: int
+    :return: (int, int, int) (the number of inserted or changed accounts, of unchanged accounts, and of rejected rows)
+    """
+    rows = iter(rows)
+    tenant = _tenant(conn)
+    written, unchanged, rejected = 0, 0, 0
+    graph_names = set()
+
+    for chunk in iter(lambda: list(_itertools.islice(rows, chunk_size)), []):
+        new_accounts = {}
+
+        for row in chunk:
+            if len(row) != len(CSV_COLUMNS) or not row[0].strip() or not row[1].strip():
+                rejected += 1
+                continue
+
+            graph_name, account_name = row[0], row[1]
+            followers, following = list(dict.fromkeys(_account_list(row[2]))), list(dict.fromkeys(_account_list(row[3])))
+            digest = account_hash(followers, following)
+
+            # an account that appears twice in a chunk before it is stored is only inserted once, with its last row
+            if (graph_name, account_name) in new_accounts:
+                new_accounts[(graph_name, account_name)] = [graph_name, account_name, followers, following, digest]
+                continue
+
+            changed = _update_account(conn, graph_name, account_name, followers, following, digest)
+
+            if changed is None:
+                new_accounts[(graph_name, account_name)] = [graph_name, account_name, followers, following, digest]
+            elif changed:
+                written += 1
+                graph_names.add(graph_name)
+            else:
+                unchanged += 1
+
+        if len(new_accounts) > 0:
+            inserted, _ = insert_accounts(conn, [v[:4] for v in new_accounts.values()], chunk_size=chunk_size)
+            conn.executemany("UPDATE accounts SET hash=? WHERE tenant=? AND graph=? AND user=?", [(v[4], tenant, v[0], v[1]) for v in new_accounts.values()])
+            written += inserted
+
+    for graph_name in graph_names:
+        bump_graph_version(conn, graph_name)
+
+    return written, unchanged, rejected
+
+
+def _update_account(conn: _sql.Connection, graph_name: str, account_name: str, followers: list, following: list, digest: str) -> _t.Optional[bool]:
+    """
+    Function to update the edges of a stored account to the given (duplicate-free) follower and following lists, by
+    deleting the edges that are no longer in them (and duplicate edges) and inserting the missing ones. The graph
+    version is not bumped.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param account_name: str
+    :param followers: list
+    :param following: list
+    :param digest: str (see account_hash)
+    :return: bool (whether the graph changed), or None if the account is not stored
+    """
+    tenant = _tenant(conn)
+    accounts = conn.execute("SELECT rowid, hash FROM accounts WHERE tenant=? AND graph=? AND user=? ORDER BY rowid", (tenant, graph_name, account_name)).fetchall()
+
+    if len(accounts) == 0:
+        return None
+
+    if len(accounts) == 1 and accounts[0][1] == digest:
+        return False
+
+    # the account is kept in its first row, and its content hash set
+    conn.executemany("DELETE FROM accounts WHERE rowid=?", [(v[0],) for v in accounts[1:]])
+    conn.execute("UPDATE accounts SET hash=? WHERE rowid=?", (digest, accounts[0][0]))
+
+    wanted = {(v, AccountAttributes.followers.value) for v in followers} | {(v, AccountAttributes.following.value) for v in following}
+    kept, removed = set(), []
+
+    for rowid, target, direction in conn.execute("SELECT rowid, target, direction FROM edges WHERE tenant=? AND graph=? AND user=?", (tenant, graph_name, account_name)):
+        if (target, direction) in wanted and (target, direction) not in kept:
+            kept.add((target, direction))
+        else:
+            removed.append((rowid,))
+
+    added = [(tenant, graph_name, account_name, v, AccountAttributes.followers.value) for v in followers if (v, AccountAttributes.followers.value) not in kept]
+    added += [(tenant, graph_name, account_name, v, AccountAttributes.following.value) for v in following if (v, AccountAttributes.following.value) not in kept]
+
+    conn.executemany("DELETE FROM edges WHERE rowid=?", removed)
+    conn.executemany("INSERT INTO edges (tenant, graph, user, target, direction) VALUES (?, ?, ?, ?, ?)", added)
+
+    return len(accounts) > 1 or len(removed) > 0 or len(added) > 0
+
+
+def insert_accounts(conn: _sql.Connection, rows: _t.Iterable[list], chunk_size: int=10000) -> (int, int):
+    """
+    Function to insert many accounts from an iterable of [graph, user, followers, following] rows, where followers and
+    following are comma-separated strings (or lists of account names). The rows are consumed in chunks of chunk_size, and each chunk is written with
+    executemany, so that memory use does not depend on the number of rows. Rows that do not have four columns, or have
+    an empty graph or account name, are rejected. The candidate counts of the new edges are added with one grouped
+    query at the end, rather than by the insert trigger on every edge. The caller is responsible for committing the
+    transaction.
+
+    :param conn: sqlite3.Connection
+    :param rows: iterable
+    :param chunk_size: int
+    :return: (int, int) (the number of inserted and rejected rows)
+    """
+    rows = iter(rows)
+    graph_names = set()
+
+    # the trigger is dropped inside the transaction, so that it is restored if the transaction is rolled back; the
+    # transaction takes the write lock as it begins, as a read transaction that is upgraded to a write fails at once
+    # (without waiting for the busy timeout) if another connection has written since it began
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+    last_rowid = conn.execute("SELECT IFNULL(MAX(rowid), 0) FROM edges").fetchone()[0]
+    conn.execute("DROP TRIGGER IF EXISTS trg_edges_insert")
+
+    try:
+        inserted, rejected = _insert_chunks(conn, rows, chunk_size, graph_names)
+    finally:
+        # an edge only adds a distinct linking account if the same link was not already in the graph
+        conn.execute("""INSERT INTO candidate_counts (tenant, graph, direction, target, links, seeds)
+                        SELECT tenant, graph, direction, target, COUNT(*),
+                               COUNT(DISTINCT CASE WHEN NOT EXISTS (SELECT 1 FROM edges AS prior
+                                                                    WHERE prior.tenant = added.tenant AND prior.graph = added.graph
+                                                                    AND prior.target = added.target AND prior.direction = added.direction
+                                                                    AND prior.user = added.user AND prior.rowid <= ?) THEN user END)
+                        FROM edges AS added WHERE rowid > ? GROUP BY tenant, graph, direction, target
+                        ON CONFLICT (tenant, graph, direction, target) DO UPDATE SET links = links + excluded.links, seeds = seeds + excluded.seeds""", (last_rowid, last_rowid))
+        conn.execute(EDGES_INSERT_TRIGGER)
+
+    for graph_name in graph_names:
+        bump_graph_version(conn, graph_name)
+
+    return inserted, rejected
+
+
+def _insert_chunks(conn: _sql.Connection, rows: _t.Iterator[list], chunk_size: int, graph_names: set) -> (int, int):
+    """
+    Function to insert the rows of insert_accounts in chunks, adding the name of each graph written to graph_names.
+
+    :param conn: sqlite3.Connection
+    :param rows: iterator
+    :param chunk_size: int
+    :param graph_names: set
+    :return: (int, int) (the number of inserted and rejected rows)
+    """
+    inserted, rejected = 0, 0
+    tenant = _tenant(conn)
+
+    for chunk in iter(lambda: list(_itertools.islice(rows, chunk_size)), []):
+        accounts, edges = [], []
+
+        for row in chunk:
+            if len(row) != len(CSV_COLUMNS) or not row[0].strip() or not row[1].strip():
+                rejected += 1
+                continue
+
+            graph_name, account_name, followers, following = row
+
+            accounts.append((tenant, graph_name, account_name))
+            edges += [(tenant, graph_name, account_name, v, AccountAttributes.followers.value) for v in _account_list(followers)]
+            edges += [(tenant, graph_name, account_name, v, AccountAttributes.following.value) for v in _account_list(following)]
+            graph_names.add(graph_name)
+
+        conn.executemany("INSERT INTO accounts (tenant, graph, user) VALUES (?, ?, ?)", accounts)
+        conn.executemany("INSERT INTO edges (tenant, graph, user, target, direction) VALUES (?, ?, ?, ?, ?)", edges)
+        inserted += len(accounts)
+
+    return inserted, rejected
+
+
+def _account_list(accounts: _t.Union[str, list]) -> list:
+    """
+    Function to return the account names of a follower/following field of insert_accounts, which is either a
+    comma-separated string or a list of names.
+
+    :param accounts: str or list
+    :return: list
+    """
+    if isinstance(accounts, str):
+        return parse_account_list(accounts)
+
+    return accounts
+
+
+def import_csv(conn: _sql.Connection, file: _t.TextIO, chunk_size: int=10000, upsert: bool=False) -> (int, int):
+    """
+    Function to bulk load accounts from a csv file object, streaming it through csv.reader. All rows are inserted (or
+    upserted, see upsert_accounts) in a single transaction (rolled back if the import fails), with the PRAGMAs tuned
+    for bulk loading while it runs (and restored afterwards).
+
+    :param conn: sqlite3.Connection
+    :param file: text file object
+    :param chunk_size: int
+    :param upsert: bool (if True, the accounts that are already stored are updated, and unchanged ones are skipped)
+    :return: (int, int) (the number of inserted, or inserted and changed, accounts, and of rejected rows)
+    """
+    if _csv.field_size_limit() < CSV_FIELD_SIZE_LIMIT:
+        _csv.field_size_limit(CSV_FIELD_SIZE_LIMIT)
+
+    rows = _csv.reader(file)
+    first_row = next(rows, None)
+
+    if first_row is not None and [v.strip().lower() for v in first_row] != CSV_COLUMNS:
+        rows = _itertools.chain([first_row], rows)
+
+    # commit any pending transaction, as the PRAGMAs cannot be changed inside one
+    conn.commit()
+
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    temp_store = conn.execute("PRAGMA temp_store").fetchone()[0]
+    cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+
+    try:
+        with conn:
+            if upsert:
+                inserted, _, rejected = upsert_accounts(conn, rows, chunk_size=chunk_size)
+            else:
+                inserted, rejected = insert_accounts(conn, rows, chunk_size=chunk_size)
+    finally:
+        conn.execute("PRAGMA synchronous = " + str(int(synchronous)))
+        conn.execute("PRAGMA temp_store = " + str(int(temp_store)))
+        conn.execute("PRAGMA cache_size = " + str(int(cache_size)))
+
+    return inserted, rejected
+
+
+def get_account_connections(conn: _sql.Connection, graph_name: str, account_name: str) -> _t.Optional[tuple]:
+    """
+    Function to return the follower and following lists of an account, or None if the account is not in the graph.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param account_name: str
+    :return: (list, list) or None
+    """
+    tenant = _tenant(conn)
+
+    if conn.execute("SELECT 1 FROM accounts WHERE tenant=? AND graph=? AND user=? LIMIT 1", (tenant, graph_name, account_name)).fetchone() is None:
+        return None
+
+    cursor = conn.execute("SELECT target, direction FROM edges WHERE tenant=? AND graph=? AND user=? ORDER BY rowid", (tenant, graph_name, account_name))
+
+    followers, following = [], []
+
+    for target, direction in cursor:
+        if direction == AccountAttributes.followers.value:
+            followers.append(target)
+        else:
+            following.append(target)
+
+    return followers, following
+
+
+def get_graph_accounts(conn: _sql.Connection, graph_name: str) -> list:
+    """
+    Function to return the names of the (major) accounts stored in a graph.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :return: list
+    """
+    return [row[0] for row in conn.execute("SELECT user FROM accounts WHERE tenant=? AND graph=? ORDER BY rowid", (_tenant(conn), graph_name))]
+
+
+def get_graph_names(conn: _sql.Connection) -> list:
+    """
+    Function to return the sorted names of the graphs that have at least one account. Every graph has a row in the
+    graph_versions table, so each graph costs a single index seek, however many accounts it holds.
+
+    :param conn: sqlite3.Connection
+    :return: list
+    """
+    cursor = conn.execute("""SELECT graph FROM graph_versions
+                             WHERE tenant=? AND EXISTS (SELECT 1 FROM accounts WHERE accounts.tenant = graph_versions.tenant AND accounts.graph = graph_versions.graph)
+                             ORDER BY graph""", (_tenant(conn),))
+
+    return [row[0] for row in cursor]
+
+
+def get_account_names(conn: _sql.Connection, graph_name: str, prefix: str='', offset: int=0, limit: int=ACCOUNT_PAGE_SIZE) -> list:
+    """
+    Function to return one page of the sorted, distinct names of the accounts in a graph that start with a prefix. The
+    prefix is matched as a range on the (graph, user) index, so the query does not scan the whole table.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param prefix: str
+    :param offset: int
+    :param limit: int
+    :return: list
+    """
+    cursor = conn.execute("""SELECT DISTINCT user FROM accounts
+                             WHERE tenant=? AND graph=? AND user >= ? AND user < ?
+                             ORDER BY user LIMIT ? OFFSET ?""", (_tenant(conn), graph_name, prefix, prefix + '\U0010ffff', limit, offset))
+
+    return [row[0] for row in cursor]
+
+
+def get_graph_edges(conn: _sql.Connection, graph_name: str, connection_type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value]) -> list:
+    """
+    Function to return the list of (account, linked account) pairs of a graph, in the same format as
+    construct_account_graph, read directly from the edges table.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param connection_type: str
+    :return: list
+    """
+    return list(iter_graph_edges(conn, graph_name, connection_type))
+
+
+def iter_graph_edges(conn: _sql.Connection, graph_name: str, connection_type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value], fetch_size: int=FETCH_SIZE) -> _t.Iterator[tuple]:
+    """
+    Function to yield the (account, linked account) pairs of a graph, in the same order as get_graph_edges, fetching
+    fetch_size rows at a time, so that the edges of a large graph are never all held in memory. The rows are read in
+    the order of the (tenant, graph, direction) index, which is the rowid order, so SQLite does not sort them first.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param connection_type: str
+    :param fetch_size: int
+    :return: iterator
+    """
+    if connection_type == AccountAttributes.followers.value:
+        direction = AccountAttributes.followers.value
+    else:
+        direction = AccountAttributes.following.value
+
+    cursor = conn.execute("SELECT user, target FROM edges WHERE tenant=? AND graph=? AND direction=? ORDER BY rowid", (_tenant(conn), graph_name, direction))
+
+    for rows in iter(lambda: cursor.fetchmany(fetch_size), []):
+        yield from rows
+
+
+def get_account_store(conn: _sql.Connection, graph_name: str, connection_types: tuple=(AccountAttributes.followers.value, AccountAttributes.following.value)) -> AccountStore:
+    """
+    Function to read the accounts of a graph and their edges (of the given connection types) into an AccountStore.
+    The rows are streamed from the cursors into the store's buffers, so no list of edges is built.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param connection_types: tuple
+    :return: AccountStore
+    """
+    store = AccountStore()
+    tenant = _tenant(conn)
+
+    for (account_name,) in conn.execute("SELECT user FROM accounts WHERE tenant=? AND graph=? ORDER BY rowid", (tenant, graph_name)):
+        store.add(account_name)
+
+    for connection_type in connection_types:
+        if connection_type == AccountAttributes.followers.value:
+            direction = AccountAttributes.followers.value
+        else:
+            direction = AccountAttributes.following.value
+
+        store.add_edges(conn.execute("SELECT user, target FROM edges WHERE tenant=? AND graph=? AND direction=? ORDER BY rowid", (tenant, graph_name, direction)), direction)
+
+    return store
+
+
+def get_candidate_counts(conn: _sql.Connection, graph_name: str, connection_type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value], mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None, top_k: int=None) -> list:
+    """
+    Function to return a sorted list of (account, degree) pairs read from the candidate_counts table, with the same
+    selection as reduce_graph followed by get_edge_weights: accounts are selected by their number of links, and
+    ranked by the number of distinct accounts in the graph that link to them. Accounts of the graph itself are never
+    returned. Ties are ranked by account name, and without top_n the query walks the seeds index and stops after
+    top_k rows.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :param connection_type: str
+    :param mode: str (either common or unique - greater than or less than/equal to)
+    :param threshold: int
+    :param top_n: int (if given, only the top_n accounts with the highest number of links are kept)
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :return: list
+    """
+    if connection_type == AccountAttributes.followers.value:
+        direction = AccountAttributes.followers.value
+    else:
+        direction = AccountAttributes.following.value
+
+    if mode=='common':
+        condition = "links > ?"
+    else:
+        condition = "links <= ?"
+
+    candidates = """SELECT target, links, seeds FROM candidate_counts
+                    WHERE tenant=? AND graph=? AND direction=? AND """ + condition + """
+                    AND NOT EXISTS (SELECT 1 FROM accounts WHERE accounts.tenant = candidate_counts.tenant AND accounts.graph = candidate_counts.graph
+                                    AND accounts.user = candidate_counts.target)"""
+
+    if top_n is not None:
+        candidates = "SELECT * FROM (" + candidates + " ORDER BY links DESC, target LIMIT " + str(int(top_n)) + ")"
+
+    cursor = conn.execute(candidates + " ORDER BY seeds DESC, target LIMIT ?", (_tenant(conn), graph_name, direction, threshold, top_k if top_k is not None else -1))
+
+    return [(target, seeds) for target, links, seeds in cursor]
+
+
+def remove_graph(conn: _sql.Connection, graph_name: str) -> None:
+    """
+    Function to delete a graph, and all of its accounts and edges.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :return: None
+    """
+    tenant = _tenant(conn)
+
+    # the delete trigger would still run (and look up the candidate counts) once per edge, so it is dropped while the
+    # edges are deleted with the candidate counts of the graph; it is dropped inside a transaction that takes the write
+    # lock as it begins (see insert_accounts), so that it is restored if the transaction is rolled back
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+    conn.execute("DROP TRIGGER IF EXISTS trg_edges_delete")
+
+    try:
+        conn.execute("DELETE FROM candidate_counts WHERE tenant=? AND graph=?", (tenant, graph_name))
+        conn.execute("DELETE FROM edges WHERE tenant=? AND graph=?", (tenant, graph_name))
+    finally:
+        conn.execute(EDGES_DELETE_TRIGGER)
+
+    conn.execute("DELETE FROM accounts WHERE tenant=? AND graph=?", (tenant, graph_name))
+
+    bump_graph_version(conn, graph_name)
+
+
+def remove_account(conn: _sql.Connection, account_name: str) -> None:
+    """
+    Function to delete an account, and its edges, from every graph it belongs to.
+
+    :param conn: sqlite3.Connection
+    :param account_name: str
+    :return: None
+    """
+    tenant = _tenant(conn)
+    graph_names = [row[0] for row in conn.execute("SELECT DISTINCT graph FROM accounts WHERE tenant=? AND user=?", (tenant, account_name))]
+
+    conn.execute("DELETE FROM edges WHERE tenant=? AND user=?", (tenant, account_name))
+    conn.execute("DELETE FROM accounts WHERE tenant=? AND user=?", (tenant, account_name))
+
+    for graph_name in graph_names:
+        bump_graph_version(conn, graph_name)
+
+
+def get_graph_version(conn: _sql.Connection, graph_name: str) -> int:
+    """
+    Function to return the version counter of a graph, which is incremented by every write to the graph. It is used
+    to invalidate analysis results computed from an earlier version of the graph.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :return: int
+    """
+    row = conn.execute("SELECT version FROM graph_versions WHERE tenant=? AND graph=?", (_tenant(conn), graph_name)).fetchone()
+
+    return row[0] if row is not None else 0
+
+
+def bump_graph_version(conn: _sql.Connection, graph_name: str) -> None:
+    """
+    Function to increment the version counter of a graph.
+
+    :param conn: sqlite3.Connection
+    :param graph_name: str
+    :return: None
+    """
+    conn.execute("""INSERT INTO graph_versions (tenant, graph, version) VALUES (?, ?, 1)
+                    ON CONFLICT (tenant, graph) DO UPDATE SET version = version + 1""", (_tenant(conn), graph_name))
+
+
+def tenant_exists(conn: _sql.Connection) -> bool:
+    """
+    Function to return whether the tenant of a connection has ever stored a graph (every write to a graph leaves a row
+    in the graph_versions table, even once the graph is deleted).
+
+    :param conn: sqlite3.Connection
+    :return: bool
+    """
+    tenant = _tenant(conn)
+
+    return bool(conn.execute("SELECT EXISTS (SELECT 1 FROM graph_versions WHERE tenant=?) OR EXISTS (SELECT 1 FROM accounts WHERE tenant=?)", (tenant, tenant)).fetchone()[0])
+
+
+def get_tenant_names(conn: _sql.Connection) -> list:
+    """
+    Function to return the names of the tenants that have accounts in a database file, in alphabetical order (a
+    per-tenant database file only holds the default tenant).
+
+    :param conn: sqlite3.Connection
+    :return: list
+    """
+    return [v[0] for v in conn.execute("SELECT DISTINCT tenant FROM accounts ORDER BY tenant")]
+
+
+def _tenant(conn: _sql.Connection) -> str:
+    """
+    Function to return the tenant whose rows a connection reads and writes (the default tenant for connections that were
+    not opened by connect).
+
+    :param conn: sqlite3.Connection
+    :return: str
+    """
+    return getattr(conn, 'tenant', DEFAULT_TENANT)
@@ -1,8 +1,9 @@
-from bokeh.models import Range1d, Circle, MultiLine
+from bokeh.models import GraphRenderer, HoverTool, LinearColorMapper, Range1d, StaticLayoutProvider, Circle, MultiLine
 from bokeh.plotting import figure
-from bokeh.plotting import from_networkx
-from flask import Flask
+from bokeh.transform import linear_cmap
 import numpy as _np
+import collections as _collections
+import heapq as _heapq
 import networkx as nx
 import sqlite3 as _sql
 import typing as _t
@@ -15,63 +16,138 @@ cwd = _os.getcwd()
 # Add the parent directory to sys.path
 _sys.path.append(cwd)
 
-from lib.constants import AccountAttributes, LinkTypes, GraphLayoutTypes
+from lib.account import AccountStore
+from lib.constants import AccountAttributes, LinkTypes, GraphLayoutTypes, RenderModes
+from lib.database import ACCOUNT_PAGE_SIZE, get_graph_names, get_account_names
+from lib.layout import compute_plot_layout
+from lib.render import RASTER_PALETTE, rasterize_edges, resolve_render_mode
 
 def construct_account_graph(account_list: list, type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value]) -> list:
     """
-    Function to construct a list of account pairs that indicate a link between two accounts.
+    Function to construct a list of account pairs that indicate a link between two accounts. An AccountStore can be
+    given instead of a list of Account objects, in which case the pairs are read from its id buffers.
 
-    :param account_list: list
+    :param account_list: list or AccountStore
     :param account_list: str
     :return: list
     """
+    if isinstance(account_list, AccountStore):
+        return account_list.pairs(type)
+
     if type=='followers':
         return [(account.account_name, account_i) for account in account_list for account_i in account.follower_accounts]
     else:
         return [(account.account_name, account_i) for account in account_list for account_i in account.following_accounts]
 
 
-def reduce_graph(graph: nx.Graph, major_accounts: list, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1) -> list:
+def reduce_graph(graph: nx.Graph, major_accounts: list, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None) -> list:
     """
-    Function to remove accounts from the graph if their degree is higher/lower than a given threshold.
+    Function to remove accounts from the graph if their degree is higher/lower than a given threshold. The degrees
+    are counted in a single hashed pass over the edges, so the function runs in linear time.
 
     :param graph: nx.Graph
     :param major_accounts: list
     :param mode: str (either common or unique - greater than or less than/equal to)
     :param threshold: int
+    :param top_n: int (if given, only the top_n accounts with the highest degree are kept)
     :return: list
     """
-    all_names = [v for k, v in graph if v not in major_accounts]
-    all_names = _np.unique(all_names, return_counts=True)
-    frequency_count = list(zip(all_names[0], all_names[1]))
-    
+    major_accounts = set(major_accounts)
+    frequency_count = _collections.Counter(v for k, v in graph if v not in major_accounts)
+
+    return list(filter_edges(graph, select_accounts(frequency_count, mode=mode, threshold=threshold, top_n=top_n)))
+
+def count_links(graph_edges: _t.Iterable[tuple], major_accounts: list) -> (dict, dict):
+    """
+    Function to count, in a single pass over an iterable of (account, linked account) pairs, the number of links to each
+    linked (non-major) account, and its degree in the graph of the pairs (the number of distinct accounts linking to
+    it). Only these counts are kept, so the pairs can be streamed (e.g. from iter_graph_edges). The linking accounts of
+    each linked account are kept as a set of integer ids (one id per account of the graph), so memory use depends on
+    the number of distinct pairs rather than the number of accounts of the graph, and the linked accounts are kept in
+    the order they were first linked, as the nodes of a graph built from the pairs are.
+
+    :param graph_edges: iterable
+    :param major_accounts: list
+    :return: (dict, dict) (links, degrees)
+    """
+    major_accounts = set(major_accounts)
+    account_ids = {}
+    links = {}
+    linking_accounts = {}
+
+    for k, v in graph_edges:
+        if v in major_accounts:
+            continue
+
+        account_id = account_ids.get(k)
+
+        if account_id is None:
+            account_id = account_ids[k] = len(account_ids)
+
+        links[v] = links.get(v, 0) + 1
+        accounts = linking_accounts.get(v)
+
+        if accounts is None:
+            linking_accounts[v] = {account_id}
+        else:
+            accounts.add(account_id)
+
+    return links, {k: len(v) for k, v in linking_accounts.items()}
+
+def select_accounts(links: dict, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None) -> set:
+    """
+    Function to return the set of accounts kept by reduce_graph, from the number of links to each account (see
+    count_links).
+
+    :param links: dict
+    :param mode: str (either common or unique - greater than or less than/equal to)
+    :param threshold: int
+    :param top_n: int (if given, only the top_n accounts with the most links are kept)
+    :return: set
+    """
     if mode=='common':
-        common_accounts = [k for k, v in frequency_count if v > threshold]
+        common_accounts = [(k, v) for k, v in links.items() if v > threshold]
     else:
-        common_accounts = [k for k, v in frequency_count if v <= threshold]
-    
-    return [(k, v) for k, v in graph if v in common_accounts]
+        common_accounts = [(k, v) for k, v in links.items() if v <= threshold]
+
+    if top_n is not None:
+        common_accounts = _heapq.nlargest(top_n, common_accounts, key=lambda v: v[1])
 
-def return_account_page(app: Flask) -> (list, list, list, list):
+    return {k for k, v in common_accounts}
+
+def filter_edges(graph_edges: _t.Iterable[tuple], accounts: set) -> _t.Iterator[tuple]:
     """
-    Function to read graph information from the database, and return it in function-readable format (lists).
+    Function that yields the (account, linked account) pairs whose linked account is in a set of accounts (see
+    select_accounts), lazily, so that they can be added to a graph without building a list of them.
 
-    :param app: Flask object
-    :return: (list, list, list, list)
+    :param graph_edges: iterable
+    :param accounts: set
+    :return: iterator
     """
-    conn = _sql.connect(app.config['DATABASE'])
+    return ((k, v) for k, v in graph_edges if v in accounts)
 
-    cursor = conn.execute("SELECT * from connections")
+def return_account_page(conn: _sql.Connection, graph_name: str=None, page: int=0) -> (list, list, list, list):
+    """
+    Function to read graph information from the database (for the tenant of the connection), and return it in
+    function-readable format (lists). Only one page of the accounts of the selected graph (or of the first graph) is
+    returned; the others can be found through the account search.
 
-    results = [row for row in cursor]
-    graph_list = _np.unique([row[0] for row in results])
-    account_list = [row[1] for row in results]
+    :param conn: sqlite3.Connection
+    :param graph_name: str (the selected graph)
+    :param page: int
+    :return: (list, list, list, list)
+    """
+    graph_list = get_graph_names(conn)
 
-    if len(graph_list) > 0:
+    if graph_name in graph_list:
+        graph_list_first = graph_name
+    elif len(graph_list) > 0:
         graph_list_first = graph_list[0]
     else:
         graph_list_first = 'Empty'
 
+    account_list = get_account_names(conn, graph_list_first, offset=page * ACCOUNT_PAGE_SIZE, limit=ACCOUNT_PAGE_SIZE)
+
     if len(account_list) > 0:
         account_list_first = account_list[0]
     else:
@@ -79,83 +155,150 @@ def return_account_page(app: Flask) -> (list, list, list, list):
 
     return graph_list_first, graph_list, account_list_first, account_list
 
-def get_network_graph(graph: nx.Graph, major_accounts: list, layout: _t.Union[GraphLayoutTypes.circular_layout.value, GraphLayoutTypes.spring_layout.value, GraphLayoutTypes.spectral_layout.value]=GraphLayoutTypes.spectral_layout.value) -> figure:
+def get_network_graph(graph: nx.Graph, major_accounts: list, layout: _t.Union[GraphLayoutTypes.circular_layout.value, GraphLayoutTypes.spring_layout.value, GraphLayoutTypes.spectral_layout.value, GraphLayoutTypes.force_layout.value]=GraphLayoutTypes.spectral_layout.value, positions: dict=None, render_mode: _t.Union[RenderModes.auto.value, RenderModes.canvas.value, RenderModes.webgl.value, RenderModes.raster.value]=RenderModes.auto.value) -> figure:
     """
     Function to read graph information from the database, and return it in function-readable format (lists).
 
     :param graph: nx.Graph
     :param major_accounts: list
     :param layout: str
+    :param positions: dict (node positions from compute_plot_layout, computed here if not given)
+    :param render_mode: str (see lib.render.resolve_render_mode)
     :return: plot
     """
-    if layout == 'circular_layout':
-        layout_variable = nx.circular_layout
-    elif layout == 'spring_layout':
-        layout_variable = nx.spring_layout
-    else:
-        layout_variable = nx.spectral_layout
-    
-    color_scheme = ['red' if a in major_accounts else 'blue' for a in list(graph.nodes)]
+    if positions is None:
+        positions = compute_plot_layout(graph, major_accounts, layout=layout)
 
-    edge_attrs = {}
+    if len(positions) < graph.number_of_nodes():
+        # large graphs are plotted as a degree-filtered view
+        graph = graph.subgraph(positions)
 
-    for start_node, end_node, _ in graph.edges(data=True):
-        edge_attrs[(start_node, end_node)] = 'red' if start_node in major_accounts and end_node in major_accounts else 'black'
+    nodes = list(graph.nodes)
+    node_ids = {v: i for i, v in enumerate(nodes)}
+    edges = _np.array([(node_ids[u], node_ids[v]) for u, v in graph.edges], dtype=_np.int32).reshape(-1, 2)
+    coordinates = _np.array([positions[v] for v in nodes], dtype=float).reshape(-1, 2)
 
-    nx.set_edge_attributes(graph, edge_attrs, "edge_color")
+    # major accounts (and the edges between them) are drawn in red, through a color mapper on a compact int8 column
+    is_major = _np.zeros(len(nodes), dtype=_np.int8)
+    is_major[[node_ids[a] for a in set(major_accounts) if a in node_ids]] = 1
+    major_edges = is_major[edges[:, 0]] & is_major[edges[:, 1]]
+
+    render_mode = resolve_render_mode(render_mode, len(edges))
 
     #Create a plot — set dimensions, toolbar, and title
-    plot = figure(tooltips = "account: @account",
-                  tools="pan,wheel_zoom,save,reset", active_scroll='wheel_zoom',
-                x_range=Range1d(-10.1, 10.1), y_range=Range1d(-10.1, 10.1), title='Title')
+    plot = figure(tools="pan,wheel_zoom,save,reset", active_scroll='wheel_zoom',
+                x_range=Range1d(-10.1, 10.1), y_range=Range1d(-10.1, 10.1), title='Title',
+                output_backend='canvas' if render_mode == RenderModes.canvas.value else 'webgl')
 
     plot.sizing_mode = 'scale_width'
 
-    #Create a network graph object with spring layout
-    # https://networkx.github.io/documentation/networkx-1.9/reference/generated/networkx.drawing.layout.spring_layout.html
-    network_graph = from_networkx(graph, layout_variable, scale=10, center=(0, 0))
-
-    network_graph.node_renderer.data_source.data['color_scheme'] = color_scheme
-
-    #Set node size and color
-    network_graph.node_renderer.glyph = Circle(size=15, fill_color='color_scheme')
-
-    #Set edge opacity and width
-    network_graph.edge_renderer.glyph = MultiLine(line_alpha=0.5, line_width=1)
-    network_graph.node_renderer.data_source.data['account']= list(graph.nodes)
-    network_graph.edge_renderer.glyph = MultiLine(line_color="edge_color", line_alpha=0.8, line_width=1)
-
-    #Add network graph to the plot
+    if render_mode == RenderModes.raster.value:
+        # only the edges between major accounts stay vector glyphs, the rest are shaded into a single image
+        x_range, y_range = (plot.x_range.start, plot.x_range.end), (plot.y_range.start, plot.y_range.end)
+        start, end = coordinates[edges[:, 0]], coordinates[edges[:, 1]]
+        image = rasterize_edges(start[:, 0], start[:, 1], end[:, 0], end[:, 1], x_range, y_range)
+        color_mapper = LinearColorMapper(palette=RASTER_PALETTE, low=0, high=255)
+        plot.image(image=[image], x=x_range[0], y=y_range[0], dw=x_range[1] - x_range[0], dh=y_range[1] - y_range[0], color_mapper=color_mapper)
+        edges, major_edges = edges[major_edges == 1], major_edges[major_edges == 1]
+
+    #Create a network graph object with the precomputed layout (see lib.layout), indexed by node position so that the
+    #edges are sent to the browser as binary integer arrays
+    network_graph = GraphRenderer()
+    network_graph.node_renderer.data_source.data = {'index': _np.arange(len(nodes), dtype=_np.int32), 'account': nodes, 'major': is_major}
+    network_graph.edge_renderer.data_source.data = {'start': edges[:, 0], 'end': edges[:, 1], 'major': major_edges}
+    network_graph.layout_provider = StaticLayoutProvider(graph_layout={i: list(xy) for i, xy in enumerate(coordinates.tolist())})
+
+    #Set node size and color, and edge color and opacity
+    network_graph.node_renderer.glyph = Circle(size=15, fill_color=linear_cmap('major', ['blue', 'red'], 0, 1))
+    network_graph.edge_renderer.glyph = MultiLine(line_color=linear_cmap('major', ['black', 'red'], 0, 1), line_alpha=0.8, line_width=1)
+
+    #Add network graph to the plot, with tooltips on its nodes
     plot.renderers.append(network_graph)
-    
+    plot.add_tools(HoverTool(renderers=[network_graph], tooltips="account: @account"))
+
     return plot
 
-def get_similar_accounts(following_graph: nx.Graph, follower_graph: nx.Graph, major_accounts: list, following_follower_ratio: float) -> list:
+def get_similar_accounts(following_graph: nx.Graph, follower_graph: nx.Graph, major_accounts: list, following_follower_ratio: float, top_k: int=None) -> list:
     """
-    Function to read graph information from the database, and return it in function-readable format (lists).
+    Function that combines the edge weights of a following graph and a follower graph into a single sorted list of
+    (account, score) pairs for similar account recommendation.
 
     :param following_graph: nx.Graph
     :param follower_graph: nx.Graph
     :param major_accounts: list
     :param following_follower_ratio: float (the relative weigthing of follower vs following)
+    :param top_k: int (if given, only the top_k accounts are returned)
     :return: list
     """
-    following_values = dict(get_edge_weights(following_graph, major_accounts))
-    follower_values = dict(get_edge_weights(follower_graph, major_accounts))
-    all_accounts = list(following_values.keys()) + list(follower_values.keys())
-    values = [(k, following_values.get(k, 0)*following_follower_ratio + follower_values.get(k, 0)) for k in all_accounts if k not in major_accounts]
-    
-    return sorted(values, key=lambda v: v[1], reverse=True)
+    major_accounts = set(major_accounts)
+    following_values = dict(_get_degree_values(following_graph, major_accounts))
+    follower_values = dict(_get_degree_values(follower_graph, major_accounts))
+    all_accounts = dict.fromkeys(list(following_values.keys()) + list(follower_values.keys()))
+    values = ((k, following_values.get(k, 0)*following_follower_ratio + follower_values.get(k, 0)) for k in all_accounts)
 
-def get_edge_weights(graph: nx.Graph, major_accounts: list) -> list:
+    return _rank_values(values, top_k)
+
+def get_edge_weights(graph: nx.Graph, major_accounts: list, top_k: int=None) -> list:
     """
     Function that returns a sorted list of (account, degree) pairs for use in graph analysis and similar account recommendation.
 
     :param graph: nx.Graph
     :param major_accounts: list
+    :param top_k: int (if given, only the top_k accounts are returned)
     :return: list
     """
-    edge_values = dict(graph.degree)
-    values = [(k, v) for k, v in edge_values.items() if (k not in major_accounts) and (v > 0)]
-    
-    return sorted(list(values), key=lambda v: v[1], reverse=True)
+    return _rank_values(_get_degree_values(graph, set(major_accounts)), top_k)
+
+def get_edge_weights_counts(degrees: dict, accounts: set, top_k: int=None) -> list:
+    """
+    Function that returns the same sorted list of (account, degree) pairs as get_edge_weights for the graph of the
+    edges kept by reduce_graph, from the degrees counted by count_links and the accounts kept by select_accounts, without
+    building the graph.
+
+    :param degrees: dict
+    :param accounts: set
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :return: list
+    """
+    return _rank_values(((k, v) for k, v in degrees.items() if k in accounts), top_k)
+
+def get_edge_weights_stream(graph_edges: _t.Iterable[tuple], major_accounts: list, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None, top_k: int=None) -> list:
+    """
+    Function that returns the same sorted list of (account, degree) pairs as reduce_graph followed by get_edge_weights,
+    in a single pass over an iterable of (account, linked account) pairs, keeping only the counts of each linked account.
+
+    :param graph_edges: iterable (e.g. iter_graph_edges)
+    :param major_accounts: list
+    :param mode: str
+    :param threshold: int
+    :param top_n: int
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :return: list
+    """
+    links, degrees = count_links(graph_edges, major_accounts)
+
+    return get_edge_weights_counts(degrees, select_accounts(links, mode=mode, threshold=threshold, top_n=top_n), top_k)
+
+def _get_degree_values(graph: nx.Graph, major_accounts: set) -> _t.Iterator[tuple]:
+    """
+    Function that yields the (account, degree) pairs of every linked (non-major) account with a non-zero degree.
+
+    :param graph: nx.Graph
+    :param major_accounts: set
+    :return: iterator
+    """
+    return ((k, v) for k, v in graph.degree if (k not in major_accounts) and (v > 0))
+
+def _rank_values(values: _t.Iterable[tuple], top_k: int=None) -> list:
+    """
+    Function that sorts (account, score) pairs by descending score. If top_k is given, a heap is used to select the
+    top_k pairs in O(N log K) instead of sorting all of them. Ties keep their original order in both cases.
+
+    :param values: iterable
+    :param top_k: int
+    :return: list
+    """
+    if top_k is None:
+        return sorted(values, key=lambda v: v[1], reverse=True)
+
+    return _heapq.nlargest(top_k, values, key=lambda v: v[1])
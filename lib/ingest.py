@@ -0,0 +1,318 @@
+import collections as _collections
+import json as _json
+import threading as _threading
+import time as _time
+import typing as _t
+
+from lib.database import connect, initialise_database, insert_accounts, upsert_accounts
+from lib.instrumentation import metrics
+
+# maximum number of accounts held in the buffer, waiting to be written
+INGEST_BUFFER_SIZE = 10000
+
+# maximum number of accounts written in one transaction
+INGEST_BATCH_SIZE = 2000
+
+# time (in seconds) the writer waits for more accounts after the first one arrives, so that concurrent posts are
+# written in the same transaction
+INGEST_FLUSH_INTERVAL = 0.05
+
+# largest body (in bytes) accepted by the /ingest route, checked before the body is read
+INGEST_MAX_BYTES = 16 * 1024 * 1024
+
+# number of accounts that could not be written kept (per buffer) for inspection, the oldest being dropped first
+INGEST_FAILED_ROWS = 100
+
+# content types of newline-delimited json bodies, with one account per line
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+class IngestBufferFull(Exception):
+    """
+    Define the exception raised when accounts are added to an ingestion buffer that has no room for them, so that the
+    producer can retry later.
+    """
+
+
+class IngestBuffer:
+    """
+    Define the class used to coalesce the accounts posted by many producers into grouped transactions. Accounts are
+    added to an in-process buffer, and a single writer thread takes them from it in batches of up to batch_size
+    accounts of the same database file and tenant, and writes each batch with insert_accounts in one transaction, so
+    producers never wait for a commit, and SQLite only ever has one writer. The buffer holds at most max_accounts
+    accounts: adding more waits for the writer to make room, and raises IngestBufferFull after a timeout. When a batch
+    fails, its accounts are written again one per transaction, so that one bad account does not drop the others, and
+    the last max_failed_rows accounts that still fail are kept, with their errors, for inspection.
+    """
+    def __init__(self, max_accounts: int=INGEST_BUFFER_SIZE, batch_size: int=INGEST_BATCH_SIZE, flush_interval: float=INGEST_FLUSH_INTERVAL, max_failed_rows: int=INGEST_FAILED_ROWS):
+        self.max_accounts = max_accounts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.written = 0
+        self.unchanged = 0
+        self.rejected = 0
+        self.batches = 0
+        self.failed = 0
+        self.failed_accounts = 0
+        self.last_error = None
+        self._failed_rows = _collections.deque(maxlen=max_failed_rows)
+        self._queues = _collections.OrderedDict()
+        self._pending = 0
+        self._writing = 0
+        self._closed = False
+        self._writer = None
+        self._connections = {}
+        self._condition = _threading.Condition()
+
+    def put(self, db_file: str, tenant: str, rows: list, timeout: float=0, upsert: bool=False) -> None:
+        """
+        Function to add [graph, user, followers, following] rows (see insert_accounts) to the buffer, to be written to
+        the tenant's graphs in a database file, or upserted (see upsert_accounts). Either all of the rows are added, or
+        none of them: if the buffer does not have room for them within timeout seconds, IngestBufferFull is raised.
+
+        :param db_file: str
+        :param tenant: str
+        :param rows: list
+        :param timeout: float
+        :param upsert: bool
+        :return: None
+        """
+        if len(rows) > self.max_accounts:
+            raise ValueError('a batch cannot hold more than ' + str(self.max_accounts) + ' accounts')
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('the ingestion buffer is closed')
+
+            # the accounts of the batch being written are still held, so they count towards the size of the buffer
+            if not self._condition.wait_for(lambda: self._pending + self._writing + len(rows) <= self.max_accounts, timeout=timeout):
+                raise IngestBufferFull('the ingestion buffer already holds ' + str(self._pending + self._writing) + ' accounts')
+
+            self._queues.setdefault((db_file, tenant, upsert), _collections.deque()).extend(rows)
+            self._pending += len(rows)
+
+            if self._writer is None:
+                self._writer = _threading.Thread(target=self._write, name='ingest-writer', daemon=True)
+                self._writer.start()
+
+            self._condition.notify_all()
+
+    def flush(self, timeout: float=None) -> bool:
+        """
+        Function to wait until every account added to the buffer has been written, and return False if they have not
+        been within timeout seconds.
+
+        :param timeout: float
+        :return: bool
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending == 0 and self._writing == 0, timeout=timeout)
+
+    def close(self, timeout: float=None) -> None:
+        """
+        Function to write the accounts left in the buffer, stop the writer thread and close its connections. It is
+        registered to run when the app exits.
+
+        :param timeout: float
+        :return: None
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            writer = self._writer
+
+        if writer is not None:
+            writer.join(timeout)
+
+    def stats(self) -> dict:
+        """
+        Function to return the number of accounts waiting in the buffer, and the numbers of accounts and batches
+        written (and of unchanged accounts, batches that failed, and accounts that could not be written) since the
+        buffer was created.
+
+        :return: dict
+        """
+        with self._condition:
+            return {'pending': self._pending + self._writing, 'capacity': self.max_accounts, 'written': self.written, 'unchanged': self.unchanged, 'rejected': self.rejected,
+                    'batches': self.batches, 'failed': self.failed, 'failed_accounts': self.failed_accounts, 'last_error': self.last_error}
+
+    def failed_rows(self, db_file: str, tenant: str) -> list:
+        """
+        Function to return the most recent rows of a tenant's database file that could not be written, each as
+        {"row": [graph, user, followers, following], "error": ...}, oldest first.
+
+        :param db_file: str
+        :param tenant: str
+        :return: list
+        """
+        with self._condition:
+            return [{'row': row, 'error': error} for key, row, error in self._failed_rows if key == (db_file, tenant)]
+
+    def _write(self) -> None:
+        """
+        Function to run the writer thread: wait for accounts, and write them in batches until the buffer is closed.
+
+        :return: None
+        """
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._pending > 0 or self._closed)
+
+                    if self._pending == 0:
+                        return
+
+                if not self._closed and self._pending < self.batch_size:
+                    # give concurrent producers a moment to add their accounts to the same transaction
+                    _time.sleep(self.flush_interval)
+
+                with self._condition:
+                    key, queue = next(iter(self._queues.items()))
+                    rows = [queue.popleft() for _ in range(min(self.batch_size, len(queue)))]
+
+                    # the queues of the database files and tenants take turns, so that one producer cannot hold up the others
+                    del self._queues[key]
+
+                    if len(queue) > 0:
+                        self._queues[key] = queue
+
+                    self._pending -= len(rows)
+                    self._writing = len(rows)
+                    self._condition.notify_all()
+
+                self._write_batch(*key, rows)
+
+                with self._condition:
+                    self._writing = 0
+                    self._condition.notify_all()
+        finally:
+            for conn in self._connections.values():
+                conn.close()
+
+            self._connections.clear()
+
+    def _write_batch(self, db_file: str, tenant: str, upsert: bool, rows: list) -> None:
+        """
+        Function to write a batch of rows in one transaction. If the transaction fails (and is rolled back), the batch
+        is counted as failed, and its rows are written again one per transaction, so that only the rows that fail on
+        their own are lost (and kept, see failed_rows).
+
+        :param db_file: str
+        :param tenant: str
+        :param upsert: bool
+        :param rows: list
+        :return: None
+        """
+        start_time = _time.perf_counter()
+
+        try:
+            inserted, unchanged, rejected = self._write_rows(db_file, tenant, upsert, rows)
+        except Exception as e:
+            with self._condition:
+                self.failed += 1
+                self.last_error = repr(e)
+
+            metrics.increment('ingest_failed_batches')
+            inserted, unchanged, rejected = 0, 0, 0
+
+            for row in rows:
+                try:
+                    row_inserted, row_unchanged, row_rejected = self._write_rows(db_file, tenant, upsert, [row])
+                except Exception as e:
+                    with self._condition:
+                        self.failed_accounts += 1
+                        self.last_error = repr(e)
+                        self._failed_rows.append(((db_file, tenant), row, repr(e)))
+
+                    metrics.increment('ingest_failed_accounts')
+                    continue
+
+                inserted += row_inserted
+                unchanged += row_unchanged
+                rejected += row_rejected
+
+        with self._condition:
+            self.written += inserted
+            self.unchanged += unchanged
+            self.rejected += rejected
+            self.batches += 1
+
+        metrics.observe('ingest_batch_seconds', _time.perf_counter() - start_time)
+        metrics.increment('ingested_accounts', inserted)
+
+    def _write_rows(self, db_file: str, tenant: str, upsert: bool, rows: list) -> (int, int, int):
+        """
+        Function to write rows in one transaction (rolled back if it fails), with the writer's connection to the
+        database file, and return the numbers of inserted (or changed), unchanged and rejected accounts.
+
+        :param db_file: str
+        :param tenant: str
+        :param upsert: bool
+        :param rows: list
+        :return: (int, int, int)
+        """
+        conn = self._connections.get(db_file)
+
+        if conn is None:
+            conn = self._connections[db_file] = connect(db_file, tenant)
+            initialise_database(conn)
+
+        conn.tenant = tenant
+
+        with conn:
+            if upsert:
+                return upsert_accounts(conn, rows, chunk_size=self.batch_size)
+
+            inserted, rejected = insert_accounts(conn, rows, chunk_size=self.batch_size)
+
+        return inserted, 0, rejected
+
+
+def parse_account(value: _t.Any) -> _t.Optional[list]:
+    """
+    Function to return the [graph, user, followers, following] row (see insert_accounts) of a posted account, given as
+    {"graph": ..., "account": ..., "followers": [...], "following": [...]}, where the follower and following accounts
+    are lists of names or comma-separated strings, and may be left out. None is returned if the account is not valid.
+
+    :param value: any (decoded json)
+    :return: list
+    """
+    if not isinstance(value, dict):
+        return None
+
+    graph_name, account_name = value.get('graph'), value.get('account')
+
+    if not isinstance(graph_name, str) or not isinstance(account_name, str) or not graph_name.strip() or not account_name.strip():
+        return None
+
+    row = [graph_name, account_name]
+
+    for key in ('followers', 'following'):
+        accounts = value.get(key, [])
+
+        if isinstance(accounts, list) and all(isinstance(v, str) for v in accounts):
+            accounts = [v.strip() for v in accounts if v.strip()]
+        elif not isinstance(accounts, str):
+            return None
+
+        row.append(accounts)
+
+    return row
+
+
+def parse_ndjson(lines: _t.Iterable[bytes]) -> _t.Iterator[_t.Any]:
+    """
+    Function to decode the json value of each non-empty line of a newline-delimited json body. Lines that are not valid
+    json are yielded as None.
+
+    :param lines: iterable
+    :return: iterator
+    """
+    for line in lines:
+        if not line.strip():
+            continue
+
+        try:
+            yield _json.loads(line)
+        except ValueError:
+            yield None
@@ -0,0 +1,318 @@
+import bisect as _bisect
+import contextlib as _contextlib
+import contextvars as _contextvars
+import os as _os
+import threading as _threading
+import time as _time
+import typing as _t
+
+# upper bounds (in seconds) of the buckets of the stage and request duration histograms
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# prefix of the name of every metric
+METRIC_PREFIX = 'graphexplore_'
+
+
+class Metrics:
+    """
+    Define the class used to aggregate duration histograms and counters, and render them in the Prometheus text
+    format. Each metric is identified by its name and a dictionary of labels, e.g. ('stage_seconds', {'stage': 'layout'}).
+    """
+    def __init__(self, buckets: tuple=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = {}
+        self._lock = _threading.Lock()
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """
+        Function to add a value (e.g. a duration in seconds) to a histogram.
+
+        :param name: str
+        :param value: float
+        :param labels: str
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+
+            if histogram is None:
+                # the counts of each bucket (the last one is +Inf), the sum of the values, and their number
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            histogram[0][_bisect.bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def increment(self, name: str, value: float=1, **labels) -> None:
+        """
+        Function to add a value to a counter.
+
+        :param name: str
+        :param value: float
+        :param labels: str
+        :return: None
+        """
+        key = (name, tuple(sorted(labels.items())))
+
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self) -> str:
+        """
+        Function to return every metric in the Prometheus text exposition format.
+
+        :return: str
+        """
+        lines = []
+
+        with self._lock:
+            histograms = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        for names, kind in ((sorted({k[0] for k, v in histograms}), 'histogram'), (sorted({k[0] for k, v in counters}), 'counter')):
+            for name in names:
+                lines.append('# TYPE ' + METRIC_PREFIX + name + ' ' + kind)
+
+                if kind == 'histogram':
+                    for (_, labels), (counts, total, count) in (v for v in histograms if v[0][0] == name):
+                        cumulative = 0
+
+                        for bound, bucket_count in zip([format(v, 'g') for v in self.buckets] + ['+Inf'], counts):
+                            cumulative += bucket_count
+                            lines.append(METRIC_PREFIX + name + '_bucket' + _format_labels(labels + (('le', bound),)) + ' ' + str(cumulative))
+
+                        lines.append(METRIC_PREFIX + name + '_sum' + _format_labels(labels) + ' ' + repr(total))
+                        lines.append(METRIC_PREFIX + name + '_count' + _format_labels(labels) + ' ' + str(count))
+                else:
+                    for (_, labels), value in (v for v in counters if v[0][0] == name):
+                        lines.append(METRIC_PREFIX + name + '_total' + _format_labels(labels) + ' ' + format(value, 'g'))
+
+        return '\n'.join(lines) + '\n'
+
+
+class Recording:
+    """
+    Define the class used to collect the stage timings and counts of one request or job, so that they can be returned
+    in a Server-Timing header, or sent from a worker process to the process that serves /metrics.
+    """
+    def __init__(self, stages: list=None, counts: dict=None):
+        self.stages = stages if stages is not None else []
+        self.counts = counts if counts is not None else {}
+
+    def to_dict(self) -> dict:
+        """
+        Function to return the recording as a json-serializable dictionary.
+
+        :return: dict
+        """
+        return {'stages': self.stages, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, values: dict) -> 'Recording':
+        """
+        Function to return the recording stored in a dictionary by to_dict.
+
+        :param values: dict
+        :return: Recording
+        """
+        return cls([tuple(v) for v in values['stages']], dict(values['counts']))
+
+    def server_timing(self) -> str:
+        """
+        Function to return the value of a Server-Timing header with the total duration (in milliseconds) of each stage,
+        in the order the stages first ran.
+
+        :return: str
+        """
+        durations = {}
+
+        for name, seconds in self.stages:
+            durations[name] = durations.get(name, 0.0) + seconds
+
+        return ', '.join(name + ';dur=' + format(seconds * 1000, '.1f') for name, seconds in durations.items())
+
+
+# metrics of the requests and jobs handled by this process (and the jobs it submitted)
+metrics = Metrics()
+
+# recording of the current request or job, if one is active
+_recording = _contextvars.ContextVar('recording', default=None)
+
+
+@_contextlib.contextmanager
+def stage(name: str) -> _t.Iterator[None]:
+    """
+    Function to time a block of code as a named stage (e.g. 'sql', 'layout') of the active recording (see record).
+    Nothing is timed when there is no active recording, so instrumented code costs nothing when instrumentation is
+    disabled.
+
+    :param name: str
+    :return: context manager
+    """
+    recording = _recording.get()
+
+    if recording is None:
+        yield
+        return
+
+    start_time = _time.perf_counter()
+
+    try:
+        yield
+    finally:
+        recording.stages.append((name, _time.perf_counter() - start_time))
+
+
+def count(name: str, value: float=1) -> None:
+    """
+    Function to add a value to a counter (e.g. the number of edges that were analyzed) of the active recording, if
+    there is one.
+
+    :param name: str
+    :param value: float
+    :return: None
+    """
+    recording = _recording.get()
+
+    if recording is not None:
+        recording.counts[name] = recording.counts.get(name, 0) + value
+
+
+def counted(values: _t.Iterable, name: str) -> _t.Iterator:
+    """
+    Function to yield the values of an iterable (e.g. the edges streamed from a cursor), and add their number to a
+    counter of the active recording once the iterable is exhausted, so that a stream can be counted without being
+    held in memory.
+
+    :param values: iterable
+    :param name: str
+    :return: iterator
+    """
+    total = 0
+
+    for total, value in enumerate(values, 1):
+        yield value
+
+    count(name, total)
+
+
+def start_recording() -> (Recording, _contextvars.Token):
+    """
+    Function to start a recording in the current context, and return it with the token used to stop it.
+
+    :return: (Recording, contextvars.Token)
+    """
+    recording = Recording()
+
+    return recording, _recording.set(recording)
+
+
+def stop_recording(token: _contextvars.Token) -> None:
+    """
+    Function to stop the recording started with a token (see start_recording).
+
+    :param token: contextvars.Token
+    :return: None
+    """
+    _recording.reset(token)
+
+
+@_contextlib.contextmanager
+def record() -> _t.Iterator[Recording]:
+    """
+    Function to collect the stages and counts of a block of code in a Recording (which can be added to the metrics
+    with observe_recording).
+
+    :return: context manager (yielding the Recording)
+    """
+    recording, token = start_recording()
+
+    try:
+        yield recording
+    finally:
+        stop_recording(token)
+
+
+def observe_recording(recording: Recording) -> None:
+    """
+    Function to add the stages and counts of a recording to the metrics.
+
+    :param recording: Recording
+    :return: None
+    """
+    for name, seconds in recording.stages:
+        metrics.observe('stage_seconds', seconds, stage=name)
+
+    for name, value in recording.counts.items():
+        metrics.increment(name, value)
+
+
+def start_profiler(kind: str='cprofile') -> _t.Any:
+    """
+    Function to start profiling the current thread, with cProfile, or with pyinstrument if kind is 'pyinstrument' and
+    the package is installed.
+
+    :param kind: str
+    :return: cProfile.Profile or pyinstrument.Profiler
+    """
+    if kind == 'pyinstrument':
+        try:
+            import pyinstrument
+        except ImportError:
+            pass
+        else:
+            profiler = pyinstrument.Profiler()
+            profiler.start()
+
+            return profiler
+
+    import cProfile
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    return profiler
+
+
+def stop_profiler(profiler: _t.Any, directory: str, name: str) -> str:
+    """
+    Function to stop a profiler started with start_profiler, and save its results to a file in a directory: a .prof
+    file (which can be read with pstats or snakeviz) for cProfile, or an html report for pyinstrument.
+
+    :param profiler: cProfile.Profile or pyinstrument.Profiler
+    :param directory: str
+    :param name: str (file name, without extension)
+    :return: str (path of the file)
+    """
+    import cProfile
+
+    _os.makedirs(directory, exist_ok=True)
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        path = _os.path.join(directory, name + '.prof')
+        profiler.dump_stats(path)
+    else:
+        profiler.stop()
+        path = _os.path.join(directory, name + '.html')
+
+        with open(path, 'w') as file:
+            file.write(profiler.output_html())
+
+    return path
+
+
+def _format_labels(labels: tuple) -> str:
+    """
+    Function to format (name, value) label pairs as a Prometheus label set, e.g. {stage="layout",le="0.5"}.
+
+    :param labels: tuple
+    :return: str
+    """
+    if len(labels) == 0:
+        return ''
+
+    return '{' + ','.join(k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for k, v in labels) + '}'
@@ -0,0 +1,272 @@
+import concurrent.futures as _futures
+import hashlib as _hashlib
+import json as _json
+import os as _os
+import pickle as _pickle
+import socket as _socket
+import sqlite3 as _sql
+import threading as _threading
+import time as _time
+import typing as _t
+import uuid as _uuid
+
+from lib.constants import JobStatus
+from lib.database import connect
+from lib.instrumentation import Recording, observe_recording, record
+
+# finished jobs (and their results) are deleted once they are older than this, in seconds
+JOB_RETENTION = 60 * 60
+
+# identifies this run of the process, so that a later process that reuses its pid does not take over its jobs
+_PROCESS_TOKEN = _uuid.uuid4().hex
+
+
+class JobQueueFull(Exception):
+    """
+    Define the exception raised when a job is submitted while the queue already holds its maximum number of unfinished
+    jobs.
+    """
+
+
+class JobQueue:
+    """
+    Define the class used to run long jobs (such as an analysis) in a pool of worker processes. The status and result of
+    every job is kept in a SQLite file, so that it can be polled by id from any request. Jobs are deduplicated by key:
+    submitting a key that already has a queued, running or finished job returns the id of that job, so keys should
+    include the version of the graph the job reads (see lib.database.get_graph_version). Each job is owned by the
+    process that submitted it (and runs its worker processes), so that several app processes can share the jobs file.
+    """
+    def __init__(self, db_file: str, max_workers: int=2, max_pending: int=16, retention: float=JOB_RETENTION, executor: _futures.Executor=None):
+        self.db_file = db_file
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention = retention
+        self._executor = executor
+        self._initialised = False
+        self._lock = _threading.Lock()
+
+    def submit(self, key: tuple, function: _t.Callable, *args) -> str:
+        """
+        Function to queue function(*args) to run in a worker process, and return the id of its job (or of an existing
+        job with the same key). The function and its arguments must be picklable.
+
+        :param key: tuple
+        :param function: callable (a module-level function)
+        :param args: any
+        :return: str (job id)
+        """
+        job_key = _hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+
+        with self._lock:
+            conn = self._connect()
+
+            try:
+                with conn:
+                    conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?", (JobStatus.done.value, JobStatus.failed.value, _time.time() - self.retention))
+
+                    row = conn.execute("SELECT id FROM jobs WHERE key = ? AND status != ?", (job_key, JobStatus.failed.value)).fetchone()
+
+                    if row is not None:
+                        return row[0]
+
+                    pending = conn.execute("SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", (JobStatus.queued.value, JobStatus.running.value)).fetchone()[0]
+
+                    if pending >= self.max_pending:
+                        raise JobQueueFull('the job queue already holds ' + str(pending) + ' unfinished jobs')
+
+                    job_id = _uuid.uuid4().hex
+                    conn.execute("INSERT INTO jobs (id, key, key_data, status, created, owner) VALUES (?, ?, ?, ?, ?, ?)",
+                                 (job_id, job_key, _pickle.dumps(key, protocol=_pickle.HIGHEST_PROTOCOL), JobStatus.queued.value, _time.time(), _process_owner()))
+            finally:
+                conn.close()
+
+            if self._executor is None:
+                self._executor = _futures.ProcessPoolExecutor(max_workers=self.max_workers)
+
+            future = self._executor.submit(run_job, self.db_file, job_id, function, args)
+
+        future.add_done_callback(lambda f: self._record_crash(job_id, f))
+        future.add_done_callback(lambda f: self._observe_recording(job_id, f))
+
+        return job_id
+
+    def get(self, job_id: str) -> _t.Optional[dict]:
+        """
+        Function to return the status and key of a job, with its result once it is done (or its error once it has
+        failed), or None if there is no job with this id.
+
+        :param job_id: str
+        :return: dict (with the keys 'id', 'key', 'status', 'result' and 'error')
+        """
+        conn = self._connect()
+
+        try:
+            row = conn.execute("SELECT key_data, status, result, error FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+
+        key, status, result, error = row
+
+        return {'id': job_id, 'key': _pickle.loads(key) if key is not None else None, 'status': status,
+                'result': _pickle.loads(result) if result is not None else None, 'error': error}
+
+    def shutdown(self, wait: bool=True) -> None:
+        """
+        Function to stop the worker processes, once (if wait is True) the running jobs have finished.
+
+        :param wait: bool
+        :return: None
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait)
+                self._executor = None
+
+    def _connect(self) -> _sql.Connection:
+        """
+        Function to open a connection to the jobs file, creating the jobs table the first time it is used. Jobs that
+        were left unfinished by a process that is no longer running (e.g. a previous run of the app) are marked as
+        failed, so that they can be submitted again. The jobs of other running processes that share the file are left
+        alone.
+
+        :return: sqlite3.Connection
+        """
+        conn = connect(self.db_file)
+
+        if not self._initialised:
+            with conn:
+                conn.execute("CREATE TABLE IF NOT EXISTS jobs (id text PRIMARY KEY, key text, status text, result blob, error text, created real, finished real, recording text, owner text, key_data blob)")
+                conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_key ON jobs (key)")
+                columns = [v[1] for v in conn.execute("PRAGMA table_info(jobs)")]
+
+                # jobs files created before the stage timings, the owners and the keys of jobs were recorded
+                for column, column_type in (('recording', 'text'), ('owner', 'text'), ('key_data', 'blob')):
+                    if column not in columns:
+                        conn.execute("ALTER TABLE jobs ADD COLUMN " + column + " " + column_type)
+
+                unfinished = conn.execute("SELECT id, owner FROM jobs WHERE status IN (?, ?)", (JobStatus.queued.value, JobStatus.running.value)).fetchall()
+                interrupted = [(JobStatus.failed.value, 'interrupted', _time.time(), v) for v, owner in unfinished if not _owner_running(owner)]
+
+                conn.executemany("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?", interrupted)
+
+            self._initialised = True
+
+        return conn
+
+    def _record_crash(self, job_id: str, future: _futures.Future) -> None:
+        """
+        Function to mark a job as failed when its worker process could not run it (e.g. when the worker crashed, or the
+        function could not be pickled). Errors raised by the function itself are recorded by run_job.
+
+        :param job_id: str
+        :param future: concurrent.futures.Future
+        :return: None
+        """
+        if future.cancelled() or future.exception() is None:
+            return
+
+        conn = connect(self.db_file)
+
+        try:
+            with conn:
+                conn.execute("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? AND status IN (?, ?)", (JobStatus.failed.value, repr(future.exception()), _time.time(), job_id, JobStatus.queued.value, JobStatus.running.value))
+        finally:
+            conn.close()
+
+    def _observe_recording(self, job_id: str, future: _futures.Future) -> None:
+        """
+        Function to add the stage timings and counts recorded by a finished job to the metrics of this process (see
+        lib.instrumentation), once per job.
+
+        :param job_id: str
+        :param future: concurrent.futures.Future
+        :return: None
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+
+        conn = connect(self.db_file)
+
+        try:
+            row = conn.execute("SELECT recording FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+
+        if row is not None and row[0] is not None:
+            observe_recording(Recording.from_dict(_json.loads(row[0])))
+
+
+def _process_owner() -> str:
+    """
+    Function to return the owner of the jobs submitted by this process: its host name, pid and process token.
+
+    :return: str
+    """
+    return _socket.gethostname() + ':' + str(_os.getpid()) + ':' + _PROCESS_TOKEN
+
+
+def _owner_running(owner: _t.Optional[str]) -> bool:
+    """
+    Function to return whether the process that owns a job may still be running. Jobs without an owner were submitted
+    before owners were recorded, so they are not, and the processes of other hosts are assumed to be running, since
+    they cannot be checked from this one.
+
+    :param owner: str (see _process_owner)
+    :return: bool
+    """
+    if owner is None:
+        return False
+
+    host, pid, token = owner.rsplit(':', 2)
+
+    if host != _socket.gethostname():
+        return True
+
+    if int(pid) == _os.getpid():
+        return token == _PROCESS_TOKEN
+
+    try:
+        _os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # the process exists, but belongs to another user
+        return True
+
+    return True
+
+
+def run_job(db_file: str, job_id: str, function: _t.Callable, args: tuple) -> None:
+    """
+    Function to run a job in a worker process, and record its status and (pickled) result in the jobs file.
+
+    :param db_file: str
+    :param job_id: str
+    :param function: callable
+    :param args: tuple
+    :return: None
+    """
+    # the stages timed by the function (see lib.instrumentation.stage) are stored with the result, so that the process
+    # that submitted the job can add them to its metrics
+    conn = connect(db_file)
+
+    try:
+        with conn:
+            conn.execute("UPDATE jobs SET status = ? WHERE id = ?", (JobStatus.running.value, job_id))
+
+        try:
+            with record() as recording:
+                result = _pickle.dumps(function(*args), protocol=_pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            with conn:
+                conn.execute("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ?", (JobStatus.failed.value, repr(e), _time.time(), job_id))
+
+            return
+
+        with conn:
+            conn.execute("UPDATE jobs SET status = ?, result = ?, finished = ?, recording = ? WHERE id = ?", (JobStatus.done.value, result, _time.time(), _json.dumps(recording.to_dict()), job_id))
+    finally:
+        conn.close()
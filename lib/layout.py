@@ -0,0 +1,184 @@
+import networkx as nx
+import numpy as _np
+import scipy.sparse as _sp
+import scipy.sparse.linalg as _spla
+
+from lib.constants import GraphLayoutTypes
+
+# graphs with more nodes than this are reduced to a degree-filtered view before they are laid out and plotted
+MAX_PLOT_NODES = 2000
+
+# graphs with more nodes than this use the grid-accelerated force layout instead of nx.spring_layout
+MAX_SPRING_LAYOUT_NODES = 500
+
+
+def compute_plot_layout(graph: nx.Graph, major_accounts: list, layout: str=GraphLayoutTypes.spectral_layout.value, max_nodes: int=MAX_PLOT_NODES, scale: float=10) -> dict:
+    """
+    Function to compute the node positions used to plot a graph. Graphs with more than max_nodes nodes are first reduced
+    to a degree-filtered view, so only the nodes in the returned dictionary should be plotted.
+
+    :param graph: nx.Graph
+    :param major_accounts: list
+    :param layout: str
+    :param max_nodes: int
+    :param scale: float
+    :return: dict (node -> (x, y))
+    """
+    if graph.number_of_nodes() > max_nodes:
+        graph = filter_graph(graph, major_accounts, max_nodes)
+
+    nodes = list(graph.nodes)
+
+    if len(nodes) == 0:
+        return {}
+
+    if layout == GraphLayoutTypes.circular_layout.value:
+        positions = nx.circular_layout(graph)
+        positions = _np.array([positions[v] for v in nodes])
+    elif layout == GraphLayoutTypes.spring_layout.value and len(nodes) <= MAX_SPRING_LAYOUT_NODES:
+        positions = nx.spring_layout(graph, seed=0)
+        positions = _np.array([positions[v] for v in nodes])
+    elif layout in (GraphLayoutTypes.spring_layout.value, GraphLayoutTypes.force_layout.value):
+        positions = grid_force_layout(graph)
+    else:
+        positions = sparse_spectral_layout(graph)
+
+    positions = _rescale(positions, scale)
+
+    return {v: (float(x), float(y)) for v, (x, y) in zip(nodes, positions)}
+
+
+def filter_graph(graph: nx.Graph, major_accounts: list, max_nodes: int=MAX_PLOT_NODES) -> nx.Graph:
+    """
+    Function to return a view of a graph with at most max_nodes nodes: the major accounts, followed by the other
+    accounts with the highest degree.
+
+    :param graph: nx.Graph
+    :param major_accounts: list
+    :param max_nodes: int
+    :return: nx.Graph (subgraph view)
+    """
+    major_accounts = [v for v in dict.fromkeys(major_accounts) if v in graph][:max_nodes]
+    excluded = set(major_accounts)
+
+    degrees = [(k, v) for k, v in graph.degree if k not in excluded]
+    degrees.sort(key=lambda v: v[1], reverse=True)
+
+    nodes = major_accounts + [k for k, v in degrees[:max_nodes - len(major_accounts)]]
+
+    return graph.subgraph(nodes)
+
+
+def sparse_spectral_layout(graph: nx.Graph) -> _np.ndarray:
+    """
+    Function to compute a spectral layout from the two smallest non-trivial eigenvectors of the normalized graph
+    Laplacian. They are found as the largest eigenvectors of the normalized adjacency matrix, which a sparse Lanczos
+    solver converges to quickly, so that no dense N x N matrix or factorization is ever built.
+
+    :param graph: nx.Graph
+    :return: np.ndarray (N x 2, in the order of graph.nodes)
+    """
+    n = graph.number_of_nodes()
+
+    if n <= 2:
+        return _np.array([[0.0, 0.0], [1.0, 0.0]])[:n]
+
+    adjacency = _sp.csr_matrix(nx.to_scipy_sparse_array(graph, format='csr', dtype=float))
+    degrees = _np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse_sqrt_degrees = _np.divide(1.0, _np.sqrt(degrees), out=_np.zeros(n), where=degrees > 0)
+    normalized = _sp.diags(inverse_sqrt_degrees) @ adjacency @ _sp.diags(inverse_sqrt_degrees)
+
+    if n <= 4:
+        # eigsh needs k < n - 1, so very small graphs are solved densely
+        eigenvalues, eigenvectors = _np.linalg.eigh(normalized.toarray())
+    else:
+        eigenvalues, eigenvectors = _spla.eigsh(normalized, k=3, which='LA', v0=_np.ones(n))
+
+    # order by descending eigenvalue, skip the trivial eigenvector, and map back to random-walk eigenvectors
+    eigenvectors = eigenvectors[:, _np.argsort(-eigenvalues)]
+
+    return eigenvectors[:, 1:3] * inverse_sqrt_degrees[:, None]
+
+
+def grid_force_layout(graph: nx.Graph, iterations: int=50, grid_size: int=20, seed: int=0, chunk_size: int=4096) -> _np.ndarray:
+    """
+    Function to compute a Fruchterman-Reingold force layout, where the repulsion between nodes is approximated on a
+    grid: each node is repelled by the centroid of every occupied grid cell, weighted by the number of nodes in the
+    cell, rather than by every other node. Each iteration costs O(N * grid_size^2 + E) instead of O(N^2).
+
+    :param graph: nx.Graph
+    :param iterations: int
+    :param grid_size: int
+    :param seed: int
+    :param chunk_size: int (number of nodes whose repulsion is computed at once, to bound memory use)
+    :return: np.ndarray (N x 2, in the order of graph.nodes)
+    """
+    n = graph.number_of_nodes()
+    node_ids = {v: i for i, v in enumerate(graph.nodes)}
+    edges = _np.array([(node_ids[u], node_ids[v]) for u, v in graph.edges if u != v], dtype=_np.int64).reshape(-1, 2)
+
+    positions = _np.random.default_rng(seed).random((n, 2))
+    k = _np.sqrt(1.0 / max(n, 1))
+    temperature = 0.1
+
+    for iteration in range(iterations):
+        # assign nodes to grid cells, and compute the node count and centroid of each cell
+        low, high = positions.min(axis=0), positions.max(axis=0)
+        cells = _np.clip(((positions - low) / _np.maximum(high - low, 1e-9) * grid_size).astype(_np.int64), 0, grid_size - 1)
+        cell_ids = cells[:, 0] * grid_size + cells[:, 1]
+
+        counts = _np.bincount(cell_ids, minlength=grid_size * grid_size).astype(float)
+        sums = _np.stack([_np.bincount(cell_ids, weights=positions[:, i], minlength=grid_size * grid_size) for i in range(2)], axis=1)
+        occupied = _np.flatnonzero(counts)
+        centroids = sums[occupied] / counts[occupied, None]
+
+        displacement = _np.zeros((n, 2))
+
+        for start in range(0, n, chunk_size):
+            chunk = slice(start, start + chunk_size)
+            delta = positions[chunk, None, :] - centroids[None, :, :]
+            distance = _np.maximum((delta ** 2).sum(axis=2), 1e-9)
+            weights = counts[occupied][None, :] * k * k / distance
+
+            # a node's own cell is replaced by the centroid of the other nodes in that cell
+            own = _np.searchsorted(occupied, cell_ids[chunk])
+            rows = _np.arange(len(own))
+            weights[rows, own] = 0
+            displacement[chunk] = (weights[:, :, None] * delta).sum(axis=1)
+
+            own_counts = counts[occupied][own] - 1
+            own_centroids = (sums[occupied][own] - positions[chunk]) / _np.maximum(own_counts, 1)[:, None]
+            own_delta = positions[chunk] - own_centroids
+            own_distance = _np.maximum((own_delta ** 2).sum(axis=1), 1e-9)
+            displacement[chunk] += (own_counts * k * k / own_distance)[:, None] * own_delta
+
+        # attraction along the edges
+        if len(edges) > 0:
+            delta = positions[edges[:, 0]] - positions[edges[:, 1]]
+            attraction = delta * _np.sqrt((delta ** 2).sum(axis=1))[:, None] / k
+            _np.add.at(displacement, edges[:, 0], -attraction)
+            _np.add.at(displacement, edges[:, 1], attraction)
+
+        length = _np.maximum(_np.sqrt((displacement ** 2).sum(axis=1)), 1e-9)
+        positions += displacement / length[:, None] * _np.minimum(length, temperature)[:, None]
+        temperature -= 0.1 / (iterations + 1)
+
+    return positions
+
+
+def _rescale(positions: _np.ndarray, scale: float) -> _np.ndarray:
+    """
+    Function to center positions on the origin, and scale them so that the largest coordinate is equal to scale (in the
+    same way as nx.rescale_layout).
+
+    :param positions: np.ndarray
+    :param scale: float
+    :return: np.ndarray
+    """
+    positions = positions - positions.mean(axis=0)
+    extent = _np.abs(positions).max()
+
+    if extent > 0:
+        positions = positions * scale / extent
+
+    return positions
@@ -0,0 +1,87 @@
+import numpy as _np
+
+from lib.constants import RenderModes
+
+# in the 'auto' render mode, plots with more edges than this are drawn with the WebGL backend
+WEBGL_EDGE_THRESHOLD = 2000
+
+# in the 'auto' render mode, plots with more edges than this have their edges rasterized on the server (the image
+# is a fixed size, so it only saves page weight once there are more edges than pixels worth sending)
+RASTER_EDGE_THRESHOLD = 50000
+
+# size (in pixels) of the image that edges are rasterized into
+RASTER_SIZE = 400
+
+# palette used to shade rasterized edges: black, with an opacity that increases with the edge density of a pixel
+RASTER_PALETTE = [(0, 0, 0, i / 255) for i in range(256)]
+
+
+def resolve_render_mode(render_mode: str, edge_count: int) -> str:
+    """
+    Function to return the render mode used to draw a plot: 'auto' picks canvas, webgl or raster depending on the number
+    of edges, and any unknown mode falls back to canvas.
+
+    :param render_mode: str
+    :param edge_count: int
+    :return: str
+    """
+    if render_mode == RenderModes.auto.value:
+        if edge_count > RASTER_EDGE_THRESHOLD:
+            return RenderModes.raster.value
+        elif edge_count > WEBGL_EDGE_THRESHOLD:
+            return RenderModes.webgl.value
+        else:
+            return RenderModes.canvas.value
+
+    if render_mode in (RenderModes.webgl.value, RenderModes.raster.value):
+        return render_mode
+
+    return RenderModes.canvas.value
+
+
+def rasterize_edges(x0: _np.ndarray, y0: _np.ndarray, x1: _np.ndarray, y1: _np.ndarray, x_range: tuple, y_range: tuple, width: int=RASTER_SIZE, height: int=RASTER_SIZE, chunk_size: int=2048) -> _np.ndarray:
+    """
+    Function to draw straight edges into an image, where the value of each pixel is the (log-scaled) number of edges
+    that cross it. Each edge is sampled once per pixel along its length, and the samples are accumulated with
+    np.bincount, so that the cost depends on the number of edges and the image size but never on the browser.
+
+    :param x0: np.ndarray (x coordinates of the edge starts)
+    :param y0: np.ndarray (y coordinates of the edge starts)
+    :param x1: np.ndarray (x coordinates of the edge ends)
+    :param y1: np.ndarray (y coordinates of the edge ends)
+    :param x_range: tuple (min, max)
+    :param y_range: tuple (min, max)
+    :param width: int
+    :param height: int
+    :param chunk_size: int (number of edges sampled at once, to bound memory use)
+    :return: np.ndarray (height x width, uint8, with row 0 at the bottom of the image as expected by Bokeh)
+    """
+    x_scale = (width - 1) / (x_range[1] - x_range[0])
+    y_scale = (height - 1) / (y_range[1] - y_range[0])
+
+    counts = _np.zeros(width * height, dtype=_np.int64)
+
+    for start in range(0, len(x0), chunk_size):
+        chunk = slice(start, start + chunk_size)
+        px0, px1 = (x0[chunk] - x_range[0]) * x_scale, (x1[chunk] - x_range[0]) * x_scale
+        py0, py1 = (y0[chunk] - y_range[0]) * y_scale, (y1[chunk] - y_range[0]) * y_scale
+
+        # one sample per pixel along the longest axis of each edge
+        steps = _np.ceil(_np.maximum(_np.abs(px1 - px0), _np.abs(py1 - py0))).astype(_np.int64) + 1
+        steps = _np.minimum(steps, width + height)
+        edge_index = _np.repeat(_np.arange(len(steps)), steps)
+        offsets = _np.arange(len(edge_index)) - _np.repeat(_np.cumsum(steps) - steps, steps)
+        t = offsets / _np.maximum(steps - 1, 1)[edge_index]
+
+        px = _np.rint(px0[edge_index] + t * (px1 - px0)[edge_index]).astype(_np.int64)
+        py = _np.rint(py0[edge_index] + t * (py1 - py0)[edge_index]).astype(_np.int64)
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+
+        counts += _np.bincount(py[inside] * width + px[inside], minlength=width * height)
+
+    if counts.max() == 0:
+        return _np.zeros((height, width), dtype=_np.uint8)
+
+    shade = _np.log1p(counts) / _np.log1p(counts.max())
+
+    return _np.rint(shade * 255).astype(_np.uint8).reshape(height, width)
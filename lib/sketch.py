@@ -0,0 +1,284 @@
+import hashlib as _hashlib
+import itertools as _itertools
+import numpy as _np
+import typing as _t
+
+from lib.constants import LinkTypes
+
+# number of counters per row of a Count-Min sketch (a power of two): each estimate exceeds the true count by at most
+# e / SKETCH_WIDTH of the number of counted links, with probability 1 - exp(-SKETCH_DEPTH)
+SKETCH_WIDTH = 2 ** 16
+
+# number of rows (independent hash functions) of a Count-Min sketch
+SKETCH_DEPTH = 4
+
+# number of candidates tracked by the heavy hitters summary
+HEAVY_HITTERS = 1024
+
+# number of hash functions of a MinHash signature (the standard error of a similarity is about 1 / sqrt(MINHASH_SIZE))
+MINHASH_SIZE = 128
+
+# number of edges hashed and counted at a time
+SKETCH_BATCH_SIZE = 65536
+
+# number of keys hashed at a time by each MinHash hash function
+MINHASH_CHUNK_SIZE = 4096
+
+
+class CountMinSketch:
+    """
+    Define the class used to count the occurrences of hashed keys in a fixed depth x width table of counters. Each key
+    is counted once per row, in the column given by that row's hash function, and its count is estimated as the
+    minimum of its counters: estimates are never below the true count, and exceed it by at most e / width of the total
+    count with probability 1 - exp(-depth). Memory use does not depend on the number of keys.
+    """
+    def __init__(self, width: int=SKETCH_WIDTH, depth: int=SKETCH_DEPTH, seed: int=0):
+        if width < 2 or width & (width - 1) != 0:
+            raise ValueError('the width of the sketch must be a power of two')
+
+        rng = _np.random.default_rng(seed)
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.table = _np.zeros((depth, width), dtype=_np.int64)
+
+        # multiply-shift hash functions: the top log2(width) bits of a * key + b (modulo 2 ** 64), with an odd a
+        self._a = rng.integers(0, 2 ** 63, size=depth, dtype=_np.uint64) * _np.uint64(2) + _np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=depth, dtype=_np.uint64)
+        self._shift = _np.uint64(64 - (width.bit_length() - 1))
+
+    def add(self, keys: _np.ndarray) -> None:
+        """
+        Function to count one occurrence of each key (keys can be repeated).
+
+        :param keys: np.ndarray (uint64, see hash_names)
+        :return: None
+        """
+        for row, columns in enumerate(self._columns(keys)):
+            self.table[row] += _np.bincount(columns, minlength=self.width)
+
+        self.total += len(keys)
+
+    def estimate(self, keys: _np.ndarray) -> _np.ndarray:
+        """
+        Function to return the estimated count of each key.
+
+        :param keys: np.ndarray (uint64)
+        :return: np.ndarray
+        """
+        if len(keys) == 0:
+            return _np.zeros(0, dtype=_np.int64)
+
+        return _np.min([self.table[row][columns] for row, columns in enumerate(self._columns(keys))], axis=0)
+
+    def error_bound(self) -> float:
+        """
+        Function to return the amount by which an estimate may exceed the true count (with probability
+        1 - exp(-depth)).
+
+        :return: float
+        """
+        return _np.e / self.width * self.total
+
+    def _columns(self, keys: _np.ndarray) -> _t.Iterator[_np.ndarray]:
+        """
+        Function to yield the column of each key in each row of the table.
+
+        :param keys: np.ndarray (uint64)
+        :return: iterator
+        """
+        keys = _np.asarray(keys, dtype=_np.uint64)
+
+        for a, b in zip(self._a, self._b):
+            yield ((keys * a + b) >> self._shift).astype(_np.intp)
+
+
+class HeavyHitters:
+    """
+    Define the class used to find the most frequent keys of a stream with the Misra-Gries summary: at most capacity
+    keys are tracked, and whenever more are seen the smallest counts are subtracted from all of them. Each batch of keys
+    is merged into the summary at once, so the memory use is bounded by the capacity plus the batch size. Every key
+    that occurs more than total / (capacity + 1) times is kept, with a count that is below its true count by at most
+    total / (capacity + 1).
+    """
+    def __init__(self, capacity: int=HEAVY_HITTERS):
+        self.capacity = capacity
+        self.total = 0
+        self.keys = _np.zeros(0, dtype=_np.uint64)
+        self.counts = _np.zeros(0, dtype=_np.int64)
+        self.names = {}
+
+    def add(self, keys: _np.ndarray, names: list) -> None:
+        """
+        Function to count one occurrence of each key, with the name the key was hashed from.
+
+        :param keys: np.ndarray (uint64, see hash_names)
+        :param names: list
+        :return: None
+        """
+        merged, inverse = _np.unique(_np.concatenate([self.keys, keys]), return_inverse=True)
+        counts = _np.bincount(inverse, weights=_np.concatenate([self.counts, _np.ones(len(keys), dtype=_np.int64)])).astype(_np.int64)
+
+        if len(merged) > self.capacity:
+            # subtracting the (capacity + 1)-th largest count leaves at most capacity positive counts
+            counts -= _np.partition(counts, len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1]
+            merged, counts = merged[counts > 0], counts[counts > 0]
+
+        batch_names = dict(zip(keys.tolist(), names))
+        self.names = {k: self.names[k] if k in self.names else batch_names[k] for k in merged.tolist()}
+        self.keys, self.counts = merged, counts
+        self.total += len(keys)
+
+    def error_bound(self) -> float:
+        """
+        Function to return the amount by which a count may be underestimated.
+
+        :return: float
+        """
+        return self.total / (self.capacity + 1)
+
+
+class MinHash:
+    """
+    Define the class used to compute MinHash signatures of sets of hashed keys: the minimum of each of size random hash
+    functions over the set. The fraction of equal values in the signatures of two sets estimates their Jaccard
+    similarity, so the similarity of two large sets can be estimated from size values each, whatever their size.
+    """
+    def __init__(self, size: int=MINHASH_SIZE, seed: int=0):
+        rng = _np.random.default_rng(seed)
+        self.size = size
+        self._a = rng.integers(0, 2 ** 63, size=size, dtype=_np.uint64) * _np.uint64(2) + _np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, size=size, dtype=_np.uint64)
+
+    def empty(self) -> _np.ndarray:
+        """
+        Function to return the signature of the empty set, to be updated with update.
+
+        :return: np.ndarray
+        """
+        return _np.full(self.size, _np.iinfo(_np.uint64).max, dtype=_np.uint64)
+
+    def update(self, signature: _np.ndarray, keys: _np.ndarray) -> None:
+        """
+        Function to add keys to the set of a signature, in place.
+
+        :param signature: np.ndarray
+        :param keys: np.ndarray (uint64)
+        :return: None
+        """
+        keys = _np.asarray(keys, dtype=_np.uint64)
+
+        # the keys are hashed in chunks, so that at most size x MINHASH_CHUNK_SIZE values are held at once
+        for start in range(0, len(keys), MINHASH_CHUNK_SIZE):
+            _np.minimum(signature, (keys[None, start:start + MINHASH_CHUNK_SIZE] * self._a[:, None] + self._b[:, None]).min(axis=1), out=signature)
+
+
+def hash_names(names: list) -> _np.ndarray:
+    """
+    Function to hash account names to 64-bit keys. The hash is the same in every process (unlike Python's hash of a
+    string), so sketches built from the same names can be compared or merged.
+
+    :param names: list
+    :return: np.ndarray (uint64)
+    """
+    return _np.frombuffer(b''.join(_hashlib.blake2b(v.encode('utf-8'), digest_size=8).digest() for v in names), dtype=_np.uint64)
+
+
+def get_edge_weights_sketch(graph_edges: _t.Iterable[tuple], major_accounts: list, mode: str=LinkTypes.common.value, threshold: int=1, top_k: int=None,
+                            width: int=SKETCH_WIDTH, depth: int=SKETCH_DEPTH, capacity: int=HEAVY_HITTERS, batch_size: int=SKETCH_BATCH_SIZE) -> list:
+    """
+    Function that returns an approximate, sorted list of (account, links) pairs for the common analysis type: the
+    accounts with more than threshold links from the graph's accounts, with the most linked first. The edges are
+    streamed in batches through a Count-Min sketch and a heavy hitters summary, so memory use is fixed, however many
+    edges there are: only the capacity most linked accounts can be returned, and their counts are Count-Min
+    estimates, which may exceed the true number of links by CountMinSketch.error_bound. Links are counted per edge,
+    as in reduce_graph.
+
+    :param graph_edges: iterable (of (account, linked account) pairs, e.g. a database cursor)
+    :param major_accounts: list
+    :param mode: str (only common is supported, as the least linked accounts cannot be found in fixed memory)
+    :param threshold: int
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :param width: int
+    :param depth: int
+    :param capacity: int
+    :param batch_size: int
+    :return: list
+    """
+    if mode != LinkTypes.common.value:
+        raise ValueError('approximate counts only support the common analysis type')
+
+    major_accounts = set(major_accounts)
+    sketch = CountMinSketch(width=width, depth=depth)
+    heavy_hitters = HeavyHitters(capacity=capacity)
+    graph_edges = iter(graph_edges)
+
+    for batch in iter(lambda: list(_itertools.islice(graph_edges, batch_size)), []):
+        names = [v for k, v in batch if v not in major_accounts]
+        keys = hash_names(names)
+        sketch.add(keys)
+        heavy_hitters.add(keys, names)
+
+    estimates = sketch.estimate(heavy_hitters.keys)
+    scores = [(heavy_hitters.names[k], int(v)) for k, v in zip(heavy_hitters.keys.tolist(), estimates.tolist()) if v > threshold]
+    scores.sort(key=lambda v: (-v[1], v[0]))
+
+    return scores[:top_k] if top_k is not None else scores
+
+
+def get_seed_signatures(graph_edges: _t.Iterable[tuple], size: int=MINHASH_SIZE, batch_size: int=SKETCH_BATCH_SIZE) -> dict:
+    """
+    Function to return the MinHash signature of the set of linked accounts of every account in a stream of (account,
+    linked account) pairs, using size values per account however many links it has.
+
+    :param graph_edges: iterable (e.g. a database cursor)
+    :param size: int
+    :param batch_size: int
+    :return: dict (account -> np.ndarray)
+    """
+    minhash = MinHash(size=size)
+    signatures = {}
+    graph_edges = iter(graph_edges)
+
+    for batch in iter(lambda: list(_itertools.islice(graph_edges, batch_size)), []):
+        keys = hash_names([v for k, v in batch])
+        start = 0
+
+        # the links of an account are usually stored together, so each batch is split into runs of the same account
+        for user, run in _itertools.groupby(k for k, v in batch):
+            end = start + sum(1 for _ in run)
+
+            if user not in signatures:
+                signatures[user] = minhash.empty()
+
+            minhash.update(signatures[user], keys[start:end])
+            start = end
+
+    return signatures
+
+
+def seed_similarities(signatures: dict, top_k: int=None) -> list:
+    """
+    Function that returns a sorted list of (account, account, similarity) triples for every pair of accounts with
+    MinHash signatures (see get_seed_signatures), where the similarity estimates the Jaccard similarity of their sets
+    of linked accounts.
+
+    :param signatures: dict
+    :param top_k: int (if given, only the top_k pairs are returned)
+    :return: list
+    """
+    names = list(signatures)
+
+    if len(names) < 2:
+        return []
+
+    matrix = _np.array([signatures[v] for v in names])
+    similarities = []
+
+    for i in range(len(names) - 1):
+        values = (matrix[i + 1:] == matrix[i]).mean(axis=1)
+        similarities += [(names[i], names[i + 1 + j], float(v)) for j, v in enumerate(values.tolist())]
+
+    similarities.sort(key=lambda v: -v[2])
+
+    return similarities[:top_k] if top_k is not None else similarities
@@ -0,0 +1,217 @@
+import glob as _glob
+import hashlib as _hashlib
+import numpy as _np
+import os as _os
+import scipy.sparse as _sp
+import shutil as _shutil
+import sqlite3 as _sql
+import tempfile as _tempfile
+import typing as _t
+
+from lib.account import AccountStore, _direction
+from lib.constants import AccountAttributes, LinkTypes
+from lib.database import _tenant, get_account_store, get_graph_version
+from lib.sparse import SCORING_MODES, rank_scores, reduce_counts, score_candidates
+
+# name of the directory (next to the database file) that snapshots are written to
+SNAPSHOT_DIRECTORY = 'snapshots'
+
+
+class SnapshotNames:
+    """
+    Define the class used to read the account names of a snapshot by id. The names are stored as one utf-8 blob with an
+    array of offsets, and each name is only decoded when it is read, so opening a snapshot never builds a list of names.
+    """
+    def __init__(self, blob: _np.ndarray, offsets: _np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, account_id: int) -> str:
+        return bytes(self.blob[self.offsets[account_id]:self.offsets[account_id + 1]]).decode('utf-8')
+
+
+class Snapshot:
+    """
+    Define the class used to read a graph snapshot: a directory of .npy files holding the account names (see
+    SnapshotNames), the ids of the graph's accounts, and, for each direction, the links in CSR form (the targets of
+    account i are targets[offsets[i]:offsets[i + 1]], with the number of times each link was stored in weights). The
+    arrays are memory-mapped read-only, so they are loaded lazily by the operating system, and every process that opens
+    the same snapshot shares one copy of it in the page cache. Every array is mapped when the snapshot is opened, so a
+    snapshot stays readable after its directory is removed (see load_snapshot).
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.names = SnapshotNames(self._load('names_blob'), self._load('names_offsets'))
+        self.accounts = self._load('accounts')
+        self._links = {v.value: (self._load(v.value + '_offsets'), self._load(v.value + '_targets'), self._load(v.value + '_weights')) for v in AccountAttributes}
+
+    def __len__(self):
+        return len(self.names)
+
+    def links(self, type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value]) -> (_np.ndarray, _np.ndarray, _np.ndarray):
+        """
+        Function to return the offsets, targets and weights arrays of the follower or following links.
+
+        :param type: str
+        :return: (np.ndarray, np.ndarray, np.ndarray)
+        """
+        return self._links[_direction(type)]
+
+    def _load(self, name: str) -> _np.ndarray:
+        """
+        Function to memory-map one of the arrays of the snapshot. Empty arrays cannot be memory-mapped, so they are read.
+
+        :param name: str
+        :return: np.ndarray
+        """
+        path = _os.path.join(self.path, name + '.npy')
+
+        try:
+            return _np.load(path, mmap_mode='r')
+        except ValueError:
+            return _np.load(path)
+
+
+def write_snapshot(store: AccountStore, path: str) -> None:
+    """
+    Function to write the accounts and links of an AccountStore to a snapshot directory (which must not exist). Duplicate
+    links are merged into a single target with a weight.
+
+    :param store: AccountStore
+    :param path: str
+    :return: None
+    """
+    _os.makedirs(path)
+
+    encoded = [v.encode('utf-8') for v in store.index.names]
+    offsets = _np.zeros(len(encoded) + 1, dtype=_np.int64)
+    offsets[1:] = _np.cumsum([len(v) for v in encoded])
+
+    _np.save(_os.path.join(path, 'names_blob.npy'), _np.frombuffer(b''.join(encoded), dtype=_np.uint8))
+    _np.save(_os.path.join(path, 'names_offsets.npy'), offsets)
+    _np.save(_os.path.join(path, 'accounts.npy'), _np.frombuffer(store.account_ids, dtype=_np.uint32).astype(_np.int32) if len(store) > 0 else _np.zeros(0, dtype=_np.int32))
+
+    n = len(store.index)
+
+    for type in AccountAttributes:
+        users, targets = store.edge_arrays(type.value)
+
+        # sort the links by account and target, and merge duplicates (so that the arrays form a canonical CSR matrix)
+        keys, counts = _np.unique(users.astype(_np.int64) * n + targets, return_counts=True)
+        link_users, link_targets = keys // n, keys % n
+
+        link_offsets = _np.zeros(n + 1, dtype=_np.int64)
+        link_offsets[1:] = _np.cumsum(_np.bincount(link_users, minlength=n))
+
+        _np.save(_os.path.join(path, type.value + '_offsets.npy'), link_offsets)
+        _np.save(_os.path.join(path, type.value + '_targets.npy'), link_targets.astype(_np.int32))
+        _np.save(_os.path.join(path, type.value + '_weights.npy'), counts.astype(_np.int32))
+
+
+def load_snapshot(conn: _sql.Connection, graph_name: str, directory: str=None) -> Snapshot:
+    """
+    Function to open the snapshot of the current version of a graph, building it from the database first if it does not
+    exist yet (e.g. after the graph was changed). Snapshots of older versions of the graph are then removed, but never
+    those of newer versions, which a process that read the graph later may have built. Snapshots are built in a
+    temporary directory and renamed into place, so concurrent processes never read a partial snapshot.
+
+    :param conn: sqlite3.Connection (to a database file)
+    :param graph_name: str
+    :param directory: str (defaults to a snapshots directory next to the database file)
+    :return: Snapshot
+    """
+    db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+
+    if not db_file:
+        raise ValueError('snapshots can only be built for a database file')
+
+    if directory is None:
+        directory = _os.path.join(_os.path.dirname(db_file), SNAPSHOT_DIRECTORY)
+
+    prefix = _os.path.join(directory, _snapshot_prefix(db_file, _tenant(conn), graph_name))
+    version = get_graph_version(conn, graph_name)
+    path = prefix + str(version)
+
+    if not _os.path.isdir(path):
+        _os.makedirs(directory, exist_ok=True)
+        temporary_directory = _tempfile.mkdtemp(dir=directory)
+
+        try:
+            write_snapshot(get_account_store(conn, graph_name), _os.path.join(temporary_directory, 'snapshot'))
+
+            try:
+                _os.rename(_os.path.join(temporary_directory, 'snapshot'), path)
+            except OSError:
+                # another process has already built the same snapshot
+                pass
+        finally:
+            _shutil.rmtree(temporary_directory, ignore_errors=True)
+
+        # processes that still have an older snapshot open keep reading its mapped arrays until they close it
+        for old_path in _glob.glob(_glob.escape(prefix) + '*'):
+            old_version = old_path[len(prefix):]
+
+            if old_version.isdigit() and int(old_version) < version:
+                _shutil.rmtree(old_path, ignore_errors=True)
+
+    try:
+        return Snapshot(path)
+    except FileNotFoundError:
+        # the graph was changed, and a newer snapshot built (removing this one), since its version was read
+        return load_snapshot(conn, graph_name, directory)
+
+
+def get_edge_weights_snapshot(snapshot: Snapshot, connection_type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value], mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None, top_k: int=None) -> list:
+    """
+    Function that returns the same sorted list of (account, degree) pairs as get_edge_weights_store, read from the
+    memory-mapped arrays of a snapshot. The link counts and degrees are computed with np.bincount directly on the
+    mapped arrays, so no copy of the links is made (except for the scoring analysis types).
+
+    :param snapshot: Snapshot
+    :param connection_type: str
+    :param mode: str
+    :param threshold: int
+    :param top_n: int
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :return: list
+    """
+    offsets, targets, weights = snapshot.links(connection_type)
+    n = len(snapshot)
+
+    if mode in SCORING_MODES:
+        # similarity scores need the (account x account) matrix without the links to the graph's accounts, so the
+        # links are copied once to build it
+        users = _np.repeat(_np.arange(n), _np.diff(offsets))
+        candidates = _np.ones(n, dtype=bool)
+        candidates[snapshot.accounts] = False
+        candidates = candidates[targets]
+        matrix = _sp.csr_matrix((_np.asarray(weights)[candidates], (users[candidates], _np.asarray(targets)[candidates])), shape=(n, n))
+
+        return rank_scores(score_candidates(matrix, mode=mode, threshold=threshold, top_n=top_n), snapshot, top_k)
+
+    # links to the graph's accounts are left out, as they are never recommended
+    counts = _np.bincount(targets, weights=weights, minlength=n).astype(_np.int64)
+    degrees = _np.bincount(targets, minlength=n)
+    counts[snapshot.accounts] = 0
+    degrees[snapshot.accounts] = 0
+
+    degrees[~reduce_counts(counts, mode=mode, threshold=threshold, top_n=top_n)] = 0
+
+    return rank_scores(degrees, snapshot, top_k)
+
+
+def _snapshot_prefix(db_file: str, tenant: str, graph_name: str) -> str:
+    """
+    Function to return the prefix of the directory names of the snapshots of a tenant's graph (the graph version is
+    appended).
+
+    :param db_file: str
+    :param tenant: str
+    :param graph_name: str
+    :return: str
+    """
+    return _os.path.basename(db_file) + '-' + _hashlib.sha1((tenant + '\0' + graph_name).encode('utf-8')).hexdigest()[:16] + '-v'
+
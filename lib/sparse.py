@@ -0,0 +1,354 @@
+import numpy as _np
+import scipy.sparse as _sp
+import typing as _t
+
+from lib.constants import AccountAttributes, LinkTypes
+
+if _t.TYPE_CHECKING:
+    # lib.account imports AccountIndex from this module, so AccountStore is only imported for the annotations
+    from lib.account import AccountStore
+
+# analysis types that rank the accounts by a similarity score (see similarity_scores) instead of their degree; they
+# select the accounts to score in the same way as the common analysis type
+SCORING_MODES = (LinkTypes.jaccard.value, LinkTypes.adamic_adar.value, LinkTypes.tfidf.value, LinkTypes.pagerank.value)
+
+# damping factor of the personalized PageRank scores (the probability of following a link rather than restarting)
+PAGERANK_ALPHA = 0.85
+
+
+class AccountIndex:
+    """
+    Define the class used to map account names to consecutive integer ids, in order of first appearance.
+    """
+    def __init__(self, names: _t.Iterable[str]=()):
+        self.ids = {}
+        self.names = []
+        self.add_many(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name: str) -> int:
+        """
+        Function to return the id of an account name, assigning a new id if the name has not been seen before.
+
+        :param name: str
+        :return: int
+        """
+        account_id = self.ids.get(name)
+
+        if account_id is None:
+            account_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+
+        return account_id
+
+    def add_many(self, names: _t.Iterable[str]) -> _np.ndarray:
+        """
+        Function to return the ids of a sequence of account names, as an integer array.
+
+        :param names: iterable
+        :return: np.ndarray
+        """
+        return _np.fromiter((self.add(v) for v in names), dtype=_np.int64)
+
+
+def build_bipartite_matrix(graph_edges: list, major_accounts: list, candidate_index: AccountIndex=None) -> (_sp.csr_matrix, AccountIndex, AccountIndex):
+    """
+    Function to build a CSR matrix of (seed account x candidate account) link counts from a list of account pairs,
+    as returned by construct_account_graph. Links to other seed accounts are left out, as they are never recommended.
+    A candidate index can be shared between matrices, so that their columns line up.
+
+    :param graph_edges: list
+    :param major_accounts: list
+    :param candidate_index: AccountIndex
+    :return: (sp.csr_matrix, AccountIndex, AccountIndex)
+    """
+    seed_index = AccountIndex(major_accounts)
+
+    if candidate_index is None:
+        candidate_index = AccountIndex()
+
+    graph_edges = [(k, v) for k, v in graph_edges if v not in seed_index.ids]
+
+    rows = seed_index.add_many(k for k, v in graph_edges)
+    cols = candidate_index.add_many(v for k, v in graph_edges)
+
+    # duplicate links are summed when converting to CSR
+    matrix = _sp.coo_matrix((_np.ones(len(rows), dtype=_np.int64), (rows, cols)), shape=(len(seed_index), len(candidate_index))).tocsr()
+
+    return matrix, seed_index, candidate_index
+
+
+def candidate_degrees(matrix: _sp.csr_matrix) -> _np.ndarray:
+    """
+    Function to return the number of distinct seed accounts linked to each candidate account.
+
+    :param matrix: sp.csr_matrix
+    :return: np.ndarray
+    """
+    return _np.asarray((matrix > 0).sum(axis=0)).ravel()
+
+
+def shared_counts(matrix: _sp.csr_matrix) -> _sp.csr_matrix:
+    """
+    Function to return the (seed account x seed account) matrix of the number of candidate accounts each pair of seed
+    accounts has in common (e.g. shared followers).
+
+    :param matrix: sp.csr_matrix
+    :return: sp.csr_matrix
+    """
+    binary = (matrix > 0).astype(_np.int64)
+
+    return (binary @ binary.T).tocsr()
+
+
+def reduce_matrix(matrix: _sp.csr_matrix, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None) -> _np.ndarray:
+    """
+    Function to select the candidate accounts whose link count is higher/lower than a given threshold, with the same
+    semantics as reduce_graph.
+
+    :param matrix: sp.csr_matrix
+    :param mode: str (either common or unique - greater than or less than/equal to)
+    :param threshold: int
+    :param top_n: int (if given, only the top_n accounts with the highest link count are kept)
+    :return: np.ndarray (boolean mask over the candidate accounts)
+    """
+    return reduce_counts(_np.asarray(matrix.sum(axis=0)).ravel(), mode=mode, threshold=threshold, top_n=top_n)
+
+
+def reduce_counts(counts: _np.ndarray, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None) -> _np.ndarray:
+    """
+    Function to select the candidate accounts whose link count is higher/lower than a given threshold (see
+    reduce_matrix), from an array of link counts.
+
+    :param counts: np.ndarray
+    :param mode: str (either common or unique - greater than or less than/equal to)
+    :param threshold: int
+    :param top_n: int (if given, only the top_n accounts with the highest link count are kept)
+    :return: np.ndarray (boolean mask over the candidate accounts)
+    """
+    if mode=='common':
+        mask = counts > threshold
+    else:
+        mask = (counts <= threshold) & (counts > 0)
+
+    if top_n is not None:
+        selected = _np.flatnonzero(mask)
+        mask = _np.zeros(len(counts), dtype=bool)
+        mask[selected[_top_k_indices(counts[selected], top_n)]] = True
+
+    return mask
+
+
+def score_candidates(matrix: _sp.csr_matrix, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None) -> _np.ndarray:
+    """
+    Function to return the score of each candidate account for an analysis type: its degree (the number of distinct
+    seed accounts linked to it) for the common and uncommon types, or its similarity score for the scoring types (see
+    similarity_scores). Candidates that are not selected by reduce_matrix get a score of 0.
+
+    :param matrix: sp.csr_matrix (seed x candidate link counts)
+    :param mode: str
+    :param threshold: int
+    :param top_n: int
+    :return: np.ndarray
+    """
+    if mode in SCORING_MODES:
+        scores = similarity_scores(matrix, mode)
+        mask = reduce_matrix(matrix, mode=LinkTypes.common.value, threshold=threshold, top_n=top_n)
+    else:
+        scores = candidate_degrees(matrix)
+        mask = reduce_matrix(matrix, mode=mode, threshold=threshold, top_n=top_n)
+
+    scores[~mask] = 0
+
+    return scores
+
+
+def similarity_scores(matrix: _sp.csr_matrix, mode: str=_t.Union[LinkTypes.jaccard.value, LinkTypes.adamic_adar.value, LinkTypes.tfidf.value, LinkTypes.pagerank.value]) -> _np.ndarray:
+    """
+    Function to score each candidate account by its similarity to the seed accounts, with k(s) the number of distinct
+    candidates linked to seed s, d(c) the number of distinct seeds linked to candidate c, and N the number of seeds
+    with at least one link. Unlike the raw degree, every score discounts the links of accounts that are linked to (or
+    link to) everything:
+
+    - jaccard: the sum, over the seeds s linked to c, of the Jaccard index of the links of s and of c, 1 / (k(s) + d(c) - 1)
+    - adamic_adar: the sum, over the seeds s linked to c, of 1 / log(1 + k(s))
+    - tfidf: the sum, over the seeds s linked to c, of 1 / k(s), times the inverse popularity log((1 + N) / (1 + d(c))) + 1
+    - pagerank: the personalized PageRank of c on the (undirected) graph of links, restarting from the seeds
+
+    :param matrix: sp.csr_matrix (seed x candidate link counts)
+    :param mode: str
+    :return: np.ndarray (of floats)
+    """
+    binary = (matrix > 0).astype(_np.float64).tocsr()
+    seed_degrees = _np.asarray(binary.sum(axis=1)).ravel()
+    degrees = _np.asarray(binary.sum(axis=0)).ravel()
+    inverse_seed_degrees = _np.divide(1.0, seed_degrees, out=_np.zeros(len(seed_degrees)), where=seed_degrees > 0)
+
+    if mode == LinkTypes.jaccard.value:
+        links = binary.tocoo()
+
+        return _np.bincount(links.col, weights=1.0 / (seed_degrees[links.row] + degrees[links.col] - 1), minlength=binary.shape[1])
+
+    if mode == LinkTypes.adamic_adar.value:
+        weights = _np.divide(1.0, _np.log1p(seed_degrees), out=_np.zeros(len(seed_degrees)), where=seed_degrees > 0)
+
+        return binary.T @ weights
+
+    if mode == LinkTypes.tfidf.value:
+        seeds = _np.count_nonzero(seed_degrees)
+
+        return (binary.T @ inverse_seed_degrees) * (_np.log((1 + seeds) / (1 + degrees)) + 1)
+
+    return _personalized_pagerank(binary, seed_degrees, degrees)
+
+
+def _personalized_pagerank(binary: _sp.csr_matrix, seed_degrees: _np.ndarray, degrees: _np.ndarray, alpha: float=PAGERANK_ALPHA, tolerance: float=1e-10, max_iterations: int=100) -> _np.ndarray:
+    """
+    Function to compute, by power iteration, the personalized PageRank of the candidate accounts on the bipartite graph
+    of (seed, candidate) links, where the random walk restarts from a uniformly chosen seed (with at least one link).
+    Each iteration is two sparse matrix-vector products, one per side of the graph.
+
+    :param binary: sp.csr_matrix (seed x candidate, 1 for every link)
+    :param seed_degrees: np.ndarray
+    :param degrees: np.ndarray
+    :param alpha: float
+    :param tolerance: float (on the L1 change of the scores)
+    :param max_iterations: int
+    :return: np.ndarray (the stationary probability of each candidate)
+    """
+    active = seed_degrees > 0
+
+    if not active.any():
+        return _np.zeros(binary.shape[1])
+
+    restart = active / active.sum()
+    inverse_seed_degrees = _np.divide(1.0, seed_degrees, out=_np.zeros(len(seed_degrees)), where=active)
+    inverse_degrees = _np.divide(1.0, degrees, out=_np.zeros(len(degrees)), where=degrees > 0)
+    transposed = binary.T.tocsr()
+
+    seed_scores = restart.copy()
+    scores = _np.zeros(binary.shape[1])
+
+    for iteration in range(max_iterations):
+        # every node has at least one link, so no probability is lost along them
+        new_scores = alpha * (transposed @ (seed_scores * inverse_seed_degrees))
+        new_seed_scores = alpha * (binary @ (scores * inverse_degrees)) + (1 - alpha) * restart
+        total = new_seed_scores.sum() + new_scores.sum()
+        new_seed_scores, new_scores = new_seed_scores / total, new_scores / total
+
+        change = _np.abs(new_scores - scores).sum() + _np.abs(new_seed_scores - seed_scores).sum()
+        seed_scores, scores = new_seed_scores, new_scores
+
+        if change < tolerance:
+            break
+
+    return scores
+
+
+def get_edge_weights_sparse(graph_edges: list, major_accounts: list, mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None, top_k: int=None) -> list:
+    """
+    Function that reduces a list of account pairs and returns a sorted list of (account, degree) pairs, giving the same
+    result as reduce_graph followed by get_edge_weights, computed with sparse matrix operations instead of networkx.
+    For the scoring analysis types, the accounts are ranked by similarity score instead (see score_candidates).
+
+    :param graph_edges: list
+    :param major_accounts: list
+    :param mode: str
+    :param threshold: int
+    :param top_n: int
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :return: list
+    """
+    matrix, _, candidate_index = build_bipartite_matrix(graph_edges, major_accounts)
+
+    return rank_scores(score_candidates(matrix, mode=mode, threshold=threshold, top_n=top_n), candidate_index, top_k)
+
+
+def get_edge_weights_store(store: 'AccountStore', connection_type: str=_t.Union[AccountAttributes.followers.value, AccountAttributes.following.value], mode: str=_t.Union[LinkTypes.common.value, LinkTypes.uncommon.value], threshold: int=1, top_n: int=None, top_k: int=None) -> list:
+    """
+    Function that returns the same sorted list of (account, degree) pairs as get_edge_weights_sparse, for the follower
+    or following links of an AccountStore (see lib.account). The matrix is built directly from the store's id buffers,
+    so no account names are handled until the ranking is returned. The accounts of the store are the seed accounts.
+
+    :param store: AccountStore
+    :param connection_type: str
+    :param mode: str
+    :param threshold: int
+    :param top_n: int
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :return: list
+    """
+    users, targets = store.edge_arrays(connection_type)
+
+    # links to other seed accounts are left out, as they are never recommended
+    seeds = _np.zeros(len(store.index), dtype=bool)
+    seeds[_np.frombuffer(store.account_ids, dtype=_np.uint32) if len(store.account_ids) > 0 else []] = True
+    candidates = ~seeds[targets]
+
+    # duplicate links are summed when converting to CSR
+    matrix = _sp.coo_matrix((_np.ones(int(candidates.sum()), dtype=_np.int64), (users[candidates], targets[candidates])), shape=(len(store.index), len(store.index))).tocsr()
+
+    return rank_scores(score_candidates(matrix, mode=mode, threshold=threshold, top_n=top_n), store.index, top_k)
+
+
+def get_similar_accounts_sparse(following_edges: list, follower_edges: list, major_accounts: list, following_follower_ratio: float, top_k: int=None) -> list:
+    """
+    Function that blends the degrees of a list of following pairs and a list of follower pairs into a single sorted
+    list of (account, score) pairs, in the same way as get_similar_accounts, using sparse matrix operations.
+
+    :param following_edges: list
+    :param follower_edges: list
+    :param major_accounts: list
+    :param following_follower_ratio: float (the relative weigthing of follower vs following)
+    :param top_k: int (if given, only the top_k accounts are returned)
+    :return: list
+    """
+    candidate_index = AccountIndex()
+    following_matrix, _, _ = build_bipartite_matrix(following_edges, major_accounts, candidate_index)
+    follower_matrix, _, _ = build_bipartite_matrix(follower_edges, major_accounts, candidate_index)
+
+    # the following matrix was built before all candidates were known, so it is padded to the final width
+    following_matrix.resize(following_matrix.shape[0], len(candidate_index))
+
+    scores = candidate_degrees(following_matrix) * following_follower_ratio + candidate_degrees(follower_matrix)
+
+    return rank_scores(scores, candidate_index, top_k)
+
+
+def rank_scores(scores: _np.ndarray, candidate_index: AccountIndex, top_k: int=None) -> list:
+    """
+    Function that returns the (account, score) pairs with a positive score, sorted by descending score.
+
+    :param scores: np.ndarray
+    :param candidate_index: AccountIndex
+    :param top_k: int
+    :return: list
+    """
+    selected = _np.flatnonzero(scores > 0)
+    selected = selected[_top_k_indices(scores[selected], top_k)]
+
+    return [(candidate_index.names[i], scores[i].item()) for i in selected]
+
+
+def _top_k_indices(scores: _np.ndarray, top_k: int=None) -> _np.ndarray:
+    """
+    Function that returns the indices of the top_k highest scores in descending order, using a partial selection
+    (np.partition) rather than a full sort. Ties keep their original order, as with a stable sort. No indices are
+    returned if top_k is 0 or less.
+
+    :param scores: np.ndarray
+    :param top_k: int
+    :return: np.ndarray
+    """
+    if top_k is not None and top_k <= 0:
+        return _np.array([], dtype=_np.int64)
+
+    if top_k is not None and top_k < len(scores):
+        kth_score = _np.partition(scores, len(scores) - top_k)[len(scores) - top_k]
+        selected = _np.flatnonzero(scores >= kth_score)
+    else:
+        selected = _np.arange(len(scores))
+
+    return selected[_np.argsort(-scores[selected], kind='stable')][:top_k]
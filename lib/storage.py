@@ -0,0 +1,145 @@
+import os as _os
+import typing as _t
+
+from lib.constants import StorageBackends
+from lib.database import DEFAULT_TENANT, EDGES_INSERT_TRIGGER, connect, initialise_database
+
+# suffix of the name of the database file of each tenant of a FileStorage (e.g. database/127.0.0.1database.db)
+DATABASE_FILE_SUFFIX = 'database.db'
+
+# path of the database file of a SharedStorage
+SHARED_DATABASE = 'database/graphexplore.db'
+
+
+class FileStorage:
+    """
+    Define the storage backend that keeps each tenant in its own database file, in a directory. This is the original
+    layout of the app (with one file per client IP address): every file is opened, and its pages cached, separately.
+    """
+    def __init__(self, directory: str='database'):
+        self.directory = directory
+
+    def locate(self, tenant: str) -> (str, str):
+        """
+        Function to return the database file that holds a tenant, and the tenant of its rows. Tenants that cannot be
+        used as part of a file name (e.g. ones that contain a path separator) are rejected with a ValueError.
+
+        :param tenant: str
+        :return: (str, str) (database file, tenant)
+        """
+        if not tenant or any(v in tenant for v in (_os.sep, _os.altsep, '\0') if v):
+            raise ValueError('invalid tenant: ' + repr(tenant))
+
+        return _os.path.join(self.directory, tenant + DATABASE_FILE_SUFFIX), DEFAULT_TENANT
+
+
+class SharedStorage:
+    """
+    Define the storage backend that keeps every tenant in one database file, with the rows of each tenant keyed by its
+    id. All tenants share the same pooled connections and page cache, so the first request of a tenant does not have to
+    open and warm up a file of its own.
+    """
+    def __init__(self, db_file: str=SHARED_DATABASE):
+        self.db_file = db_file
+
+    def locate(self, tenant: str) -> (str, str):
+        """
+        Function to return the database file that holds a tenant, and the tenant of its rows.
+
+        :param tenant: str
+        :return: (str, str) (database file, tenant)
+        """
+        return self.db_file, tenant
+
+
+# storage backend classes, by the name used in the STORAGE setting
+STORAGE_BACKENDS = {StorageBackends.files.value: FileStorage, StorageBackends.shared.value: SharedStorage}
+
+
+def get_storage(backend: str=StorageBackends.files.value, location: str=None) -> _t.Union[FileStorage, SharedStorage]:
+    """
+    Function to return a storage backend by name, with its directory (files) or database file (shared) if given.
+
+    :param backend: str
+    :param location: str
+    :return: FileStorage or SharedStorage
+    """
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError('unknown storage backend: ' + str(backend))
+
+    if location is None:
+        return STORAGE_BACKENDS[backend]()
+
+    return STORAGE_BACKENDS[backend](location)
+
+
+def tenant_name(db_file: str) -> str:
+    """
+    Function to return the tenant of a FileStorage database file, from its name.
+
+    :param db_file: str
+    :return: str
+    """
+    name = _os.path.basename(db_file)
+
+    if not name.endswith(DATABASE_FILE_SUFFIX) or name == DATABASE_FILE_SUFFIX:
+        raise ValueError('not a tenant database file: ' + db_file)
+
+    return name[:-len(DATABASE_FILE_SUFFIX)]
+
+
+def migrate_database(source_file: str, db_file: str, tenant: str=None) -> int:
+    """
+    Function to copy the graphs of a per-tenant database file into a shared database file, under a tenant (by default
+    the one named by the file, see tenant_name). The source file is first upgraded to the current schema, in the same
+    way as when the app opens it. Any rows the tenant already had in the shared file are replaced, so a migration can be
+    run again; the version of every graph the tenant already had is then increased past the one it had (and past the
+    source's), so that the results cached for an older version are never served for the copied rows. The rows are copied with INSERT ... SELECT from the attached source file, and the candidate counts are
+    copied rather than recomputed by the insert trigger on every edge.
+
+    :param source_file: str
+    :param db_file: str
+    :param tenant: str
+    :return: int (the number of accounts copied)
+    """
+    if tenant is None:
+        tenant = tenant_name(source_file)
+
+    source = connect(source_file)
+
+    try:
+        initialise_database(source)
+    finally:
+        source.close()
+
+    conn = connect(db_file, tenant)
+
+    try:
+        initialise_database(conn)
+        conn.execute("ATTACH DATABASE ? AS source", (source_file,))
+
+        try:
+            with conn:
+                # the trigger is dropped inside the transaction, so that it is restored if the transaction is rolled back
+                conn.execute("BEGIN")
+                conn.execute("DROP TRIGGER IF EXISTS trg_edges_insert")
+
+                for table in ('candidate_counts', 'edges', 'accounts'):
+                    conn.execute("DELETE FROM main." + table + " WHERE tenant=?", (tenant,))
+
+                conn.execute("INSERT INTO main.accounts (tenant, graph, user, hash) SELECT ?, graph, user, hash FROM source.accounts WHERE tenant=? ORDER BY rowid", (tenant, DEFAULT_TENANT))
+                conn.execute("""INSERT INTO main.edges (tenant, graph, user, target, direction)
+                                SELECT ?, graph, user, target, direction FROM source.edges WHERE tenant=? ORDER BY rowid""", (tenant, DEFAULT_TENANT))
+                conn.execute("""INSERT INTO main.candidate_counts (tenant, graph, direction, target, links, seeds)
+                                SELECT ?, graph, direction, target, links, seeds FROM source.candidate_counts WHERE tenant=?""", (tenant, DEFAULT_TENANT))
+                # the versions of the graphs are keys of the snapshots, caches and jobs of their rows, so they never go back
+                conn.execute("UPDATE main.graph_versions SET version = version + 1 WHERE tenant=?", (tenant,))
+                conn.execute("""INSERT INTO main.graph_versions (tenant, graph, version) SELECT ?, graph, version FROM source.graph_versions WHERE tenant=?
+                                ON CONFLICT (tenant, graph) DO UPDATE SET version = MAX(version, excluded.version)""", (tenant, DEFAULT_TENANT))
+                conn.execute(EDGES_INSERT_TRIGGER)
+
+            return conn.execute("SELECT COUNT(*) FROM main.accounts WHERE tenant=?", (tenant,)).fetchone()[0]
+        finally:
+            conn.execute("DETACH DATABASE source")
+    finally:
+        conn.close()
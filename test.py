@@ -1,22 +1,35 @@
+import io
+import os
+import json
+import tempfile
+import sqlite3
 import unittest
 from unittest.mock import MagicMock, patch, Mock
 from flask import Flask
-from app_script import app, get_account_details, delete_graph, delete_account, analyze, add_account, homepage, home, upload
+from bokeh.resources import CDN
+from app_script import app, analysis_cache, layout_cache, get_account_details, search_accounts, delete_graph, delete_account, analyze, submit_job, job_status, add_account, homepage, home, upload, ingest_buffer
 from werkzeug.datastructures import ImmutableMultiDict
+from werkzeug.exceptions import BadRequest
+from lib.account import AccountStore
+from lib.database import get_account_connections
+from lib.storage import get_storage
+from lib.ingest import IngestBufferFull
 
 class TestIndexRoute(unittest.TestCase):
     def setUp(self):
         # Create a test client using Flask's test_client method
         self.app = app.test_client()
 
-    @patch('app_script.os.path.isfile')
-    @patch('app_script.sqlite3.connect')
+    @patch('app_script.initialise_database')
+    @patch('app_script.insert_account')
+    @patch('app_script.tenant_exists')
+    @patch('app_script.get_connection')
     @patch('app_script.return_account_page')
     @patch('app_script.render_template')
-    def test_index_route(self, mock_render_template, mock_return_account_page, mock_sqlite_connect, mock_os_path_isfile):
+    def test_index_route(self, mock_render_template, mock_return_account_page, mock_sqlite_connect, mock_tenant_exists, mock_insert_account, mock_initialise_database):
         with self.app as a:
             # Set up mocks
-            mock_os_path_isfile.return_value = False
+            mock_tenant_exists.return_value = False
             mock_sqlite_connect.return_value = MagicMock()
             mock_return_account_page.return_value = ("graph1", ["graph1"], "account1", ["account1"])
             mock_render_template.return_value = "test"
@@ -30,14 +43,38 @@ class TestIndexRoute(unittest.TestCase):
             # Check if render_template is called with the expected arguments
             mock_render_template.assert_called_once_with('add.html', graph_list_first='graph1', graph_list=['graph1'], account_list_first='account1', account_list=['account1'])
 
+            # Check if the schema is created, and the initial graph inserted, for the new tenant
+            mock_initialise_database.assert_called_once_with(mock_sqlite_connect.return_value)
+            mock_insert_account.assert_called_once_with(mock_sqlite_connect.return_value, 'graph', 'test', ['test'], ['test'])
+            mock_sqlite_connect.assert_called_once_with('database/127.0.0.1database.db', '')
+
+    @patch('app_script.initialise_database')
+    @patch('app_script.get_connection')
+    @patch('app_script.return_account_page')
+    @patch('app_script.render_template')
+    def test_index_route_shared_storage(self, mock_render_template, mock_return_account_page, mock_sqlite_connect, mock_initialise_database):
+        # Test that, with a shared database file, the tenant is read from the tenant header
+        mock_return_account_page.return_value = ("graph1", ["graph1"], "account1", ["account1"])
+        mock_render_template.return_value = "test"
+
+        with patch('app_script.storage', get_storage('shared', 'database/shared.db')), patch.dict(app.config, TENANT_HEADER='X-Tenant-ID'):
+            self.assertEqual(self.app.get('/', headers={'X-Tenant-ID': 'tenant1'}).status_code, 200)
+            mock_sqlite_connect.assert_called_once_with('database/shared.db', 'tenant1')
+
+            # tenant ids are never used as file names with a shared database, but are with one file per tenant
+            with patch('app_script.storage', get_storage('files')):
+                self.assertEqual(self.app.get('/', headers={'X-Tenant-ID': '../tenant1'}).status_code, 400)
+
 class TestGetAccountDetails(unittest.TestCase):
-    @patch('app_script.sqlite3.connect')
+    @patch('app_script.get_account_connections')
+    @patch('app_script.get_connection')
     @patch('app_script.render_template')
     @patch('app_script.return_account_page')
-    def test_get_account_details(self, return_account_page_mock, mock_render_template, mock_connect):
+    def test_get_account_details(self, return_account_page_mock, mock_render_template, mock_connect, mock_get_account_connections):
         # Create a mock cursor
         mock_cursor = Mock()
         mock_cursor.execute.return_value = [("graph1", "account1", "followers1", "following1")]
+        mock_get_account_connections.return_value = None
         return_account_page_mock.return_value = ('graph1', ['graph1', 'graph2'], 'user1', ['user1', 'user2'])
 
         # Set the return value of the mock connect method to the mock cursor
@@ -59,11 +96,50 @@ class TestGetAccountDetails(unittest.TestCase):
             'add.html', graph_list_first='graph1', graph_list=['graph1', 'graph2'], account_list_first='account1', account_list=['user1', 'user2'], followers='Empty', following='Empty'
         )
 
+    @patch('app_script.get_account_connections')
+    @patch('app_script.get_connection')
+    @patch('app_script.render_template')
+    @patch('app_script.return_account_page')
+    def test_get_account_details_found(self, return_account_page_mock, mock_render_template, mock_connect, mock_get_account_connections):
+        mock_get_account_connections.return_value = (['follower1', 'follower2'], ['following1'])
+        return_account_page_mock.return_value = ('graph1', ['graph1', 'graph2'], 'user1', ['user1', 'user2'])
+
+        app.config = {'DATABASE': 'mock_db', 'APPLICATION_ROOT': '/', 'PREFERRED_URL_SCHEME': 'http', 'SERVER_NAME': 'localhost:5000'
+                           , 'SECRET_KEY': '', 'PRESERVE_CONTEXT_ON_EXCEPTION': '', 'DEBUG': ''}
+
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graph_name': 'graph1', 'account_name_1': 'account1'})
+            with patch('app_script.request.form', form_data):
+                get_account_details()
+
+        mock_get_account_connections.assert_called_once_with(mock_connect.return_value, 'graph1', 'account1')
+        mock_render_template.assert_called_once_with(
+            'add.html', graph_list_first='graph1', graph_list=['graph1', 'graph2'], account_list_first='account1', account_list=['user1', 'user2'], followers='follower1, follower2', following='following1'
+        )
+
+class TestSearchAccounts(unittest.TestCase):
+    @patch('app_script.get_account_names')
+    @patch('app_script.get_connection')
+    def test_search_accounts(self, mock_connect, mock_get_account_names):
+        mock_get_account_names.return_value = ['account1', 'account2']
+
+        # Mock the Flask app configuration, with the default json settings
+        app.config = dict(app.default_config, DATABASE='mock_db')
+
+        with app.test_request_context('/search_accounts', query_string={'graph': 'graph1', 'q': 'acc', 'limit': '1000'}):
+            response = search_accounts()
+
+        self.assertEqual(response.get_json(), ['account1', 'account2'])
+
+        # the page size is capped
+        mock_get_account_names.assert_called_with(mock_connect.return_value, 'graph1', prefix='acc', offset=0, limit=100)
+
 class TestDeleteGraph(unittest.TestCase):
-    @patch('app_script.sqlite3.connect')
+    @patch('app_script.remove_graph')
+    @patch('app_script.get_connection')
     @patch('app_script.return_account_page')
     @patch('app_script.render_template')
-    def test_delete_graph(self, mock_render_template, mock_return_account_page, mock_connect):
+    def test_delete_graph(self, mock_render_template, mock_return_account_page, mock_connect, mock_remove_graph):
         # Mock the request form data
         mock_request = Mock()
         mock_request.form = {'graph_name': 'test_graph'}
@@ -92,17 +168,18 @@ class TestDeleteGraph(unittest.TestCase):
         # Check if the render_template function is called with the correct arguments
         mock_render_template.assert_called_with('add.html', graph_list_first='graph_list_first', graph_list=['graph_list'], account_list_first='account_list_first', account_list=['account_list'])
 
-        # Check if the connection.execute method is called with the correct SQL query
-        mock_conn.execute.assert_called_with("DELETE from connections where graph='test_graph'")
+        # Check if the graph is removed through the connection
+        mock_remove_graph.assert_called_with(mock_conn, 'test_graph')
 
         # Check if the connection.commit method is called
         mock_conn.commit.assert_called()
 
 class TestDeleteAccount(unittest.TestCase):
-    @patch('app_script.sqlite3.connect')
+    @patch('app_script.remove_account')
+    @patch('app_script.get_connection')
     @patch('app_script.return_account_page')
     @patch('app_script.render_template')
-    def test_delete_account(self, mock_render_template, mock_return_account_page, mock_connect):
+    def test_delete_account(self, mock_render_template, mock_return_account_page, mock_connect, mock_remove_account):
         # Mock the request form data
         mock_request = Mock()
         mock_request.form = {'graph_name': 'test_graph'}
@@ -131,17 +208,18 @@ class TestDeleteAccount(unittest.TestCase):
         # Check if the render_template function is called with the correct arguments
         mock_render_template.assert_called_with('add.html', graph_list_first='graph_list_first', graph_list=['graph_list'], account_list_first='account_list_first', account_list=['account_list'])
 
-        # Check if the connection.execute method is called with the correct SQL query
-        mock_conn.execute.assert_called_with("DELETE from connections where user='test_account'")
+        # Check if the account is removed through the connection
+        mock_remove_account.assert_called_with(mock_conn, 'test_account')
 
         # Check if the connection.commit method is called
         mock_conn.commit.assert_called()
 
 class TestAddAccount(unittest.TestCase):
-    @patch('app_script.sqlite3.connect')
+    @patch('app_script.insert_account')
+    @patch('app_script.get_connection')
     @patch('app_script.return_account_page')
     @patch('app_script.render_template')
-    def test_add_account(self, mock_render_template, mock_return_account_page, mock_connect):
+    def test_add_account(self, mock_render_template, mock_return_account_page, mock_connect, mock_insert_account):
         # Mock the request form data
         mock_request = Mock()
         mock_request.form = {'graph_name': 'test_graph'}
@@ -170,14 +248,33 @@ class TestAddAccount(unittest.TestCase):
         # Check if the render_template function is called with the correct arguments
         mock_render_template.assert_called_with('add.html', graph_list_first='graph_list_first', graph_list=['graph_list'], account_list_first='account_list_first', account_list=['account_list'])
 
-        # Check if the connection.execute method is called with the correct SQL query
-        mock_conn.execute.assert_called_with("INSERT INTO connections (graph, user, followers, following) VALUES ('test_graph', 'test_account', 'test_account_1', 'test_account_2');")
+        # Check if the account is inserted with its parsed follower/following lists
+        mock_insert_account.assert_called_with(mock_conn, 'test_graph', 'test_account', ['test_account_1'], ['test_account_2'])
 
         # Check if the connection.commit method is called
         mock_conn.commit.assert_called()
 
+    @patch('app_script.insert_account')
+    @patch('app_script.upsert_account')
+    @patch('app_script.get_connection')
+    @patch('app_script.return_account_page')
+    @patch('app_script.render_template')
+    def test_add_account_upsert(self, mock_render_template, mock_return_account_page, mock_connect, mock_upsert_account, mock_insert_account):
+        # Test that, in upsert mode, the account is upserted rather than inserted again
+        mock_return_account_page.return_value = ('graph_list_first', ['graph_list'], 'account_list_first', ['account_list'])
+        app.config = dict(app.default_config, DATABASE='mock_db')
+
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graph_name_2': 'test_graph', 'account_name_2': 'test_account', 'follower_accounts': 'test_account_1', 'following_accounts': '', 'upsert': '1'})
+            with patch('app_script.request.form', form_data):
+                add_account()
+
+        mock_upsert_account.assert_called_with(mock_connect.return_value, 'test_graph', 'test_account', ['test_account_1'], [])
+        mock_insert_account.assert_not_called()
+        mock_connect.return_value.commit.assert_called()
+
 class TestHomepage(unittest.TestCase):
-    @patch('app_script.sqlite3.connect')
+    @patch('app_script.get_connection')
     @patch('app_script.return_account_page')
     @patch('app_script.render_template')
     def test_homepage(self, mock_render_template, mock_return_account_page, mock_connect):
@@ -210,7 +307,7 @@ class TestHomepage(unittest.TestCase):
         mock_render_template.assert_called_with('explore.html', graph_list_first='graph_list_first', graph_list=['graph_list'], account_list_first='account_list_first', account_list=['account_list'])
 
 class TestHome(unittest.TestCase):
-    @patch('app_script.sqlite3.connect')
+    @patch('app_script.get_connection')
     @patch('app_script.return_account_page')
     @patch('app_script.render_template')
     def test_home(self, mock_render_template, mock_return_account_page, mock_connect):
@@ -244,69 +341,120 @@ class TestHome(unittest.TestCase):
 
 class TestUpload(unittest.TestCase):
     @patch('app_script.return_account_page')
-    @patch('app_script.sqlite3.connect')
-    @patch('builtins.open', create=True)
-    @patch('csv.reader')
     @patch('app_script.render_template')
-    def test_upload(self, mock_render_template, mock_csv_reader, mock_open, mock_connect, mock_return_account_page):
+    def test_upload(self, mock_render_template, mock_return_account_page):
 
         # Mocking return value for return_account_page
         mock_return_account_page.return_value = ('graph_list_first', ['graph1', 'graph2'], 'account_list_first', ['account1', 'account2'])
 
-        # Mocking csv reader
-        mock_csv_reader.return_value = [['graph1', 'user1', 'followers1', 'following1']]
-
-        # Mock the cursor and connection
-        mock_cursor = Mock()
-        mock_conn = Mock()
-        mock_conn.execute.return_value = mock_cursor
-        mock_connect.return_value = mock_conn
+        # Use an in-memory database in place of the per-IP database file
+        conn = sqlite3.connect(':memory:')
 
         # Mock the Flask app configuration
         app.config = {'DATABASE': 'mock_db', 'APPLICATION_ROOT': '/', 'PREFERRED_URL_SCHEME': 'http', 'SERVER_NAME': 'localhost:5000'
-                           , 'SECRET_KEY': '', 'PRESERVE_CONTEXT_ON_EXCEPTION': '', 'DEBUG':''}
-        
-        with app.test_request_context('/upload', method='POST'):
-            with patch('app_script.request.files.get'):
-                with patch('app_script.request.remote_addr'):
-                    upload()
-        
-        # Check if the connection.execute method is called with the correct SQL query
-        mock_conn.execute.assert_called_with("INSERT INTO connections (graph, user, followers, following) VALUES ('graph1', 'user1', 'followers1', 'following1');")
+                           , 'SECRET_KEY': '', 'PRESERVE_CONTEXT_ON_EXCEPTION': '', 'DEBUG':'', 'MAX_CONTENT_LENGTH': None}
+
+        csv_data = b'graph,user,followers,following\ngraph1,user1,"followers1, followers2",following1\nmalformed row\n'
+
+        with app.test_request_context('/upload', method='POST', data={'file': (io.BytesIO(csv_data), 'accounts.csv')}, environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+            with patch('app_script.get_connection', return_value=conn):
+                upload()
+
+        # Check that the header is skipped, the valid row is inserted and the malformed row is rejected
+        self.assertEqual(get_account_connections(conn, 'graph1', 'user1'), (['followers1', 'followers2'], ['following1']))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0], 1)
+
+        upload_message = mock_render_template.call_args.kwargs['upload_message']
+        self.assertTrue(upload_message.startswith('Uploaded 1 accounts'))
+        self.assertTrue(upload_message.endswith('rejected 1 rows.'))
+
+class TestIngest(unittest.TestCase):
+    def setUp(self):
+        self.app = app.test_client()
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, 'test.db')
+        app.config = dict(app.default_config, INGEST_TIMEOUT=0)
+
+    def tearDown(self):
+        ingest_buffer.flush(timeout=5)
+        self.directory.cleanup()
+
+    def test_ingest(self):
+        # Test that json and ndjson batches are queued, and written to the tenant's database file
+        with patch('app_script._tenant_database', return_value=(self.db_file, '')):
+            response = self.app.post('/ingest', json=[{'graph': 'graph1', 'account': 'user1', 'followers': ['A', 'B'], 'following': ['C']}, {'graph': 'graph1'}])
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(response.get_json(), {'accepted': 1, 'rejected': 1})
+
+            ndjson = '\n'.join(json.dumps({'graph': 'graph1', 'account': 'user' + str(i)}) for i in range(2, 4))
+            response = self.app.post('/ingest', data=ndjson, content_type='application/x-ndjson')
+            self.assertEqual(response.get_json(), {'accepted': 2, 'rejected': 0})
+
+            response = self.app.post('/ingest', data='not json', content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
+        self.assertTrue(ingest_buffer.flush(timeout=5))
+        self.assertEqual(self.app.get('/ingest').get_json()['pending'], 0)
+        self.assertEqual(self.app.get('/ingest').get_json()['failed_rows'], [])
+
+        conn = sqlite3.connect(self.db_file)
+        self.assertEqual(get_account_connections(conn, 'graph1', 'user1'), (['A', 'B'], ['C']))
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0], 3)
+        conn.close()
+
+    def test_ingest_buffer_full(self):
+        # Test that a batch is refused with a 429 status when the ingestion buffer is full
+        with patch('app_script._tenant_database', return_value=(self.db_file, '')), patch('app_script.ingest_buffer.put', side_effect=IngestBufferFull('full')):
+            response = self.app.post('/ingest', json=[{'graph': 'graph1', 'account': 'user1'}])
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '1')
+
+    def test_ingest_too_large(self):
+        # Test that a body larger than INGEST_MAX_BYTES is refused before it is parsed
+        app.config['INGEST_MAX_BYTES'] = 100
+        ndjson = '\n'.join(json.dumps({'graph': 'graph1', 'account': 'user' + str(i)}) for i in range(10))
+
+        with patch('app_script._tenant_database', return_value=(self.db_file, '')), patch('app_script.parse_ndjson') as mock_parse_ndjson:
+            response = self.app.post('/ingest', data=ndjson, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 413)
+        mock_parse_ndjson.assert_not_called()
 
 class TestAnalyze(unittest.TestCase):
-    @patch('app_script.sqlite3.connect')
+    def setUp(self):
+        # Each test starts with empty result and layout caches
+        analysis_cache.clear()
+        layout_cache.clear()
+
+    @patch('app_script.compute_plot_layout')
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_graph_accounts')
+    @patch('app_script.get_connection')
     @patch('app_script.nx.Graph')
-    @patch('app_script.construct_account_graph')
-    @patch('app_script.reduce_graph')
-    @patch('app_script.output_file')
-    @patch('app_script.save')
-    @patch('app_script.get_edge_weights')
+    @patch('app_script.iter_graph_edges')
+    @patch('app_script.components')
     @patch('app_script.render_template')
     @patch('app_script.get_network_graph')
-    def test_analyze(self, get_network_graph_mock, mock_render_template, mock_get_edge_weights, mock_save, mock_output_file, mock_reduce_graph, mock_construct_account_graph, mock_nx_graph, mock_sqlite_connect):
+    def test_analyze(self, get_network_graph_mock, mock_render_template, mock_components, mock_iter_graph_edges, mock_nx_graph, mock_sqlite_connect, mock_get_graph_accounts, mock_get_graph_version, mock_compute_plot_layout):
 
         # Mock nx.Graph
         mock_g = MagicMock()
         mock_nx_graph.return_value = mock_g
 
-        # Mock construct_account_graph
-        mock_graph_edges = [('user1', 'user2')]
-        mock_construct_account_graph.return_value = mock_graph_edges
-
-        # Mock reduce_graph
-        mock_reduced_graph_edges = [('user1', 'user2')]
-        mock_reduce_graph.return_value = mock_reduced_graph_edges
-
-        # Mock get_edge_weights
-        mock_edge_weights = [('user2', 0.5), ('user3', 0.3)]
-        mock_get_edge_weights.return_value = mock_edge_weights
+        # Mock the database reads, with a new stream of edges on each read
+        mock_get_graph_version.return_value = 1
+        mock_get_graph_accounts.return_value = ['user1', 'user4']
+        mock_graph_edges = [('user1', 'user2'), ('user4', 'user2'), ('user1', 'user3'), ('user4', 'user3'), ('user4', 'user3'), ('user1', 'user4'), ('user1', 'user5')]
+        mock_iter_graph_edges.side_effect = lambda *args: iter(mock_graph_edges)
 
         # Mock render_template
         mock_render_template.return_value = 'rendered_template_html'
 
         # mock the graph return function
         get_network_graph_mock.return_value = None
+        mock_components.return_value = ('<script></script>', '<div></div>')
+        mock_compute_plot_layout.return_value = {'user1': (0.0, 0.0), 'user2': (1.0, 0.0)}
 
         # Mock the Flask app configuration
         app.config = {'DATABASE': 'mock_db', 'APPLICATION_ROOT': '/', 'PREFERRED_URL_SCHEME': 'http', 'SERVER_NAME': 'localhost:5000'
@@ -320,9 +468,282 @@ class TestAnalyze(unittest.TestCase):
                 # Call the analyze function
                 result = analyze()
 
-        # Assertions
-        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2, user3')
+        # Assertions: the edges are streamed once to count the links, and once to add the edges of the selected accounts
+        # to the graph, and the accounts are ranked by their number of distinct linking accounts
+        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2, user3', scores=[('user2', 2), ('user3', 2)], plot={'script': '<script></script>', 'div': '<div></div>'}, plot_resources=CDN.render())
+        self.assertEqual(mock_iter_graph_edges.call_count, 2)
+        mock_iter_graph_edges.assert_called_with(mock_sqlite_connect.return_value, 'graph1', 'following')
+        self.assertEqual(list(mock_g.add_edges_from.call_args.args[0]), mock_graph_edges[:5])
+        mock_components.assert_called_with(get_network_graph_mock.return_value)
+        get_network_graph_mock.assert_called_with(mock_g, ['user1', 'user4'], layout='test_account_2', positions=mock_compute_plot_layout.return_value, render_mode='auto')
+
+        # Re-plotting the same graph version with another engine reuses the cached layout
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'common', 'graph_type': 'test_account_2', 'engine': 'sparse'})
+            with patch('app_script.request.form', form_data), patch('app_script.get_account_store', return_value=AccountStore()), patch('app_script.get_edge_weights_store', return_value=[]):
+                analyze()
+
+        mock_compute_plot_layout.assert_called_once()
         self.assertEqual(result, 'rendered_template_html')
 
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_graph_accounts')
+    @patch('app_script.get_connection')
+    @patch('app_script.nx.Graph')
+    @patch('app_script.get_account_store')
+    @patch('app_script.get_edge_weights_store')
+    @patch('app_script.components')
+    @patch('app_script.render_template')
+    @patch('app_script.get_network_graph')
+    def test_analyze_sparse_without_plot(self, get_network_graph_mock, mock_render_template, mock_components, mock_get_edge_weights_store, mock_get_account_store, mock_nx_graph, mock_sqlite_connect, mock_get_graph_accounts, mock_get_graph_version):
+        mock_get_graph_version.return_value = 1
+        mock_get_graph_accounts.return_value = ['user1']
+        mock_get_edge_weights_store.return_value = [('user2', 1)]
+
+        app.config = {'DATABASE': 'mock_db', 'APPLICATION_ROOT': '/', 'PREFERRED_URL_SCHEME': 'http', 'SERVER_NAME': 'localhost:5000'
+                           , 'SECRET_KEY': '', 'PRESERVE_CONTEXT_ON_EXCEPTION': '', 'DEBUG':''}
+
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'common', 'graph_type': 'no_plot', 'engine': 'sparse', 'top_n': '10'})
+            with patch('app_script.request.form', form_data):
+                analyze()
+
+        # networkx and bokeh are not used when no plot is requested
+        mock_nx_graph.assert_not_called()
+        get_network_graph_mock.assert_not_called()
+        mock_components.assert_not_called()
+        mock_get_account_store.assert_called_with(mock_sqlite_connect.return_value, 'graph1', ('following',))
+        mock_get_edge_weights_store.assert_called_with(mock_get_account_store.return_value, 'following', mode='common', threshold=1, top_n=10, top_k=10)
+        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2', scores=[('user2', 1)], plot=None, plot_resources=CDN.render())
+
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_graph_accounts')
+    @patch('app_script.get_connection')
+    @patch('app_script.iter_graph_edges')
+    @patch('app_script.get_candidate_counts')
+    @patch('app_script.render_template')
+    def test_analyze_index_without_plot(self, mock_render_template, mock_get_candidate_counts, mock_iter_graph_edges, mock_sqlite_connect, mock_get_graph_accounts, mock_get_graph_version):
+        # Test that the index engine reads the ranking from the candidate counts, without reading the edges
+        mock_get_graph_version.return_value = 1
+        mock_get_graph_accounts.return_value = ['user1']
+        mock_get_candidate_counts.return_value = [('user2', 1)]
+
+        app.config = dict(app.default_config, DATABASE='mock_db')
+
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'common', 'graph_type': 'no_plot', 'engine': 'index', 'top_n': '10'})
+            with patch('app_script.request.form', form_data):
+                analyze()
+
+        mock_iter_graph_edges.assert_not_called()
+        mock_get_candidate_counts.assert_called_with(mock_sqlite_connect.return_value, 'graph1', 'following', mode='common', threshold=1, top_n=10, top_k=10)
+        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2', scores=[('user2', 1)], plot=None, plot_resources=CDN.render())
+
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_graph_accounts')
+    @patch('app_script.get_connection')
+    @patch('app_script.iter_graph_edges')
+    @patch('app_script.load_snapshot')
+    @patch('app_script.get_edge_weights_snapshot')
+    @patch('app_script.render_template')
+    def test_analyze_snapshot_without_plot(self, mock_render_template, mock_get_edge_weights_snapshot, mock_load_snapshot, mock_iter_graph_edges, mock_sqlite_connect, mock_get_graph_accounts, mock_get_graph_version):
+        # Test that the snapshot engine ranks the accounts from the graph snapshot, without reading the edges
+        mock_get_graph_version.return_value = 1
+        mock_get_graph_accounts.return_value = ['user1']
+        mock_get_edge_weights_snapshot.return_value = [('user2', 1)]
+
+        app.config = dict(app.default_config, DATABASE='mock_db')
+
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'common', 'graph_type': 'no_plot', 'engine': 'snapshot'})
+            with patch('app_script.request.form', form_data):
+                analyze()
+
+        mock_iter_graph_edges.assert_not_called()
+        mock_load_snapshot.assert_called_with(mock_sqlite_connect.return_value, 'graph1')
+        mock_get_edge_weights_snapshot.assert_called_with(mock_load_snapshot.return_value, 'following', mode='common', threshold=1, top_n=None, top_k=None)
+        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2', scores=[('user2', 1)], plot=None, plot_resources=CDN.render())
+
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_graph_accounts')
+    @patch('app_script.get_connection')
+    @patch('app_script.iter_graph_edges')
+    @patch('app_script.get_edge_weights_sketch')
+    @patch('app_script.render_template')
+    def test_analyze_sketch_without_plot(self, mock_render_template, mock_get_edge_weights_sketch, mock_iter_graph_edges, mock_sqlite_connect, mock_get_graph_accounts, mock_get_graph_version):
+        # Test that the sketch engine streams the edges of the graph into approximate link counts
+        mock_get_graph_version.return_value = 1
+        mock_get_graph_accounts.return_value = ['user1']
+        mock_get_edge_weights_sketch.return_value = [('user2', 3)]
+
+        app.config = dict(app.default_config, DATABASE='mock_db')
+
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'common', 'graph_type': 'no_plot', 'engine': 'sketch', 'top_n': 10})
+            with patch('app_script.request.form', form_data):
+                analyze()
+
+        mock_iter_graph_edges.assert_called_with(mock_sqlite_connect.return_value, 'graph1', 'following')
+        mock_get_edge_weights_sketch.assert_called_with(mock_iter_graph_edges.return_value, ['user1'], threshold=1, top_k=10)
+        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2', scores=[('user2', 3)], plot=None, plot_resources=CDN.render())
+
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_graph_accounts')
+    @patch('app_script.get_connection')
+    @patch('app_script.get_candidate_counts')
+    @patch('app_script.get_account_store')
+    @patch('app_script.get_edge_weights_store')
+    @patch('app_script.render_template')
+    def test_analyze_scoring_mode(self, mock_render_template, mock_get_edge_weights_store, mock_get_account_store, mock_get_candidate_counts, mock_sqlite_connect, mock_get_graph_accounts, mock_get_graph_version):
+        # Test that a similarity score is computed with sparse matrix operations, whatever the engine
+        mock_get_graph_version.return_value = 1
+        mock_get_graph_accounts.return_value = ['user1']
+        mock_get_edge_weights_store.return_value = [('user2', 0.5)]
+
+        app.config = dict(app.default_config, DATABASE='mock_db')
+
+        with app.test_request_context('/'):
+            form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'adamic_adar', 'graph_type': 'no_plot', 'engine': 'index'})
+            with patch('app_script.request.form', form_data):
+                analyze()
+
+        mock_get_candidate_counts.assert_not_called()
+        mock_get_edge_weights_store.assert_called_with(mock_get_account_store.return_value, 'following', mode='adamic_adar', threshold=1, top_n=None, top_k=None)
+        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2', scores=[('user2', 0.5)], plot=None, plot_resources=CDN.render())
+
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_graph_accounts')
+    @patch('app_script.get_connection')
+    @patch('app_script.get_account_store')
+    @patch('app_script.get_edge_weights_store')
+    @patch('app_script.render_template')
+    def test_analyze_cache(self, mock_render_template, mock_get_edge_weights_store, mock_get_account_store, mock_sqlite_connect, mock_get_graph_accounts, mock_get_graph_version):
+        mock_get_graph_version.return_value = 1
+        mock_get_graph_accounts.return_value = ['user1']
+        mock_get_edge_weights_store.return_value = [('user2', 1)]
+
+        app.config = {'DATABASE': 'mock_db', 'APPLICATION_ROOT': '/', 'PREFERRED_URL_SCHEME': 'http', 'SERVER_NAME': 'localhost:5000'
+                           , 'SECRET_KEY': '', 'PRESERVE_CONTEXT_ON_EXCEPTION': '', 'DEBUG':''}
+
+        form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'common', 'graph_type': 'no_plot', 'engine': 'sparse'})
+
+        with app.test_request_context('/'):
+            with patch('app_script.request.form', form_data):
+                analyze()
+                analyze()
+
+                # A write to the graph bumps its version, and invalidates the cached result
+                mock_get_graph_version.return_value = 2
+                analyze()
+
+        self.assertEqual(mock_get_account_store.call_count, 2)
+        self.assertEqual(mock_render_template.call_count, 3)
+
+class TestJobs(unittest.TestCase):
+    def setUp(self):
+        analysis_cache.clear()
+        app.config = dict(app.default_config, DATABASE='mock_db', ASYNC_JOBS=True)
+        self.form_data = ImmutableMultiDict({'graphs': 'graph1', 'connection_type': 'following', 'analysis_type': 'common', 'graph_type': 'no_plot', 'engine': 'sparse'})
+
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_connection')
+    @patch('app_script.render_template')
+    @patch('app_script.job_queue')
+    def test_analyze_submits_job(self, mock_job_queue, mock_render_template, mock_sqlite_connect, mock_get_graph_version):
+        # Test that an uncached analysis is submitted to the job queue, and the result page polls for it
+        mock_get_graph_version.return_value = 1
+        mock_job_queue.submit.return_value = 'job1'
+        mock_job_queue.get.return_value = {'id': 'job1', 'status': 'queued', 'result': None, 'error': None}
+
+        with app.test_request_context('/', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+            with patch('app_script.request.form', self.form_data):
+                analyze()
+
+        cache_key = ('database/127.0.0.1database.db', '', 'graph1', 'following', 'common', 'no_plot', 1, None, 1, 'sparse', 'auto')
+        self.assertEqual(mock_job_queue.submit.call_args[0][0], cache_key)
+        mock_render_template.assert_called_with('result.html', graph='graph1', job_id='job1', recommended_accounts='', scores=[], plot=None, plot_resources=CDN.render())
+
+        # A finished job is rendered directly, and its result is cached
+        mock_job_queue.get.return_value = {'id': 'job1', 'status': 'done', 'result': ([('user2', 1)], None), 'error': None}
+
+        with app.test_request_context('/', environ_base={'REMOTE_ADDR': '127.0.0.1'}):
+            with patch('app_script.request.form', self.form_data):
+                analyze()
+
+        mock_render_template.assert_called_with('result.html', graph='graph1', recommended_accounts='user2', scores=[('user2', 1)], plot=None, plot_resources=CDN.render())
+        self.assertEqual(analysis_cache.get(cache_key), ([('user2', 1)], None))
+
+    @patch('app_script.get_graph_version')
+    @patch('app_script.get_connection')
+    @patch('app_script.job_queue')
+    def test_submit_job(self, mock_job_queue, mock_sqlite_connect, mock_get_graph_version):
+        mock_get_graph_version.return_value = 1
+        mock_job_queue.submit.return_value = 'job1'
+        mock_job_queue.get.return_value = {'id': 'job1', 'status': 'queued', 'result': None, 'error': None}
+
+        with app.test_request_context('/'):
+            with patch('app_script.request.form', self.form_data):
+                response, status = submit_job()
+
+        self.assertEqual(status, 202)
+        self.assertEqual(response.get_json(), {'job_id': 'job1', 'status': 'queued'})
+
+    @patch('app_script.get_connection')
+    @patch('app_script.job_queue')
+    def test_submit_job_invalid_top_n(self, mock_job_queue, mock_sqlite_connect):
+        # Test that an analysis that would keep no accounts is refused
+        for top_n in ('0', '-1'):
+            with app.test_request_context('/'):
+                with patch('app_script.request.form', self.form_data.copy()) as form_data:
+                    form_data['top_n'] = top_n
+
+                    with self.assertRaises(BadRequest):
+                        submit_job()
+
+        mock_job_queue.submit.assert_not_called()
+
+    @patch('app_script.job_queue')
+    def test_job_status(self, mock_job_queue):
+        # Test that a finished job returns its recommended accounts, scores and plot components, and caches its result
+        cache_key = ('database/127.0.0.1database.db', '', 'graph1', 'following', 'common', 'no_plot', 1, None, 1, 'sparse', 'auto')
+        mock_job_queue.get.return_value = {'id': 'job1', 'key': cache_key, 'status': 'done', 'result': ([('user2', 2), ('user3', 1)], {'script': '', 'div': ''}), 'error': None}
+
+        with app.test_request_context('/'):
+            response = job_status('job1')
+
+        self.assertEqual(response.get_json(), {'job_id': 'job1', 'status': 'done', 'error': None, 'recommended_accounts': 'user2, user3', 'scores': [['user2', 2], ['user3', 1]], 'plot': {'script': '', 'div': ''}})
+        self.assertEqual(analysis_cache.get(cache_key), ([('user2', 2), ('user3', 1)], {'script': '', 'div': ''}))
+
+        mock_job_queue.get.return_value = None
+
+        with app.test_request_context('/'):
+            response, status = job_status('unknown')
+
+        self.assertEqual(status, 404)
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config['INSTRUMENTATION'] = False
+
+    def test_metrics_disabled(self):
+        app.config['INSTRUMENTATION'] = False
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('Server-Timing', response.headers)
+
+    def test_metrics(self):
+        # Test that requests get a Server-Timing header, and their duration is added to the metrics
+        app.config['INSTRUMENTATION'] = True
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('total;dur=', response.headers['Server-Timing'])
+
+        response = self.client.get('/metrics')
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        self.assertIn('graphexplore_request_seconds_count{endpoint="get_metrics"}', response.get_data(as_text=True))
+
 if __name__ == '__main__':
     unittest.main()
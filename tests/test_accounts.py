@@ -7,7 +7,8 @@ cwd = os.getcwd()
 sys.path.append(cwd)
 
 import unittest
-from lib.account import Account
+import numpy as np
+from lib.account import Account, AccountStore
 
 class TestAccount(unittest.TestCase):
     def setUp(self):
@@ -33,5 +34,34 @@ class TestAccount(unittest.TestCase):
         self.assertEqual(account.follower_accounts, self.follower_accounts)
         self.assertEqual(account.following_accounts, self.following_accounts)
 
+class TestAccountStore(unittest.TestCase):
+    def setUp(self):
+        self.accounts = [Account("A", "Description", ["B", "C"], ["C"]), Account("B", None, ["C"], [])]
+        self.store = AccountStore(self.accounts)
+
+    def test_stored_account_attributes(self):
+        # Test that stored accounts have the same attributes as the Account objects they were built from
+        self.assertEqual(len(self.store), 2)
+
+        for account, stored_account in zip(self.accounts, self.store):
+            self.assertEqual(stored_account.account_name, account.account_name)
+            self.assertEqual(stored_account.account_description, account.account_description)
+            self.assertEqual(stored_account.follower_accounts, account.follower_accounts)
+            self.assertEqual(stored_account.following_accounts, account.following_accounts)
+
+        self.assertEqual(self.store[-1].account_name, "B")
+        self.assertFalse(hasattr(self.store[0], '__dict__'))
+
+    def test_interned_edges(self):
+        # Test that each name is stored once, and the links are exposed as integer arrays
+        self.assertEqual(self.store.index.names, ["A", "B", "C"])
+        users, targets = self.store.edge_arrays('followers')
+        self.assertEqual(users.dtype, np.uint32)
+        self.assertEqual(users.tolist(), [0, 0, 1])
+        self.assertEqual(targets.tolist(), [1, 2, 2])
+        pairs = self.store.pairs('followers')
+        self.assertEqual(pairs, [("A", "B"), ("A", "C"), ("B", "C")])
+        self.assertIs(pairs[1][1], pairs[2][1])
+
 if __name__ == '__main__': 
     unittest.main() 
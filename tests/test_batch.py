@@ -0,0 +1,50 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import tempfile
+import unittest
+from lib.batch import analyze_graphs
+from lib.database import connect, initialise_database, insert_account, get_graph_accounts, get_graph_edges
+from lib.sparse import get_edge_weights_sparse, get_similar_accounts_sparse
+
+class TestAnalyzeGraphs(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, 'test.db')
+
+        conn = connect(self.db_file)
+        initialise_database(conn)
+        insert_account(conn, 'graph1', 'A', ['X', 'Y', 'B'], ['X', 'Z'])
+        insert_account(conn, 'graph1', 'B', ['X', 'Z'], ['X', 'Y', 'Y'])
+        insert_account(conn, 'graph1', 'C', ['Y'], ['X', 'Z', 'A'])
+        insert_account(conn, 'graph2', 'D', ['X', 'W'], ['W'])
+        conn.commit()
+        self.conn = conn
+
+    def tearDown(self):
+        self.conn.close()
+        self.directory.cleanup()
+
+    def test_analyze_graphs_single_connection_type(self):
+        # Test that each graph gets the same ranking as get_edge_weights_sparse
+        results = analyze_graphs(self.db_file, ['graph1', 'graph2'], connection_types=('following',), mode='common', threshold=1, max_workers=2)
+
+        for graph_name in ['graph1', 'graph2']:
+            expected_result = get_edge_weights_sparse(get_graph_edges(self.conn, graph_name, 'following'), get_graph_accounts(self.conn, graph_name), mode='common', threshold=1)
+            self.assertEqual(results[graph_name], expected_result)
+
+    def test_analyze_graphs_blends_connection_types(self):
+        # Test that the following and follower scores are blended in the same way as get_similar_accounts_sparse
+        results = analyze_graphs(self.db_file, ['graph1'], following_follower_ratio=0.5, top_k=2, max_workers=2)
+        following_edges = get_graph_edges(self.conn, 'graph1', 'following')
+        follower_edges = get_graph_edges(self.conn, 'graph1', 'followers')
+        expected_result = get_similar_accounts_sparse(following_edges, follower_edges, get_graph_accounts(self.conn, 'graph1'), 0.5, top_k=2)
+        self.assertEqual(results, {'graph1': expected_result})
+
+if __name__ == '__main__':
+    unittest.main()
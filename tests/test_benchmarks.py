@@ -0,0 +1,65 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import io
+import unittest
+from benchmarks.generate import generate_accounts, generate_edges, write_csv
+from benchmarks.run import compare, measure
+from lib.database import connect, initialise_database, import_csv, get_graph_accounts
+
+class TestGenerateAccounts(unittest.TestCase):
+    def test_generate_accounts(self):
+        # Test that the same arguments generate the same graph, with distinct links of about the requested number
+        accounts = generate_accounts(seeds=10, candidates=200, edges=500)
+        self.assertEqual([(v.account_name, v.follower_accounts, v.following_accounts) for v in accounts],
+                         [(v.account_name, v.follower_accounts, v.following_accounts) for v in generate_accounts(seeds=10, candidates=200, edges=500)])
+        self.assertEqual(len(accounts), 10)
+
+        for account in accounts:
+            self.assertEqual(len(set(account.follower_accounts)), len(account.follower_accounts))
+            self.assertLessEqual(len(account.follower_accounts), 200)
+
+        self.assertAlmostEqual(sum(len(v.following_accounts) for v in accounts), 500, delta=50)
+
+    def test_generate_edges(self):
+        # Test that the same arguments generate the same pairs, with at least one link per seed account
+        edges = generate_edges(seeds=300, candidates=50, edges=1000)
+        self.assertEqual(edges, generate_edges(seeds=300, candidates=50, edges=1000))
+        self.assertEqual(len({k for k, v in edges}), 300)
+        self.assertLessEqual(len({v for k, v in edges}), 50)
+        self.assertAlmostEqual(len(edges), 1000, delta=300)
+
+    def test_write_csv(self):
+        # Test that the generated accounts can be uploaded
+        accounts = generate_accounts(seeds=5, candidates=50, edges=100)
+        file = io.StringIO()
+        write_csv(accounts, file, graph_name='graph1')
+        file.seek(0)
+
+        conn = connect(':memory:')
+        initialise_database(conn)
+        self.assertEqual(import_csv(conn, file), (5, 0))
+        self.assertEqual(get_graph_accounts(conn, 'graph1'), [v.account_name for v in accounts])
+
+class TestCompare(unittest.TestCase):
+    def test_measure(self):
+        result = measure(lambda: [0] * 100000, repeat=2)
+        self.assertGreater(result['time'], 0)
+        self.assertGreaterEqual(result['peak_memory'], 800000)
+
+    def test_compare(self):
+        # Test that only differences over both the relative and absolute tolerances are regressions
+        baseline = {'a': {'time': 1.0, 'peak_memory': 10 ** 8}, 'b': {'time': 0.001, 'peak_memory': 1000}, 'c': {'time': 1.0, 'peak_memory': 1000}}
+        results = {'a': {'time': 2.0, 'peak_memory': 2 * 10 ** 8}, 'b': {'time': 0.002, 'peak_memory': 2000}, 'd': {'time': 1.0, 'peak_memory': 1000}}
+        regressions = compare(results, baseline)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('a: time'))
+        self.assertTrue(regressions[1].startswith('a: peak memory'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import unittest
+from lib.cache import AnalysisCache
+
+class TestAnalysisCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = AnalysisCache()
+        cache.put(('db', 'graph1', 1), ([('A', 2)], None))
+        self.assertEqual(cache.get(('db', 'graph1', 1)), ([('A', 2)], None))
+        self.assertIsNone(cache.get(('db', 'graph1', 2)))
+
+    def test_lru_eviction(self):
+        # Test that the least recently used entry is evicted once the cache is full
+        cache = AnalysisCache(max_entries=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+
+    def test_size_cap(self):
+        # Test that entries are evicted to keep the total size under the byte limit
+        cache = AnalysisCache(max_bytes=1000)
+        cache.put('a', 'x' * 600)
+        cache.put('b', 'x' * 600)
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        self.assertLessEqual(cache.total_bytes, 1000)
+
+        # values larger than the whole cache are not stored
+        cache.put('c', 'x' * 2000)
+        self.assertNotIn('c', cache)
+
+if __name__ == '__main__':
+    unittest.main()
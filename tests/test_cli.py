@@ -0,0 +1,135 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import contextlib
+import io
+import tempfile
+import json
+import unittest
+from unittest.mock import patch
+from lib.cli import main
+from lib.database import connect, initialise_database, insert_account, get_graph_accounts
+
+class TestBatchCommand(unittest.TestCase):
+    def test_batch(self):
+        # Test that every graph is analyzed when no graph is given, and the rankings are written in csv format
+        with tempfile.TemporaryDirectory() as directory:
+            db_file = os.path.join(directory, 'test.db')
+            conn = connect(db_file)
+            initialise_database(conn)
+            insert_account(conn, 'graph1', 'A', ['X'], ['X', 'Y'])
+            insert_account(conn, 'graph2', 'B', [], ['Z'])
+            conn.commit()
+            conn.close()
+
+            output = io.StringIO()
+
+            with contextlib.redirect_stdout(output):
+                main(['batch', db_file, '--connection-type', 'following', '--workers', '1'])
+
+        self.assertEqual(output.getvalue().splitlines(), ['graph,rank,account,score', 'graph1,1,X,1.0', 'graph1,2,Y,1.0', 'graph2,1,Z,1.0'])
+
+class TestAnalyzeCommand(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_files = []
+
+        for i, account_name in enumerate(['A', 'B']):
+            db_file = os.path.join(self.directory.name, str(i) + 'database.db')
+            conn = connect(db_file)
+            initialise_database(conn)
+            insert_account(conn, 'graph1', account_name, [], ['X', 'Y'])
+            insert_account(conn, 'graph2', account_name, [], ['Z'])
+            conn.commit()
+            conn.close()
+            self.db_files.append(db_file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_analyze_jsonl(self):
+        # Test that every graph of every database file is analyzed, and the rankings are written in jsonl format
+        output_file = os.path.join(self.directory.name, 'output.jsonl')
+        main(['analyze'] + self.db_files + ['--connection-type', 'following', '--workers', '1', '--top-k', '1', '--format', 'jsonl', '--output', output_file])
+
+        with open(output_file) as file:
+            rows = [json.loads(v) for v in file]
+
+        self.assertEqual(rows, [{'database': db_file, 'tenant': '', 'graph': graph_name, 'rank': 1, 'account': account, 'score': 1.0}
+                                for db_file in self.db_files for graph_name, account in [('graph1', 'X'), ('graph2', 'Z')]])
+
+    def test_analyze_csv(self):
+        # Test that only the given graphs are analyzed, and the rankings are written to stdout in csv format
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output):
+            main(['analyze', self.db_files[0], '--graph', 'graph2', '--connection-type', 'following', '--workers', '1'])
+
+        self.assertEqual(output.getvalue().splitlines(), ['database,tenant,graph,rank,account,score', self.db_files[0] + ',,graph2,1,Z,1.0'])
+
+    def test_analyze_default_databases(self):
+        # Test that the per-tenant database files and every tenant of the shared database file are analyzed by default
+        conn = connect(os.path.join(self.directory.name, 'graphexplore.db'), '10.0.0.1')
+        initialise_database(conn)
+        insert_account(conn, 'graph1', 'C', [], ['W'])
+        conn.tenant = '10.0.0.2'
+        insert_account(conn, 'graph1', 'D', [], ['V'])
+        conn.commit()
+        conn.close()
+
+        output = io.StringIO()
+
+        with contextlib.redirect_stdout(output), patch('lib.cli.DEFAULT_DATABASES', os.path.join(self.directory.name, '*database.db')), \
+                patch('lib.storage.SHARED_DATABASE', os.path.join(self.directory.name, 'graphexplore.db')):
+            main(['analyze', '--graph', 'graph1', '--connection-type', 'following', '--workers', '1', '--top-k', '1'])
+
+        shared_file = os.path.join(self.directory.name, 'graphexplore.db')
+        self.assertEqual(output.getvalue().splitlines(), ['database,tenant,graph,rank,account,score', self.db_files[0] + ',,graph1,1,X,1.0', self.db_files[1] + ',,graph1,1,X,1.0',
+                                                          shared_file + ',10.0.0.1,graph1,1,W,1.0', shared_file + ',10.0.0.2,graph1,1,V,1.0'])
+
+    def test_analyze_parquet_needs_output(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                main(['analyze', self.db_files[0], '--format', 'parquet'])
+
+class TestMigrateCommand(unittest.TestCase):
+    def test_migrate(self):
+        # Test that every per-tenant database file is copied into the shared file, which can then be analyzed per tenant
+        with tempfile.TemporaryDirectory() as directory:
+            db_files = []
+
+            for tenant, account_name in [('10.0.0.1', 'A'), ('10.0.0.2', 'B')]:
+                db_file = os.path.join(directory, tenant + 'database.db')
+                conn = connect(db_file)
+                initialise_database(conn)
+                insert_account(conn, 'graph1', account_name, [], ['X'])
+                conn.commit()
+                conn.close()
+                db_files.append(db_file)
+
+            shared_file = os.path.join(directory, 'shared.db')
+            output = io.StringIO()
+
+            with contextlib.redirect_stdout(output):
+                main(['migrate', shared_file] + db_files)
+
+            self.assertEqual(output.getvalue().splitlines(), ['database,tenant,accounts', db_files[0] + ',10.0.0.1,1', db_files[1] + ',10.0.0.2,1'])
+
+            conn = connect(shared_file, '10.0.0.2')
+            self.assertEqual(get_graph_accounts(conn, 'graph1'), ['B'])
+            conn.close()
+
+            output = io.StringIO()
+
+            with contextlib.redirect_stdout(output):
+                main(['batch', shared_file, '--tenant', '10.0.0.2', '--connection-type', 'following', '--workers', '1'])
+
+        self.assertEqual(output.getvalue().splitlines(), ['graph,rank,account,score', 'graph1,1,X,1.0'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,433 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import io
+import tempfile
+import threading
+import unittest
+import sqlite3 as _sql
+from flask import Flask
+from lib.database import (
+    ConnectionPool,
+    connection_pool,
+    connect,
+    get_connection,
+    release_connections,
+    initialise_database,
+    parse_account_list,
+    insert_account,
+    insert_accounts,
+    upsert_account,
+    upsert_accounts,
+    import_csv,
+    get_account_connections,
+    get_graph_accounts,
+    get_graph_names,
+    get_account_names,
+    get_account_store,
+    get_candidate_counts,
+    get_graph_edges,
+    iter_graph_edges,
+    get_graph_version,
+    remove_graph,
+    remove_account,
+    tenant_exists
+)
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, 'test.db')
+
+    def tearDown(self):
+        connection_pool.close_all()
+        self.directory.cleanup()
+
+    def test_connect_wal(self):
+        # Test that connections use WAL journaling with synchronous=NORMAL
+        conn = connect(self.db_file)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 1)
+        conn.close()
+
+    def test_pool_reuses_connections(self):
+        pool = ConnectionPool(max_idle=1)
+        conn = pool.acquire(self.db_file)
+        conn.execute("CREATE TABLE test (value integer)")
+        conn.execute("INSERT INTO test VALUES (1)")
+        pool.release(self.db_file, conn)
+
+        # the uncommitted transaction is rolled back when the connection is returned to the pool
+        self.assertFalse(conn.in_transaction)
+        self.assertIs(pool.acquire(self.db_file), conn)
+        pool.close_all()
+
+    def test_get_connection_app_context(self):
+        # Test that a connection is shared within an app context, and released when it is torn down
+        app = Flask(__name__)
+        app.teardown_appcontext(release_connections)
+
+        with app.app_context():
+            conn = get_connection(self.db_file)
+            self.assertIs(get_connection(self.db_file), conn)
+
+        with app.app_context():
+            self.assertIs(get_connection(self.db_file), conn)
+
+class TestInitialiseDatabase(unittest.TestCase):
+    def test_initialise_database_creates_indexes(self):
+        # Test that the normalized tables are created with their indexes
+        conn = _sql.connect(':memory:')
+        initialise_database(conn)
+        indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")]
+        self.assertIn('idx_edges_graph_user', indexes)
+        self.assertIn('idx_edges_graph_target', indexes)
+        self.assertIn('idx_edges_graph_direction', indexes)
+
+    def test_initialise_database_migrates_legacy_table(self):
+        # Test that a legacy 'connections' table is split into one row per edge
+        conn = _sql.connect(':memory:')
+        conn.execute("CREATE TABLE connections (graph text, user text, followers text, following text)")
+        conn.execute("INSERT INTO connections VALUES ('graph1', 'A', 'B, C', 'D')")
+        conn.execute("INSERT INTO connections VALUES ('graph1', 'B', '', 'A, C')")
+        conn.commit()
+        initialise_database(conn)
+        self.assertEqual(get_graph_accounts(conn, 'graph1'), ['A', 'B'])
+        self.assertEqual(get_graph_edges(conn, 'graph1', 'followers'), [('A', 'B'), ('A', 'C')])
+        self.assertEqual(get_graph_edges(conn, 'graph1', 'following'), [('A', 'D'), ('B', 'A'), ('B', 'C')])
+        self.assertIsNone(conn.execute("SELECT name FROM sqlite_master WHERE name='connections'").fetchone())
+
+    def test_initialise_database_adds_tenants(self):
+        # Test that the rows of a database created before tenants were stored are kept, under the default tenant
+        conn = _sql.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE accounts (graph text, user text);
+            CREATE TABLE edges (graph text, user text, target text, direction text);
+            CREATE TABLE graph_versions (graph text PRIMARY KEY, version integer NOT NULL);
+            CREATE TABLE candidate_counts (graph text, direction text, target text, links integer NOT NULL, seeds integer NOT NULL, PRIMARY KEY (graph, direction, target));
+            INSERT INTO accounts VALUES ('graph1', 'A');
+            INSERT INTO edges VALUES ('graph1', 'A', 'X', 'followers'), ('graph1', 'A', 'Y', 'following');
+            INSERT INTO graph_versions VALUES ('graph1', 5);
+            INSERT INTO candidate_counts VALUES ('graph1', 'followers', 'X', 1, 1), ('graph1', 'following', 'Y', 1, 1);
+            PRAGMA user_version = 3;
+        """)
+        initialise_database(conn)
+        self.assertEqual(get_account_connections(conn, 'graph1', 'A'), (['X'], ['Y']))
+        self.assertEqual(get_graph_version(conn, 'graph1'), 5)
+        self.assertEqual(get_candidate_counts(conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 1)])
+        self.assertEqual(conn.execute("SELECT DISTINCT tenant FROM edges").fetchall(), [('',)])
+        self.assertIsNone(conn.execute("SELECT name FROM sqlite_master WHERE name='graph_versions_v3'").fetchone())
+        self.assertEqual(conn.execute("SELECT hash FROM accounts").fetchall(), [(None,)])
+
+    def test_initialise_database_adds_graph_versions(self):
+        # Test that the graphs of a database created before graph versions were stored are still listed
+        conn = _sql.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE accounts (graph text, user text);
+            CREATE TABLE edges (graph text, user text, target text, direction text);
+            CREATE INDEX idx_accounts_graph_user ON accounts (graph, user);
+            CREATE INDEX idx_edges_graph_user ON edges (graph, user);
+            CREATE INDEX idx_edges_graph_target ON edges (graph, target);
+            INSERT INTO accounts VALUES ('graph1', 'A'), ('graph2', 'B'), ('graph2', 'C');
+            INSERT INTO edges VALUES ('graph1', 'A', 'X', 'followers'), ('graph2', 'B', 'X', 'following');
+            PRAGMA user_version = 1;
+        """)
+        initialise_database(conn)
+        self.assertEqual(get_graph_names(conn), ['graph1', 'graph2'])
+        self.assertEqual(get_graph_version(conn, 'graph2'), 1)
+        self.assertEqual(get_account_connections(conn, 'graph2', 'B'), ([], ['X']))
+        self.assertEqual(get_candidate_counts(conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 1)])
+
+class TestTenants(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, 'test.db')
+        self.conn1 = connect(self.db_file, 'tenant1')
+        self.conn2 = connect(self.db_file, 'tenant2')
+        initialise_database(self.conn1)
+
+        for conn, followers in [(self.conn1, ['X']), (self.conn2, ['X', 'Y'])]:
+            insert_account(conn, 'graph1', 'A', followers, [])
+            conn.commit()
+
+    def tearDown(self):
+        self.conn1.close()
+        self.conn2.close()
+        connection_pool.close_all()
+        self.directory.cleanup()
+
+    def test_tenants_are_isolated(self):
+        # Test that the tenants of a shared database file only see their own graphs
+        self.assertEqual(get_account_connections(self.conn1, 'graph1', 'A'), (['X'], []))
+        self.assertEqual(get_account_connections(self.conn2, 'graph1', 'A'), (['X', 'Y'], []))
+        self.assertEqual(get_candidate_counts(self.conn2, 'graph1', 'followers', mode='common', threshold=0), [('X', 1), ('Y', 1)])
+
+        insert_account(self.conn2, 'graph2', 'B', [], [])
+        self.conn2.commit()
+        remove_account(self.conn1, 'A')
+        self.conn1.commit()
+        self.assertEqual(get_graph_names(self.conn1), [])
+        self.assertEqual(get_graph_names(self.conn2), ['graph1', 'graph2'])
+        self.assertEqual(get_graph_version(self.conn1, 'graph1'), 2)
+        self.assertEqual(get_graph_version(self.conn2, 'graph1'), 1)
+
+        self.assertTrue(tenant_exists(self.conn1))
+        self.assertFalse(tenant_exists(connect(self.db_file, 'tenant3')))
+
+    def test_pool_binds_tenant(self):
+        # Test that a pooled connection is reused by another tenant of the same database file
+        pool = ConnectionPool(max_idle=1)
+        conn = pool.acquire(self.db_file, 'tenant1')
+        pool.release(self.db_file, conn)
+        self.assertIs(pool.acquire(self.db_file, 'tenant2'), conn)
+        self.assertEqual(get_account_connections(conn, 'graph1', 'A'), (['X', 'Y'], []))
+        pool.close_all()
+
+class TestParseAccountList(unittest.TestCase):
+    def test_parse_account_list(self):
+        self.assertEqual(parse_account_list('A, B,C ,'), ['A', 'B', 'C'])
+        self.assertEqual(parse_account_list(''), [])
+
+class TestAccountConnections(unittest.TestCase):
+    def setUp(self):
+        self.conn = _sql.connect(':memory:')
+        initialise_database(self.conn)
+        insert_account(self.conn, 'graph1', 'A', ['B', 'C'], ['D'])
+        insert_account(self.conn, 'graph2', 'A', ['E'], [])
+
+    def test_get_account_connections(self):
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'A'), (['B', 'C'], ['D']))
+        self.assertIsNone(get_account_connections(self.conn, 'graph1', 'Z'))
+
+    def test_iter_graph_edges(self):
+        # Test that the edges are streamed in the same order as they are read by get_graph_edges
+        self.assertEqual(list(iter_graph_edges(self.conn, 'graph1', 'followers', fetch_size=1)), get_graph_edges(self.conn, 'graph1', 'followers'))
+
+        # the edges are read in index order, without sorting them
+        plan = self.conn.execute("EXPLAIN QUERY PLAN SELECT user, target FROM edges WHERE tenant=? AND graph=? AND direction=? ORDER BY rowid", ('', 'graph1', 'followers')).fetchall()
+        self.assertNotIn('TEMP B-TREE', str(plan))
+
+    def test_get_account_store(self):
+        store = get_account_store(self.conn, 'graph1')
+        self.assertEqual([v.account_name for v in store], ['A'])
+        self.assertEqual(store.pairs('followers'), get_graph_edges(self.conn, 'graph1', 'followers'))
+        self.assertEqual(store.pairs('following'), get_graph_edges(self.conn, 'graph1', 'following'))
+        self.assertEqual(get_account_store(self.conn, 'graph1', ('following',)).pairs('followers'), [])
+
+    def test_get_graph_names(self):
+        self.assertEqual(get_graph_names(self.conn), ['graph1', 'graph2'])
+        remove_graph(self.conn, 'graph1')
+        self.assertEqual(get_graph_names(self.conn), ['graph2'])
+
+    def test_get_account_names(self):
+        # Test the prefix search and pagination of account names
+        for name in ['Bob', 'Bobby', 'Alice', 'Bo', 'Carl']:
+            insert_account(self.conn, 'graph1', name, [], [])
+        self.assertEqual(get_account_names(self.conn, 'graph1'), ['A', 'Alice', 'Bo', 'Bob', 'Bobby', 'Carl'])
+        self.assertEqual(get_account_names(self.conn, 'graph1', prefix='Bob'), ['Bob', 'Bobby'])
+        self.assertEqual(get_account_names(self.conn, 'graph1', offset=2, limit=2), ['Bo', 'Bob'])
+
+    def test_remove_graph(self):
+        remove_graph(self.conn, 'graph1')
+        self.assertEqual(get_graph_accounts(self.conn, 'graph1'), [])
+        self.assertEqual(get_graph_edges(self.conn, 'graph2', 'followers'), [('A', 'E')])
+
+        # the delete trigger is restored, and the candidate counts of the other graphs are left alone
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name = 'trg_edges_delete'").fetchone()[0], 1)
+        self.assertEqual(self.conn.execute("SELECT DISTINCT graph FROM candidate_counts").fetchall(), [('graph2',)])
+        remove_account(self.conn, 'A')
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM candidate_counts").fetchone()[0], 0)
+
+    def test_graph_version(self):
+        # Test that every write to a graph increments its version
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 1)
+        insert_account(self.conn, 'graph1', 'B', [], [])
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 2)
+        remove_account(self.conn, 'A')
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 3)
+        self.assertEqual(get_graph_version(self.conn, 'graph2'), 2)
+        remove_graph(self.conn, 'graph1')
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 4)
+        self.assertEqual(get_graph_version(self.conn, 'graph3'), 0)
+
+    def test_remove_account(self):
+        remove_account(self.conn, 'A')
+        self.assertEqual(get_graph_accounts(self.conn, 'graph1'), [])
+        self.assertEqual(get_graph_edges(self.conn, 'graph2', 'followers'), [])
+
+class TestCandidateCounts(unittest.TestCase):
+    def setUp(self):
+        self.conn = _sql.connect(':memory:')
+        initialise_database(self.conn)
+        insert_account(self.conn, 'graph1', 'A', ['X', 'Y', 'B'], ['X'])
+        insert_account(self.conn, 'graph1', 'B', ['X', 'Z', 'Z'], [])
+
+    def test_get_candidate_counts(self):
+        # Test that links to accounts of the graph are left out, and duplicate links count once towards the degree
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 2), ('Y', 1), ('Z', 1)])
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='common', threshold=1), [('X', 2), ('Z', 1)])
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='uncommon', threshold=1), [('Y', 1)])
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='common', threshold=0, top_n=2), [('X', 2), ('Z', 1)])
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='common', threshold=0, top_k=1), [('X', 2)])
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'following', mode='common', threshold=0), [('X', 1)])
+
+    def test_candidate_counts_follow_writes(self):
+        # Test that the counts are updated by inserts and deletes, including bulk inserts
+        remove_account(self.conn, 'B')
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='common', threshold=0), [('B', 1), ('X', 1), ('Y', 1)])
+        insert_accounts(self.conn, [['graph1', 'C', 'X, Y, Y', ''], ['graph1', 'A', 'Y', '']])
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 2), ('Y', 2), ('B', 1)])
+        remove_graph(self.conn, 'graph1')
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM candidate_counts").fetchone()[0], 0)
+
+    def test_initialise_database_counts_existing_edges(self):
+        # Test that the counts of a database created before the candidate_counts table are computed on migration
+        conn = _sql.connect(':memory:')
+        conn.executescript("""
+            CREATE TABLE accounts (graph text, user text);
+            CREATE TABLE edges (graph text, user text, target text, direction text);
+            CREATE TABLE graph_versions (graph text PRIMARY KEY, version integer NOT NULL);
+            CREATE INDEX idx_edges_graph_target ON edges (graph, target);
+            INSERT INTO accounts VALUES ('graph1', 'A'), ('graph1', 'B');
+            INSERT INTO edges VALUES ('graph1', 'A', 'X', 'followers'), ('graph1', 'A', 'X', 'followers'), ('graph1', 'B', 'X', 'followers');
+            PRAGMA user_version = 2;
+        """)
+        initialise_database(conn)
+        self.assertEqual(get_candidate_counts(conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 2)])
+        insert_account(conn, 'graph1', 'C', ['X'], [])
+        self.assertEqual(get_candidate_counts(conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 3)])
+
+class TestBulkInsert(unittest.TestCase):
+    def setUp(self):
+        self.conn = _sql.connect(':memory:')
+        initialise_database(self.conn)
+
+    def test_insert_accounts_chunks(self):
+        # Test that rows are inserted across several chunks, and malformed rows are rejected
+        rows = [['graph1', 'user' + str(i), 'A, B', 'C'] for i in range(5)] + [['graph1', '', 'A', 'B'], ['graph1']]
+        self.assertEqual(insert_accounts(self.conn, rows, chunk_size=2), (5, 2))
+        self.assertEqual(len(get_graph_accounts(self.conn, 'graph1')), 5)
+        self.assertEqual(len(get_graph_edges(self.conn, 'graph1', 'followers')), 10)
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 1)
+
+    def test_insert_accounts_waits_for_writer(self):
+        # Test that a bulk insert waits for a concurrent writer to commit, rather than failing on a stale read snapshot
+        with tempfile.TemporaryDirectory() as directory:
+            db_file = os.path.join(directory, 'test.db')
+            conn = connect(db_file)
+            initialise_database(conn)
+            writer = connect(db_file)
+            writer.execute("BEGIN IMMEDIATE")
+            insert_account(writer, 'graph1', 'A', ['X'], [])
+            timer = threading.Timer(0.2, writer.commit)
+            timer.start()
+
+            try:
+                self.assertEqual(insert_accounts(conn, [['graph1', 'B', 'X', '']]), (1, 0))
+                conn.commit()
+                self.assertEqual(get_candidate_counts(conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 2)])
+
+                # the delete trigger of remove_graph is dropped in the same way
+                writer.execute("BEGIN IMMEDIATE")
+                insert_account(writer, 'graph2', 'C', ['Y'], [])
+                timer = threading.Timer(0.2, writer.commit)
+                timer.start()
+                remove_graph(conn, 'graph1')
+                conn.commit()
+                self.assertEqual(get_graph_names(conn), ['graph2'])
+            finally:
+                timer.join()
+                writer.close()
+                conn.close()
+
+    def test_import_csv(self):
+        # Test that the header row is skipped and the rows are committed
+        file = io.StringIO('graph,user,followers,following\ngraph1,A,"B, C",D\ngraph1,B,,\n')
+        pragmas = [self.conn.execute("PRAGMA " + v).fetchone()[0] for v in ('synchronous', 'temp_store', 'cache_size')]
+        self.assertEqual(import_csv(self.conn, file), (2, 0))
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'A'), (['B', 'C'], ['D']))
+
+        # the bulk loading PRAGMAs are restored
+        self.assertEqual([self.conn.execute("PRAGMA " + v).fetchone()[0] for v in ('synchronous', 'temp_store', 'cache_size')], pragmas)
+
+    def test_import_csv_without_header(self):
+        file = io.StringIO('graph1,A,B,C\n')
+        self.assertEqual(import_csv(self.conn, file), (1, 0))
+
+    def test_import_csv_large_field(self):
+        # Test that follower lists longer than the csv module's default field size limit can be imported
+        followers = ['account' + str(i) for i in range(20000)]
+        file = io.StringIO('graph1,A,"' + ', '.join(followers) + '",\n')
+        self.assertEqual(import_csv(self.conn, file), (1, 0))
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'A'), (followers, []))
+
+class TestUpsert(unittest.TestCase):
+    def setUp(self):
+        self.conn = _sql.connect(':memory:')
+        initialise_database(self.conn)
+
+    def assert_candidate_counts(self):
+        # the candidate counts kept by the triggers match a recount of the edges
+        recount = self.conn.execute("""SELECT tenant, graph, direction, target, COUNT(*), COUNT(DISTINCT user) FROM edges
+                                       GROUP BY tenant, graph, direction, target ORDER BY 1, 2, 3, 4""").fetchall()
+        self.assertEqual(self.conn.execute("SELECT * FROM candidate_counts ORDER BY 1, 2, 3, 4").fetchall(), recount)
+
+    def test_upsert_account(self):
+        # Test that an account is inserted, skipped when unchanged, and updated with only its added and removed edges
+        self.assertTrue(upsert_account(self.conn, 'graph1', 'A', ['X', 'Y', 'X'], ['Z']))
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'A'), (['X', 'Y'], ['Z']))
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 1)
+
+        self.assertFalse(upsert_account(self.conn, 'graph1', 'A', ['Y', 'X'], ['Z']))
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 1)
+
+        kept = self.conn.execute("SELECT rowid FROM edges WHERE target='Y'").fetchone()
+        self.assertTrue(upsert_account(self.conn, 'graph1', 'A', ['Y', 'W'], ['Z']))
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'A'), (['Y', 'W'], ['Z']))
+        self.assertEqual(self.conn.execute("SELECT rowid FROM edges WHERE target='Y'").fetchone(), kept)
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 2)
+        self.assert_candidate_counts()
+
+    def test_upsert_account_removes_duplicates(self):
+        # Test that the duplicate rows left by inserting an account twice are removed when it is upserted
+        insert_account(self.conn, 'graph1', 'A', ['X', 'Y'], [])
+        insert_account(self.conn, 'graph1', 'A', ['X', 'Y'], [])
+        self.assertTrue(upsert_account(self.conn, 'graph1', 'A', ['X', 'Y'], []))
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'A'), (['X', 'Y'], []))
+        self.assertEqual(get_graph_accounts(self.conn, 'graph1'), ['A'])
+        self.assertEqual(get_candidate_counts(self.conn, 'graph1', 'followers', mode='common', threshold=0), [('X', 1), ('Y', 1)])
+        self.assert_candidate_counts()
+
+        # the stored account now has a content hash, so the next upsert of the same sets is skipped
+        self.assertFalse(upsert_account(self.conn, 'graph1', 'A', ['X', 'Y'], []))
+
+    def test_upsert_accounts(self):
+        # Test that a re-import only writes the new and changed accounts, and bumps the version of each changed graph once
+        self.assertEqual(upsert_accounts(self.conn, [['graph1', 'A', 'X, Y', 'Z'], ['graph1', 'B', 'X', ''], ['graph2', 'C', 'X', ''], ['bad']], chunk_size=2), (3, 0, 1))
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 1)
+
+        rows = [['graph1', 'A', 'Y, X', 'Z'], ['graph1', 'B', 'X, W', ''], ['graph2', 'C', 'X', ''], ['graph1', 'D', 'X', ''], ['graph1', 'D', 'V', '']]
+        self.assertEqual(upsert_accounts(self.conn, rows, chunk_size=10), (2, 2, 0))
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'B'), (['X', 'W'], []))
+        self.assertEqual(get_account_connections(self.conn, 'graph1', 'D'), (['V'], []))
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 3)
+        self.assertEqual(get_graph_version(self.conn, 'graph2'), 1)
+        self.assert_candidate_counts()
+
+    def test_import_csv_upsert(self):
+        # Test that importing the same csv file twice in upsert mode does not duplicate its accounts
+        csv_data = 'graph,user,followers,following\ngraph1,A,"B, C",D\ngraph1,B,,\n'
+        self.assertEqual(import_csv(self.conn, io.StringIO(csv_data), upsert=True), (2, 0))
+        self.assertEqual(import_csv(self.conn, io.StringIO(csv_data), upsert=True), (0, 0))
+        self.assertFalse(self.conn.in_transaction)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM edges").fetchone()[0], 3)
+        self.assertEqual(get_graph_version(self.conn, 'graph1'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
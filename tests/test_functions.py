@@ -11,15 +11,23 @@ from unittest.mock import Mock, patch
 from lib.functions import (
     construct_account_graph,
     reduce_graph,
+    count_links,
+    select_accounts,
+    filter_edges,
     return_account_page,
     get_network_graph,
     get_similar_accounts,
-    get_edge_weights
+    get_edge_weights,
+    get_edge_weights_counts,
+    get_edge_weights_stream
 )
 import sqlite3 as _sql
+import tempfile
 
 import networkx as nx
-from lib.account import Account
+from bokeh.models import GraphRenderer, Image
+from lib.account import Account, AccountStore
+from lib.database import ACCOUNT_PAGE_SIZE, initialise_database, insert_account
 
 class TestConstructAccountGraph(unittest.TestCase):
     def test_construct_account_graph_followers(self):
@@ -34,6 +42,13 @@ class TestConstructAccountGraph(unittest.TestCase):
         expected_result = [('A', 'B'), ('A', 'C'), ('B', 'A'), ('B', 'C'), ('C', 'B'), ('C', 'A')]
         self.assertEqual(construct_account_graph(account_list, type='following'), expected_result)
 
+    def test_construct_account_graph_store(self):
+        # Test that an AccountStore gives the same pairs as the list of accounts it holds
+        account_list = [Account("A", "Description", ["B", "C"], ["D"]), Account("B", "Description", ["A"], ["C", "D"])]
+        store = AccountStore(account_list)
+        self.assertEqual(construct_account_graph(store, type='followers'), construct_account_graph(account_list, type='followers'))
+        self.assertEqual(construct_account_graph(store), construct_account_graph(account_list))
+
 class TestReduceGraph(unittest.TestCase):
     def test_reduce_graph_common(self):
         # Test reduce_graph with mode='common'
@@ -49,23 +64,81 @@ class TestReduceGraph(unittest.TestCase):
         expected_result = [("A", 1), ("D", 3)]
         self.assertEqual(reduce_graph(graph, major_accounts, mode='unique'), expected_result)
 
-class TestReturnAccountPage(unittest.TestCase):
+    def test_reduce_graph_threshold(self):
+        # Test reduce_graph with a custom threshold, keeping the accounts linked to more than two major accounts
+        graph = [("A", "X"), ("B", "X"), ("C", "X"), ("A", "Y"), ("B", "Y"), ("A", "B")]
+        major_accounts = ["A", "B", "C"]
+        self.assertEqual(reduce_graph(graph, major_accounts, mode='common', threshold=2), [("A", "X"), ("B", "X"), ("C", "X")])
+
+    def test_reduce_graph_top_n(self):
+        # Test reduce_graph with a top-N cutoff
+        graph = [("A", "X"), ("B", "X"), ("C", "X"), ("A", "Y"), ("B", "Y"), ("A", "Z")]
+        major_accounts = ["A", "B", "C"]
+        self.assertEqual(reduce_graph(graph, major_accounts, mode='common', threshold=0, top_n=1), [("A", "X"), ("B", "X"), ("C", "X")])
+
+class TestCountLinks(unittest.TestCase):
+    def test_count_links(self):
+        # Test that the links and distinct linking accounts of each account are counted from a stream of edges
+        graph = iter([("A", "X"), ("B", "X"), ("A", "Y"), ("A", "Y"), ("A", "B"), ("C", "Y")])
+        links, degrees = count_links(graph, ["A", "B", "C"])
+        self.assertEqual(links, {"X": 2, "Y": 3})
+        self.assertEqual(degrees, {"X": 2, "Y": 2})
+        self.assertEqual(select_accounts(links, mode='common', threshold=2), {"Y"})
+        self.assertEqual(select_accounts(links, mode='unique', threshold=2), {"X"})
+        self.assertEqual(list(filter_edges(iter([("A", "X"), ("A", "Y")]), {"Y"})), [("A", "Y")])
+
+    def test_get_edge_weights_stream(self):
+        # Test that streaming the edges ranks the accounts in the same way as reducing them into a graph
+        graph = [("A", "X"), ("B", "Z"), ("B", "X"), ("A", "Y"), ("A", "Y"), ("A", "B"), ("C", "Y"), ("C", "Z"), ("A", "X"), ("D", "W")]
+        major_accounts = ["A", "B", "C", "D"]
+
+        for mode, threshold, top_n, top_k in (('common', 1, None, None), ('common', 0, 2, None), ('unique', 2, None, None), ('common', 0, None, 1)):
+            g = nx.Graph()
+            g.add_edges_from(reduce_graph(graph, major_accounts, mode=mode, threshold=threshold, top_n=top_n))
+            expected_result = get_edge_weights(g, major_accounts, top_k=top_k)
+            self.assertEqual(get_edge_weights_stream(iter(graph), major_accounts, mode=mode, threshold=threshold, top_n=top_n, top_k=top_k), expected_result)
+
+        links, degrees = count_links(graph, major_accounts)
+        self.assertEqual(get_edge_weights_counts(degrees, {"X", "Z"}), [("X", 2), ("Z", 2)])
+
+    def test_count_links_many_accounts(self):
+        # Test that the distinct linking accounts are counted when the graph has many more accounts than linked accounts
+        graph = [("A" + str(i), "X" + str(i % 7)) for i in range(2000)] + [("A" + str(i), "X0") for i in range(0, 2000, 3)]
+        links, degrees = count_links(iter(graph), [])
+        self.assertEqual(degrees, dict(nx.Graph(graph).degree(["X" + str(i) for i in range(7)])))
+        self.assertEqual(sum(links.values()), len(graph))
+
+class TestReturnAccountPageDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.conn = _sql.connect(os.path.join(self.directory.name, 'test.db'))
+        initialise_database(self.conn)
+
+    def tearDown(self):
+        self.conn.close()
+        self.directory.cleanup()
+
     def test_return_account_page_empty(self):
         # Test return_account_page when database is empty
-        mock_app = Mock()
-        mock_app.config = {'DATABASE': ':memory:'}
-        self.assertEqual(return_account_page(mock_app), ('Empty', [], 'Empty', []))
+        self.assertEqual(return_account_page(self.conn), ('Empty', [], 'Empty', []))
 
     def test_return_account_page_non_empty(self):
         # Test return_account_page when database has data
-        mock_app = Mock()
-        mock_app.config = {'DATABASE': ':memory:'}
-        conn = _sql.connect(':memory:')
-        conn.execute("CREATE TABLE connections (graph text, user text, followers text, following text)")
-        conn.execute("INSERT INTO connections VALUES ('graph1', 'user1', 'follower1', 'following1')")
-        conn.execute("INSERT INTO connections VALUES ('graph2', 'user2', 'follower2', 'following2')")
-        conn.commit()
-        self.assertEqual(return_account_page(mock_app), ('graph1', ['graph1', 'graph2'], 'user1', ['user1', 'user2']))
+        insert_account(self.conn, 'graph2', 'user3', ['follower3'], ['following3'])
+        insert_account(self.conn, 'graph1', 'user2', ['follower2'], ['following2'])
+        insert_account(self.conn, 'graph1', 'user1', ['follower1'], ['following1'])
+        self.conn.commit()
+        self.assertEqual(return_account_page(self.conn), ('graph1', ['graph1', 'graph2'], 'user1', ['user1', 'user2']))
+        self.assertEqual(return_account_page(self.conn, 'graph2'), ('graph2', ['graph1', 'graph2'], 'user3', ['user3']))
+
+    def test_return_account_page_paginated(self):
+        # Test that only one page of accounts is returned
+        for i in range(ACCOUNT_PAGE_SIZE + 5):
+            insert_account(self.conn, 'graph1', 'user' + str(i).zfill(3), [], [])
+        self.conn.commit()
+        _, _, account_list_first, account_list = return_account_page(self.conn, page=1)
+        self.assertEqual(account_list_first, 'user' + str(ACCOUNT_PAGE_SIZE).zfill(3))
+        self.assertEqual(len(account_list), 5)
 
 class TestGetNetworkGraph(unittest.TestCase):
     def test_get_network_graph(self):
@@ -80,6 +153,21 @@ class TestGetNetworkGraph(unittest.TestCase):
         self.assertIsNotNone(plot)
         # Add more tests for other layouts if needed
 
+    def test_get_network_graph_render_modes(self):
+        # Test that every render mode draws the same nodes, and only the raster mode adds an edge image
+        graph = nx.Graph([("A", "B"), ("B", "C"), ("A", "C")])
+
+        for render_mode in ['canvas', 'webgl', 'raster']:
+            plot = get_network_graph(graph, ["A", "B"], render_mode=render_mode)
+            network_graph = plot.select_one(GraphRenderer)
+            self.assertEqual(plot.output_backend, 'canvas' if render_mode == 'canvas' else 'webgl')
+            self.assertEqual(list(network_graph.node_renderer.data_source.data['major']), [1, 1, 0])
+            self.assertEqual(len(plot.select(Image)) > 0, render_mode == 'raster')
+
+            # the raster mode only keeps the edges between major accounts as vector glyphs
+            edge_count = 1 if render_mode == 'raster' else 3
+            self.assertEqual(len(network_graph.edge_renderer.data_source.data['start']), edge_count)
+
 class TestGetSimilarAccounts(unittest.TestCase):
     def test_get_similar_accounts(self):
         # Test get_similar_accounts function
@@ -97,6 +185,17 @@ class TestGetSimilarAccounts(unittest.TestCase):
         expected_result = [('D', 2.0), ('B', 1.0), ('E', 1.0), ('C', 0.5)]
         self.assertEqual(get_similar_accounts(following_graph, follower_graph, major_accounts, following_follower_ratio), expected_result)
 
+    def test_get_similar_accounts_top_k(self):
+        # Test get_similar_accounts with accounts that appear in both graphs, and a top_k cutoff
+        following_graph = nx.Graph()
+        following_graph.add_edges_from([("A", "B"), ("A", "C")])
+
+        follower_graph = nx.Graph()
+        follower_graph.add_edges_from([("A", "B"), ("A", "D")])
+
+        expected_result = [('B', 1.5), ('D', 1.0)]
+        self.assertEqual(get_similar_accounts(following_graph, follower_graph, ["A"], 0.5, top_k=2), expected_result)
+
 class TestGetEdgeWeights(unittest.TestCase):
     def test_get_edge_weights(self):
         # Test get_edge_weights function
@@ -107,21 +206,23 @@ class TestGetEdgeWeights(unittest.TestCase):
         expected_result = [('B', 2), ('C', 1)]
         self.assertEqual(get_edge_weights(graph, major_accounts), expected_result)
 
+    def test_get_edge_weights_top_k(self):
+        # Test get_edge_weights with a top_k cutoff
+        graph = nx.Graph()
+        graph.add_edges_from([("A", "B"), ("B", "C"), ("C", "D"), ("D", "E")])
+        self.assertEqual(get_edge_weights(graph, ["A"], top_k=2), [('B', 2), ('C', 2)])
+
 import unittest
 from unittest.mock import Mock, patch
 
 class TestReturnAccountPage(unittest.TestCase):
-    @patch('lib.functions._sql.connect')
-    def test_return_account_page(self, mock_connect):
-        # Set the return value of the mock connect method to the mock cursor
-        mock_connect.return_value.execute.return_value = [("graph1", "account1", "followers1", "following1")]
-
-        # Mock the Flask app object
-        mock_app = Mock()
-        mock_app.config = {'DATABASE': 'mock_db'}
+    def test_return_account_page(self):
+        # Set the return values of the graph and account queries of the mock connection
+        mock_conn = Mock()
+        mock_conn.execute.side_effect = [[("graph1",)], [("account1",)]]
 
-        # Call the function with the mock app
-        graph_list_first, graph_list, account_list_first, account_list = return_account_page(mock_app)
+        # Call the function with the mock connection
+        graph_list_first, graph_list, account_list_first, account_list = return_account_page(mock_conn)
 
         # Check the returned values
         self.assertEqual(graph_list_first, "graph1")
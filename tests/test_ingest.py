@@ -0,0 +1,139 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import json
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from lib.database import connect, get_account_connections, get_graph_version, insert_accounts
+from lib.ingest import IngestBuffer, IngestBufferFull, parse_account, parse_ndjson
+
+class TestIngestBuffer(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, 'test.db')
+        self.buffer = IngestBuffer(max_accounts=10, batch_size=4, flush_interval=0.01)
+
+    def tearDown(self):
+        self.buffer.close()
+        self.directory.cleanup()
+
+    def test_put(self):
+        # Test that the accounts posted by concurrent producers are written in grouped transactions
+        def produce(i):
+            self.buffer.put(self.db_file, 'tenant1', [['graph1', 'user' + str(i), ['A', 'B'], 'C']], timeout=5)
+
+        producers = [threading.Thread(target=produce, args=(i,)) for i in range(8)]
+
+        for producer in producers:
+            producer.start()
+
+        for producer in producers:
+            producer.join()
+
+        self.assertTrue(self.buffer.flush(timeout=5))
+
+        stats = self.buffer.stats()
+        self.assertEqual(stats['written'], 8)
+        self.assertEqual(stats['pending'], 0)
+        self.assertLess(stats['batches'], 8)
+
+        conn = connect(self.db_file, 'tenant1')
+        self.assertEqual(get_account_connections(conn, 'graph1', 'user3'), (['A', 'B'], ['C']))
+        self.assertEqual(get_graph_version(conn, 'graph1'), stats['batches'])
+        self.assertEqual(get_account_connections(connect(self.db_file), 'graph1', 'user3'), None)
+        conn.close()
+
+    def test_put_upsert(self):
+        # Test that accounts added in upsert mode update the stored accounts rather than duplicating them
+        self.buffer.put(self.db_file, '', [['graph1', 'user1', ['A'], []]], upsert=True)
+        self.assertTrue(self.buffer.flush(timeout=5))
+        self.buffer.put(self.db_file, '', [['graph1', 'user1', ['A'], []], ['graph1', 'user2', ['B'], []]], upsert=True)
+        self.assertTrue(self.buffer.flush(timeout=5))
+
+        stats = self.buffer.stats()
+        self.assertEqual((stats['written'], stats['unchanged']), (2, 1))
+
+        conn = connect(self.db_file)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0], 2)
+        conn.close()
+
+    def test_backpressure(self):
+        # Test that a batch is refused when the buffer has no room for it, and accepted once the writer has made room
+        release = threading.Event()
+
+        with patch.object(self.buffer, '_write_batch', side_effect=lambda *args: release.wait(5)):
+            self.buffer.put(self.db_file, '', [['graph1', 'user' + str(i), [], []] for i in range(10)])
+
+            with self.assertRaises(IngestBufferFull):
+                self.buffer.put(self.db_file, '', [['graph1', 'user10', [], []]], timeout=0.05)
+
+            with self.assertRaises(ValueError):
+                self.buffer.put(self.db_file, '', [['graph1', 'user', [], []]] * 11)
+
+            release.set()
+            self.buffer.put(self.db_file, '', [['graph1', 'user10', [], []]], timeout=5)
+            self.assertTrue(self.buffer.flush(timeout=5))
+
+    def test_failed_batch(self):
+        # Test that a batch that cannot be written is counted as failed, without stopping the writer
+        self.buffer.put(os.path.join(self.directory.name, 'missing', 'test.db'), '', [['graph1', 'user1', [], []]])
+        self.buffer.put(self.db_file, '', [['graph1', 'user2', [], []]])
+        self.assertTrue(self.buffer.flush(timeout=5))
+
+        stats = self.buffer.stats()
+        self.assertEqual((stats['failed'], stats['failed_accounts'], stats['written']), (1, 1, 1))
+        self.assertIn('OperationalError', stats['last_error'])
+
+    def test_failed_batch_rows(self):
+        # Test that the rows of a failed batch are written one at a time, and the rows that still fail are kept
+        def insert_valid_accounts(conn, rows, chunk_size):
+            if any(v[1] == 'bad' for v in rows):
+                raise ValueError('bad account')
+
+            return insert_accounts(conn, rows, chunk_size=chunk_size)
+
+        with patch('lib.ingest.insert_accounts', side_effect=insert_valid_accounts):
+            self.buffer.put(self.db_file, 'tenant1', [['graph1', 'user1', ['A'], []], ['graph1', 'bad', [], []], ['graph1', 'user2', [], ['B']]])
+            self.assertTrue(self.buffer.flush(timeout=5))
+
+        stats = self.buffer.stats()
+        self.assertEqual((stats['failed'], stats['failed_accounts'], stats['written']), (1, 1, 2))
+        self.assertEqual(self.buffer.failed_rows(self.db_file, 'tenant1'), [{'row': ['graph1', 'bad', [], []], 'error': "ValueError('bad account')"}])
+        self.assertEqual(self.buffer.failed_rows(self.db_file, ''), [])
+
+        conn = connect(self.db_file, 'tenant1')
+        self.assertEqual(get_account_connections(conn, 'graph1', 'user2'), ([], ['B']))
+        conn.close()
+
+    def test_close(self):
+        # Test that the accounts left in the buffer are written when it is closed
+        self.buffer.put(self.db_file, '', [['graph1', 'user1', [], []]])
+        self.buffer.close(timeout=5)
+        self.assertEqual(self.buffer.stats()['written'], 1)
+
+        with self.assertRaises(RuntimeError):
+            self.buffer.put(self.db_file, '', [['graph1', 'user2', [], []]])
+
+class TestParseAccount(unittest.TestCase):
+    def test_parse_account(self):
+        # Test that posted accounts are converted to insert_accounts rows, and invalid ones rejected
+        self.assertEqual(parse_account({'graph': 'graph1', 'account': 'user1', 'followers': ['A', ' B ', ''], 'following': 'C, D'}), ['graph1', 'user1', ['A', 'B'], 'C, D'])
+        self.assertEqual(parse_account({'graph': 'graph1', 'account': 'user1'}), ['graph1', 'user1', [], []])
+        self.assertIsNone(parse_account({'graph': 'graph1', 'account': ' '}))
+        self.assertIsNone(parse_account({'graph': 'graph1', 'account': 'user1', 'followers': [1]}))
+        self.assertIsNone(parse_account(['graph1', 'user1']))
+
+    def test_parse_ndjson(self):
+        # Test that each non-empty line is decoded, with invalid lines decoded as None
+        lines = [json.dumps({'graph': 'graph1'}).encode('utf-8') + b'\n', b'\n', b'{invalid\n']
+        self.assertEqual(list(parse_ndjson(lines)), [{'graph': 'graph1'}, None])
+
+if __name__ == '__main__':
+    unittest.main()
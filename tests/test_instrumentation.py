@@ -0,0 +1,95 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import cProfile
+import pstats
+import tempfile
+import unittest
+from unittest.mock import patch
+from lib.instrumentation import Metrics, Recording, count, counted, observe_recording, record, stage, start_profiler, stop_profiler
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        # Test that histograms are rendered with cumulative buckets, and counters with a _total suffix
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.observe('stage_seconds', 0.05, stage='sql')
+        metrics.observe('stage_seconds', 0.5, stage='sql')
+        metrics.observe('stage_seconds', 5.0, stage='sql')
+        metrics.increment('uploaded_rows', 3)
+
+        self.assertEqual(metrics.render().splitlines(), [
+            '# TYPE graphexplore_stage_seconds histogram',
+            'graphexplore_stage_seconds_bucket{stage="sql",le="0.1"} 1',
+            'graphexplore_stage_seconds_bucket{stage="sql",le="1"} 2',
+            'graphexplore_stage_seconds_bucket{stage="sql",le="+Inf"} 3',
+            'graphexplore_stage_seconds_sum{stage="sql"} 5.55',
+            'graphexplore_stage_seconds_count{stage="sql"} 3',
+            '# TYPE graphexplore_uploaded_rows counter',
+            'graphexplore_uploaded_rows_total 3',
+        ])
+
+class TestRecording(unittest.TestCase):
+    def test_record(self):
+        # Test that stages and counts go to the active recording, and are ignored when there is none
+        metrics = Metrics()
+
+        with patch('lib.instrumentation.metrics', metrics):
+            with record() as recording:
+                with stage('sql'):
+                    pass
+
+                with stage('layout'):
+                    pass
+
+                with stage('sql'):
+                    pass
+
+                count('graph_edges', 10)
+
+            self.assertEqual([v[0] for v in recording.stages], ['sql', 'layout', 'sql'])
+            self.assertEqual(recording.counts, {'graph_edges': 10})
+            self.assertEqual(metrics.render(), '\n')
+
+            with stage('sql'):
+                pass
+
+            count('graph_edges', 10)
+            self.assertEqual(metrics.render(), '\n')
+            observe_recording(recording)
+
+        self.assertIn('graphexplore_stage_seconds_count{stage="sql"} 2', metrics.render())
+        self.assertIn('graphexplore_graph_edges_total 10', metrics.render())
+
+    def test_counted(self):
+        # Test that the values of a stream are counted once the stream is exhausted
+        with record() as recording:
+            self.assertEqual(list(counted(iter([1, 2, 3]), 'analyzed_edges')), [1, 2, 3])
+            self.assertEqual(list(counted([], 'analyzed_edges')), [])
+
+        self.assertEqual(recording.counts, {'analyzed_edges': 3})
+
+    def test_server_timing(self):
+        # Test that the durations of a stage are added up, in milliseconds, and that recordings can be serialized
+        recording = Recording([('sql', 0.001), ('layout', 0.25), ('sql', 0.002)], {'graph_edges': 10})
+        self.assertEqual(recording.server_timing(), 'sql;dur=3.0, layout;dur=250.0')
+        self.assertEqual(Recording.from_dict(recording.to_dict()).to_dict(), recording.to_dict())
+
+class TestProfiler(unittest.TestCase):
+    def test_profiler(self):
+        # Test that cProfile is used when pyinstrument is not requested, and its stats are saved to a .prof file
+        profiler = start_profiler('cprofile')
+        self.assertIsInstance(profiler, cProfile.Profile)
+        sum(range(1000))
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = stop_profiler(profiler, os.path.join(directory, 'profiles'), 'request')
+            self.assertEqual(path, os.path.join(directory, 'profiles', 'request.prof'))
+            self.assertGreater(pstats.Stats(path).total_calls, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import socket
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+from lib.instrumentation import Metrics, stage
+from lib.database import connect
+from lib.jobs import JobQueue, JobQueueFull
+
+def add(a, b):
+    return a + b
+
+def fail():
+    raise ValueError('bad input')
+
+def timed_add(a, b):
+    with stage('add'):
+        return a + b
+
+def wait(seconds):
+    time.sleep(seconds)
+
+    return seconds
+
+class TestJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.queue = JobQueue(os.path.join(self.directory.name, 'jobs.db'), max_workers=2, max_pending=2)
+
+    def tearDown(self):
+        self.queue.shutdown()
+        self.directory.cleanup()
+
+    def wait_for(self, job_id):
+        for i in range(200):
+            job = self.queue.get(job_id)
+
+            if job['status'] in ('done', 'failed'):
+                return job
+
+            time.sleep(0.05)
+
+        self.fail('job did not finish')
+
+    def test_submit(self):
+        # Test that a job runs in a worker process, and its result can be read once it is done
+        job_id = self.queue.submit(('graph1', 1), add, 1, 2)
+        job = self.wait_for(job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result'], 3)
+        self.assertEqual(job['key'], ('graph1', 1))
+        self.assertIsNone(self.queue.get('unknown'))
+
+    def test_submit_deduplicates(self):
+        # Test that a job with the same key returns the existing job, and a new graph version starts a new job
+        job_id = self.queue.submit(('graph1', 1), add, 1, 2)
+        self.assertEqual(self.queue.submit(('graph1', 1), add, 1, 2), job_id)
+        self.wait_for(job_id)
+        self.assertEqual(self.queue.submit(('graph1', 1), add, 1, 2), job_id)
+        self.assertNotEqual(self.queue.submit(('graph1', 2), add, 1, 2), job_id)
+
+    def test_submit_records_stages(self):
+        # Test that the stages timed in a worker process are added to the metrics of the submitting process
+        metrics = Metrics()
+
+        with patch('lib.instrumentation.metrics', metrics):
+            job = self.wait_for(self.queue.submit(('graph1', 1), timed_add, 1, 2))
+            self.assertEqual(job['result'], 3)
+
+            for i in range(100):
+                if 'stage="add"' in metrics.render():
+                    break
+
+                time.sleep(0.05)
+
+        self.assertIn('graphexplore_stage_seconds_count{stage="add"} 1', metrics.render())
+
+    def test_submit_failure(self):
+        # Test that an error is recorded, and a failed job can be submitted again
+        job_id = self.queue.submit(('graph1', 1), fail)
+        job = self.wait_for(job_id)
+        self.assertEqual(job['status'], 'failed')
+        self.assertIn('bad input', job['error'])
+        self.assertNotEqual(self.queue.submit(('graph1', 1), fail), job_id)
+
+    def test_submit_queue_full(self):
+        # Test that submissions are refused once the queue holds max_pending unfinished jobs
+        self.queue.submit(('graph1', 1), wait, 0.5)
+        self.queue.submit(('graph2', 1), wait, 0.5)
+
+        with self.assertRaises(JobQueueFull):
+            self.queue.submit(('graph3', 1), wait, 0.5)
+
+    def test_recover_interrupted_jobs(self):
+        # Test that a new queue on the same file only fails the unfinished jobs of processes that are no longer running
+        job_id = self.queue.submit(('graph1', 1), wait, 0.5)
+        conn = connect(self.queue.db_file)
+
+        with conn:
+            conn.execute("INSERT INTO jobs (id, key, status, created, owner) VALUES ('dead', 'dead', 'running', 0, ?)", (socket.gethostname() + ':2147483647:token',))
+            conn.execute("INSERT INTO jobs (id, key, status, created) VALUES ('old', 'old', 'queued', 0)")
+
+        conn.close()
+
+        queue = JobQueue(self.queue.db_file)
+        self.assertEqual(queue.get('dead')['error'], 'interrupted')
+        self.assertEqual(queue.get('old')['error'], 'interrupted')
+        self.assertIn(queue.get(job_id)['status'], ('queued', 'running'))
+        self.assertEqual(self.wait_for(job_id)['result'], 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import unittest
+import numpy as np
+import networkx as nx
+from lib.layout import (
+    compute_plot_layout,
+    filter_graph,
+    sparse_spectral_layout,
+    grid_force_layout
+)
+
+class TestComputePlotLayout(unittest.TestCase):
+    def setUp(self):
+        self.graph = nx.Graph()
+        self.graph.add_edges_from([("A", "X"), ("B", "X"), ("A", "Y"), ("B", "Z"), ("C", "Z")])
+        self.major_accounts = ["A", "B", "C"]
+
+    def test_compute_plot_layout(self):
+        # Test that every layout positions every node within the plot scale
+        for layout in ['circular_layout', 'spring_layout', 'spectral_layout', 'force_layout', '1']:
+            positions = compute_plot_layout(self.graph, self.major_accounts, layout=layout)
+            self.assertEqual(set(positions), set(self.graph.nodes))
+            self.assertLessEqual(np.abs(np.array(list(positions.values()))).max(), 10 + 1e-9)
+
+    def test_compute_plot_layout_filtered(self):
+        # Test that large graphs are reduced to a degree-filtered view
+        positions = compute_plot_layout(self.graph, self.major_accounts, max_nodes=4)
+        self.assertEqual(set(positions), {"A", "B", "C", "X"})
+
+    def test_filter_graph(self):
+        self.assertEqual(set(filter_graph(self.graph, self.major_accounts, max_nodes=5).nodes), {"A", "B", "C", "X", "Z"})
+
+class TestLayouts(unittest.TestCase):
+    def test_sparse_spectral_layout(self):
+        graph = nx.path_graph(10)
+        positions = sparse_spectral_layout(graph)
+        self.assertEqual(positions.shape, (10, 2))
+        # the first non-trivial eigenvector of a path orders its nodes monotonically
+        self.assertTrue(np.all(np.diff(positions[:, 0]) > 0) or np.all(np.diff(positions[:, 0]) < 0))
+
+    def test_grid_force_layout(self):
+        graph = nx.barabasi_albert_graph(300, 2, seed=1)
+        positions = grid_force_layout(graph, iterations=20, chunk_size=64)
+        self.assertEqual(positions.shape, (300, 2))
+        self.assertTrue(np.all(np.isfinite(positions)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import unittest
+import numpy as np
+from lib.render import (
+    RASTER_EDGE_THRESHOLD,
+    WEBGL_EDGE_THRESHOLD,
+    resolve_render_mode,
+    rasterize_edges
+)
+
+class TestResolveRenderMode(unittest.TestCase):
+    def test_resolve_render_mode(self):
+        # Test that the automatic mode depends on the number of edges, and explicit modes are kept
+        self.assertEqual(resolve_render_mode('auto', WEBGL_EDGE_THRESHOLD), 'canvas')
+        self.assertEqual(resolve_render_mode('auto', WEBGL_EDGE_THRESHOLD + 1), 'webgl')
+        self.assertEqual(resolve_render_mode('auto', RASTER_EDGE_THRESHOLD + 1), 'raster')
+        self.assertEqual(resolve_render_mode('raster', 1), 'raster')
+        self.assertEqual(resolve_render_mode('1', RASTER_EDGE_THRESHOLD + 1), 'canvas')
+
+class TestRasterizeEdges(unittest.TestCase):
+    def test_rasterize_edges(self):
+        # Test that a horizontal and a vertical edge shade one row and one column, with the crossing pixel darkest
+        x0, y0 = np.array([0.0, 5.0]), np.array([5.0, 0.0])
+        x1, y1 = np.array([10.0, 5.0]), np.array([5.0, 10.0])
+        image = rasterize_edges(x0, y0, x1, y1, (0, 10), (0, 10), width=11, height=11)
+        self.assertEqual(image.shape, (11, 11))
+        self.assertEqual(image.dtype, np.uint8)
+        self.assertTrue((image[5] > 0).all())
+        self.assertTrue((image[:, 5] > 0).all())
+        self.assertEqual(image[5, 5], 255)
+        self.assertEqual(np.count_nonzero(image), 21)
+
+    def test_rasterize_edges_outside_range(self):
+        image = rasterize_edges(np.array([20.0]), np.array([20.0]), np.array([30.0]), np.array([30.0]), (0, 10), (0, 10), width=5, height=5)
+        self.assertEqual(np.count_nonzero(image), 0)
+
+if __name__ == '__main__':
+    unittest.main()
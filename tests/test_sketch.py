@@ -0,0 +1,90 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import collections
+import unittest
+import numpy as np
+from lib.sketch import CountMinSketch, HeavyHitters, MinHash, hash_names, get_edge_weights_sketch, get_seed_signatures, seed_similarities
+
+class TestCountMinSketch(unittest.TestCase):
+    def test_estimate(self):
+        # Test that estimates are never below the true counts, and are exact when there are few keys
+        names = ['account' + str(i % 50) for i in range(1000)] + ['popular'] * 500
+        sketch = CountMinSketch(width=1024, depth=4)
+        sketch.add(hash_names(names))
+        counts = collections.Counter(names)
+        estimates = sketch.estimate(hash_names(list(counts)))
+        self.assertEqual(estimates.tolist(), list(counts.values()))
+
+        sketch = CountMinSketch(width=16, depth=2)
+        sketch.add(hash_names(names))
+        self.assertTrue((sketch.estimate(hash_names(list(counts))) >= np.array(list(counts.values()))).all())
+        self.assertEqual(sketch.total, 1500)
+
+    def test_width_power_of_two(self):
+        with self.assertRaises(ValueError):
+            CountMinSketch(width=1000)
+
+class TestHeavyHitters(unittest.TestCase):
+    def test_heavy_hitters(self):
+        # Test that the most frequent keys are kept, with counts below the true counts by at most the error bound
+        names = ['rare' + str(i) for i in range(2000)] + ['popular'] * 300 + ['common'] * 200
+        np.random.default_rng(0).shuffle(names)
+        heavy_hitters = HeavyHitters(capacity=10)
+
+        for start in range(0, len(names), 100):
+            heavy_hitters.add(hash_names(names[start:start + 100]), names[start:start + 100])
+
+        counts = dict(zip([heavy_hitters.names[k] for k in heavy_hitters.keys.tolist()], heavy_hitters.counts.tolist()))
+        self.assertLessEqual(len(counts), 10)
+        self.assertGreaterEqual(counts['popular'], 300 - heavy_hitters.error_bound())
+        self.assertGreaterEqual(counts['common'], 200 - heavy_hitters.error_bound())
+        self.assertLessEqual(counts['popular'], 300)
+
+class TestMinHash(unittest.TestCase):
+    def test_similarity(self):
+        # Test that the fraction of equal signature values estimates the Jaccard similarity
+        minhash = MinHash(size=256)
+        signatures = []
+
+        for names in (['a' + str(i) for i in range(0, 3000)], ['a' + str(i) for i in range(1000, 4000)]):
+            signature = minhash.empty()
+            minhash.update(signature, hash_names(names))
+            signatures.append(signature)
+
+        self.assertAlmostEqual((signatures[0] == signatures[1]).mean(), 2000 / 4000, delta=0.1)
+
+class TestEdgeWeightsSketch(unittest.TestCase):
+    def setUp(self):
+        self.graph_edges = [("A", "X"), ("B", "X"), ("C", "X"), ("A", "Y"), ("B", "Y"), ("A", "B"), ("C", "Z"), ("C", "Z")]
+        self.major_accounts = ["A", "B", "C"]
+
+    def test_get_edge_weights_sketch(self):
+        # Test that the link counts of the accounts are found in small batches, without the graph's accounts
+        self.assertEqual(get_edge_weights_sketch(iter(self.graph_edges), self.major_accounts, threshold=0, batch_size=3), [('X', 3), ('Y', 2), ('Z', 2)])
+        self.assertEqual(get_edge_weights_sketch(self.graph_edges, self.major_accounts, threshold=2), [('X', 3)])
+        self.assertEqual(get_edge_weights_sketch(self.graph_edges, self.major_accounts, threshold=0, top_k=1), [('X', 3)])
+
+        with self.assertRaises(ValueError):
+            get_edge_weights_sketch(self.graph_edges, self.major_accounts, mode='uncommon')
+
+    def test_get_edge_weights_sketch_fixed_capacity(self):
+        # Test that the most linked accounts are found among many rarely linked ones
+        graph_edges = [('seed' + str(i), 'popular') for i in range(100)] + [('seed' + str(i), 'account' + str(i * 10 + j)) for i in range(100) for j in range(10)]
+        self.assertEqual(get_edge_weights_sketch(graph_edges, [], threshold=1, capacity=8, batch_size=64), [('popular', 100)])
+
+    def test_seed_similarities(self):
+        # Test that seeds with the same linked accounts have a similarity of 1, and seeds without shared links of 0
+        graph_edges = [('A', 'X'), ('A', 'Y'), ('B', 'Y'), ('B', 'X'), ('C', 'Z')]
+        signatures = get_seed_signatures(iter(graph_edges), batch_size=3)
+        self.assertEqual(list(signatures), ['A', 'B', 'C'])
+        self.assertEqual(seed_similarities(signatures, top_k=1), [('A', 'B', 1.0)])
+        self.assertEqual(seed_similarities(signatures)[-1][2], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
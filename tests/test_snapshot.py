@@ -0,0 +1,107 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from lib.database import connect, initialise_database, insert_account, get_account_store, get_graph_edges
+from lib.snapshot import Snapshot, load_snapshot, get_edge_weights_snapshot
+from lib.sparse import get_edge_weights_store
+
+class TestSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.conn = connect(os.path.join(self.directory.name, 'test.db'))
+        initialise_database(self.conn)
+        insert_account(self.conn, 'graph1', 'A', ['X', 'Y', 'B'], ['X', 'Z', 'Z'])
+        insert_account(self.conn, 'graph1', 'B', ['X', 'é'], ['Y'])
+        insert_account(self.conn, 'graph1', 'C', [], ['X'])
+        insert_account(self.conn, 'graph2', 'D', ['X'], [])
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+        self.directory.cleanup()
+
+    def test_load_snapshot(self):
+        # Test that the snapshot holds the graph's accounts and links, in memory-mapped CSR arrays
+        snapshot = load_snapshot(self.conn, 'graph1')
+        self.assertEqual(os.path.dirname(snapshot.path), os.path.join(self.directory.name, 'snapshots'))
+        self.assertEqual([snapshot.names[i] for i in snapshot.accounts], ['A', 'B', 'C'])
+
+        offsets, targets, weights = snapshot.links('following')
+        self.assertIsInstance(targets, np.memmap)
+        pairs = [(snapshot.names[i], snapshot.names[targets[j]], weights[j]) for i in range(len(snapshot)) for j in range(offsets[i], offsets[i + 1])]
+        self.assertEqual(sorted(pairs), [('A', 'X', 1), ('A', 'Z', 2), ('B', 'Y', 1), ('C', 'X', 1)])
+
+        offsets, targets, weights = snapshot.links('followers')
+        pairs = sorted((snapshot.names[i], snapshot.names[targets[j]]) for i in range(len(snapshot)) for j in range(offsets[i], offsets[i + 1]))
+        self.assertEqual(pairs, sorted(get_graph_edges(self.conn, 'graph1', 'followers')))
+
+    def test_load_snapshot_rebuilt(self):
+        # Test that the snapshot is reused until the graph changes, and then rebuilt in place of the old one, which
+        # stays readable by the processes that still have it open
+        old_snapshot = load_snapshot(self.conn, 'graph1')
+        path = old_snapshot.path
+        self.assertEqual(load_snapshot(self.conn, 'graph1').path, path)
+
+        insert_account(self.conn, 'graph1', 'E', ['W'], [])
+        self.conn.commit()
+
+        snapshot = load_snapshot(self.conn, 'graph1')
+        self.assertNotEqual(snapshot.path, path)
+        self.assertFalse(os.path.exists(path))
+        self.assertIn('E', [snapshot.names[i] for i in snapshot.accounts])
+        self.assertEqual(len(os.listdir(os.path.join(self.directory.name, 'snapshots'))), 1)
+        self.assertEqual(len(old_snapshot.links('followers')[1]), 5)
+
+    def test_load_snapshot_keeps_newer(self):
+        # Test that building the snapshot of a version never removes the snapshot of a newer version
+        path = load_snapshot(self.conn, 'graph1').path
+        newer_path = path[:path.rindex('-v') + 2] + '1000'
+        shutil.copytree(path, newer_path)
+
+        insert_account(self.conn, 'graph1', 'E', ['W'], [])
+        self.conn.commit()
+
+        load_snapshot(self.conn, 'graph1')
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(os.path.isdir(newer_path))
+
+    def test_load_snapshot_tenants(self):
+        # Test that the tenants of a shared database file get separate snapshots of graphs with the same name
+        conn = connect(os.path.join(self.directory.name, 'test.db'), 'tenant1')
+        insert_account(conn, 'graph1', 'F', ['W'], [])
+        conn.commit()
+
+        snapshot = load_snapshot(conn, 'graph1')
+        self.assertNotEqual(snapshot.path, load_snapshot(self.conn, 'graph1').path)
+        self.assertEqual([snapshot.names[i] for i in snapshot.accounts], ['F'])
+        conn.close()
+
+    def test_load_snapshot_in_memory(self):
+        conn = connect(':memory:')
+
+        with self.assertRaises(ValueError):
+            load_snapshot(conn, 'graph1')
+
+    def test_get_edge_weights_snapshot(self):
+        # Test that the snapshot gives the same ranking as the AccountStore it was built from
+        snapshot = Snapshot(load_snapshot(self.conn, 'graph1').path)
+        store = get_account_store(self.conn, 'graph1')
+
+        for connection_type in ['followers', 'following']:
+            for mode, threshold, top_n in [('common', 0, None), ('common', 1, None), ('uncommon', 1, None), ('common', 0, 1), ('adamic_adar', 0, None), ('pagerank', 0, 2)]:
+                self.assertEqual(get_edge_weights_snapshot(snapshot, connection_type, mode=mode, threshold=threshold, top_n=top_n),
+                                 get_edge_weights_store(store, connection_type, mode=mode, threshold=threshold, top_n=top_n))
+
+        self.assertEqual(get_edge_weights_snapshot(snapshot, 'followers', mode='common', threshold=0, top_k=1), [('X', 2)])
+
+if __name__ == '__main__':
+    unittest.main()
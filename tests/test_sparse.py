@@ -0,0 +1,103 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import math
+import unittest
+import networkx as nx
+from lib.account import AccountStore
+from lib.functions import reduce_graph, get_edge_weights, get_similar_accounts
+from lib.sparse import (
+    AccountIndex,
+    build_bipartite_matrix,
+    candidate_degrees,
+    shared_counts,
+    similarity_scores,
+    get_edge_weights_sparse,
+    get_edge_weights_store,
+    get_similar_accounts_sparse
+)
+
+class TestAccountIndex(unittest.TestCase):
+    def test_account_index(self):
+        index = AccountIndex(["A", "B"])
+        self.assertEqual(list(index.add_many(["B", "C", "A"])), [1, 2, 0])
+        self.assertEqual(index.names, ["A", "B", "C"])
+
+class TestBipartiteMatrix(unittest.TestCase):
+    def setUp(self):
+        self.major_accounts = ["A", "B", "C"]
+        self.graph_edges = [("A", "X"), ("B", "X"), ("C", "X"), ("A", "Y"), ("B", "Y"), ("A", "B"), ("C", "Z"), ("C", "Z")]
+
+    def test_build_bipartite_matrix(self):
+        matrix, seed_index, candidate_index = build_bipartite_matrix(self.graph_edges, self.major_accounts)
+        self.assertEqual(matrix.shape, (3, 3))
+        self.assertEqual(candidate_index.names, ["X", "Y", "Z"])
+        self.assertEqual(list(candidate_degrees(matrix)), [3, 2, 1])
+
+    def test_shared_counts(self):
+        matrix, _, _ = build_bipartite_matrix(self.graph_edges, self.major_accounts)
+        self.assertEqual(shared_counts(matrix).toarray().tolist(), [[2, 2, 1], [2, 2, 1], [1, 1, 2]])
+
+    def test_get_edge_weights_sparse_matches_networkx(self):
+        for mode, threshold, top_n in [('common', 1, None), ('uncommon', 1, None), ('common', 0, 2), ('common', 0, None)]:
+            g = nx.Graph()
+            g.add_edges_from(reduce_graph(self.graph_edges, self.major_accounts, mode=mode, threshold=threshold, top_n=top_n))
+            expected_result = get_edge_weights(g, self.major_accounts)
+            self.assertEqual(get_edge_weights_sparse(self.graph_edges, self.major_accounts, mode=mode, threshold=threshold, top_n=top_n), expected_result)
+
+    def test_similarity_scores(self):
+        # Every seed links to 2 candidates, and X, Y and Z are linked to by 3, 2 and 1 seeds (Z twice by C)
+        matrix, _, _ = build_bipartite_matrix(self.graph_edges, self.major_accounts)
+
+        for actual, expected in [(similarity_scores(matrix, 'jaccard'), [3 / 4, 2 / 3, 1 / 2]),
+                                 (similarity_scores(matrix, 'adamic_adar'), [3 / math.log(3), 2 / math.log(3), 1 / math.log(3)]),
+                                 (similarity_scores(matrix, 'tfidf'), [1.5, 1.0 * (math.log(4 / 3) + 1), 0.5 * (math.log(2) + 1)])]:
+            for a, b in zip(actual, expected):
+                self.assertAlmostEqual(a, b)
+
+    def test_similarity_scores_pagerank_matches_networkx(self):
+        matrix, seed_index, candidate_index = build_bipartite_matrix(self.graph_edges, self.major_accounts)
+        g = nx.Graph()
+        g.add_edges_from((k, v) for k, v in self.graph_edges if v not in self.major_accounts)
+        expected_result = nx.pagerank(g, alpha=0.85, personalization={v: 1 for v in self.major_accounts}, max_iter=1000, tol=1e-12)
+
+        for name, score in zip(candidate_index.names, similarity_scores(matrix, 'pagerank')):
+            self.assertAlmostEqual(score, expected_result[name])
+
+    def test_get_edge_weights_sparse_scoring(self):
+        # Test that the scoring modes select the accounts to score in the same way as the common mode
+        self.assertEqual([v[0] for v in get_edge_weights_sparse(self.graph_edges, self.major_accounts, mode='jaccard', threshold=1)], ['X', 'Y', 'Z'])
+        self.assertEqual([v[0] for v in get_edge_weights_sparse(self.graph_edges, self.major_accounts, mode='tfidf', threshold=2)], ['X'])
+        self.assertEqual([v[0] for v in get_edge_weights_sparse(self.graph_edges, self.major_accounts, mode='pagerank', threshold=0, top_k=1)], ['X'])
+
+    def test_get_edge_weights_store_matches_sparse(self):
+        store = AccountStore()
+
+        for account_name in self.major_accounts:
+            store.add(account_name)
+
+        store.add_edges(self.graph_edges, 'following')
+
+        for mode, threshold, top_n in [('common', 1, None), ('uncommon', 1, None), ('common', 0, 2), ('common', 0, None)]:
+            expected_result = get_edge_weights_sparse(self.graph_edges, self.major_accounts, mode=mode, threshold=threshold, top_n=top_n)
+            self.assertEqual(get_edge_weights_store(store, 'following', mode=mode, threshold=threshold, top_n=top_n), expected_result)
+
+    def test_get_edge_weights_sparse_top_k(self):
+        self.assertEqual(get_edge_weights_sparse(self.graph_edges, self.major_accounts, mode='common', threshold=0, top_k=1), [("X", 3)])
+        self.assertEqual(get_edge_weights_sparse(self.graph_edges, self.major_accounts, mode='common', threshold=0, top_k=0), [])
+
+    def test_get_similar_accounts_sparse(self):
+        following_edges = [("A", "B"), ("A", "C")]
+        follower_edges = [("A", "B"), ("A", "D")]
+        following_graph = nx.Graph(following_edges)
+        follower_graph = nx.Graph(follower_edges)
+        expected_result = get_similar_accounts(following_graph, follower_graph, ["A"], 0.5)
+        self.assertEqual(get_similar_accounts_sparse(following_edges, follower_edges, ["A"], 0.5), expected_result)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import sys
+import os
+
+cwd = os.getcwd()
+
+# Add the parent directory to sys.path
+sys.path.append(cwd)
+
+import tempfile
+import unittest
+from lib.database import connect, initialise_database, insert_account, get_account_connections, get_candidate_counts, get_graph_names, get_graph_version
+from lib.snapshot import get_edge_weights_snapshot, load_snapshot
+from lib.storage import FileStorage, SharedStorage, get_storage, migrate_database, tenant_name
+
+class TestStorage(unittest.TestCase):
+    def test_locate(self):
+        # Test that a file storage keeps one database file per tenant, and a shared storage one file for every tenant
+        self.assertEqual(FileStorage('database').locate('127.0.0.1'), (os.path.join('database', '127.0.0.1database.db'), ''))
+        self.assertEqual(SharedStorage('database/shared.db').locate('127.0.0.1'), ('database/shared.db', '127.0.0.1'))
+
+        with self.assertRaises(ValueError):
+            FileStorage().locate('../tenant')
+
+    def test_get_storage(self):
+        self.assertIsInstance(get_storage('files'), FileStorage)
+        self.assertEqual(get_storage('shared', 'shared.db').db_file, 'shared.db')
+
+        with self.assertRaises(ValueError):
+            get_storage('unknown')
+
+    def test_tenant_name(self):
+        self.assertEqual(tenant_name('database/127.0.0.1database.db'), '127.0.0.1')
+
+        with self.assertRaises(ValueError):
+            tenant_name('database/jobs.db')
+
+class TestMigrateDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.db_file = os.path.join(self.directory.name, 'shared.db')
+        self.source_files = []
+
+        for tenant, followers in [('10.0.0.1', ['X']), ('10.0.0.2', ['X', 'Y'])]:
+            source_file = os.path.join(self.directory.name, tenant + 'database.db')
+            conn = connect(source_file)
+            initialise_database(conn)
+            insert_account(conn, 'graph1', 'A', followers, ['Z'])
+            insert_account(conn, 'graph1', 'B', ['X'], [])
+            conn.commit()
+            conn.close()
+            self.source_files.append(source_file)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_migrate_database(self):
+        # Test that each file is copied under its own tenant, and that migrating a file again replaces its rows
+        for source_file in self.source_files + self.source_files[:1]:
+            self.assertEqual(migrate_database(source_file, self.db_file), 2)
+
+        for tenant, followers, version in [('10.0.0.1', ['X'], 3), ('10.0.0.2', ['X', 'Y'], 2)]:
+            conn = connect(self.db_file, tenant)
+            self.assertEqual(get_graph_names(conn), ['graph1'])
+            self.assertEqual(get_account_connections(conn, 'graph1', 'A'), (followers, ['Z']))
+            self.assertEqual(get_graph_version(conn, 'graph1'), version)
+            counts = get_candidate_counts(conn, 'graph1', 'followers', mode='common', threshold=0)
+
+            # the copied counts are kept up to date by the triggers, as if the rows had been inserted
+            insert_account(conn, 'graph1', 'C', ['X'], [])
+            self.assertEqual(get_candidate_counts(conn, 'graph1', 'followers', mode='common', threshold=0), [('X', counts[0][1] + 1)] + counts[1:])
+            conn.close()
+
+        self.assertEqual(connect(self.db_file).execute("SELECT COUNT(*) FROM accounts").fetchone()[0], 4)
+
+    def test_migrate_database_again(self):
+        # Test that migrating a changed file again gives its graphs a new version, even if the graph was changed in the
+        # shared file as many times, so that the analysis of the replaced rows is not reused
+        migrate_database(self.source_files[0], self.db_file)
+        conn = connect(self.db_file, '10.0.0.1')
+        insert_account(conn, 'graph1', 'D', ['W'], [])
+        conn.commit()
+        self.assertEqual(get_edge_weights_snapshot(load_snapshot(conn, 'graph1'), 'followers', mode='common', threshold=0), [('X', 2), ('W', 1)])
+        version = get_graph_version(conn, 'graph1')
+
+        source = connect(self.source_files[0])
+        insert_account(source, 'graph1', 'C', ['Y'], [])
+        source.commit()
+        self.assertEqual(get_graph_version(source, 'graph1'), version)
+        source.close()
+
+        migrate_database(self.source_files[0], self.db_file)
+        self.assertGreater(get_graph_version(conn, 'graph1'), version)
+        self.assertEqual(get_edge_weights_snapshot(load_snapshot(conn, 'graph1'), 'followers', mode='common', threshold=0), [('X', 2), ('Y', 1)])
+        conn.close()
+
+if __name__ == '__main__':
+    unittest.main()